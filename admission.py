@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import itertools
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+# ---------------------------------------------------------
+# Admission control หน้า endpoint ที่ต้องเรียก LLM (/chat, /chat/stream)
+# ช่วงใกล้ปิดลงทะเบียน request เข้ามาเกินโควตา Groq มาก ถ้ารับหมดแล้วให้รอ ทุกคน timeout พร้อมกัน
+# - token bucket ต่อ client: คนเดียวยิงรัวๆ ได้ 429 ไม่ไปกินคิวของคนอื่น
+# - งาน LLM ทำพร้อมกันได้ max_active งาน ที่เหลือรอในคิวจำกัดขนาด + จำกัดเวลารอ
+# - คิวเรียงตาม priority: งานสร้างไฟล์ก่อนคำถามทั่วไป, คิวเต็มแล้วงานสำคัญกว่ามา เบียดตัวท้ายออก
+# - คาดว่ารอเกิน max_wait แน่ๆ (จากเวลาที่แต่ละงานถือ slot ล่าสุด) ตอบ 503 ทันที ไม่ต้องรอจนหมดเวลา
+# งานถูกๆ (ตอบจาก answer cache / ดาวน์โหลดไฟล์) ไม่เข้าคิว เสียแค่ token ส่วนน้อยของ bucket
+# ค่าทั้งหมดเป็นต่อ process (รันผ่าน serve.py หลาย worker = คูณตามจำนวน worker)
+# ---------------------------------------------------------
+
+# เลขน้อย = ได้ก่อน
+PRIORITY_CHEAP = 0  # answer cache hit / ดาวน์โหลด: ไม่ต้องรอ slot
+PRIORITY_FILE = 1   # โหมดสร้างไฟล์: ผู้ใช้ให้ข้อมูลมาครบแล้ว เรียก LLM สั้นๆ ไม่เกินสองครั้ง
+PRIORITY_CHAT = 2   # คำถามใหม่: ค้น + ให้ Advisor ตอบ
+PRIORITY_NAMES = {PRIORITY_CHEAP: "cheap", PRIORITY_FILE: "file", PRIORITY_CHAT: "chat"}
+
+ADMISSIONS = metrics.REGISTRY.register(metrics.Counter(
+    "admission_total",
+    "Requests by priority and admission outcome (admitted, rate_limited, queue_full, evicted, shed, expired)",
+    ("priority", "outcome"),
+))
+ADMISSION_WAIT = metrics.REGISTRY.register(metrics.Histogram(
+    "admission_wait_seconds", "Time spent in the admission queue before getting a slot", ("priority",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15),
+))
+
+
+class Rejected(Exception):
+    """ไม่รับ request นี้ ให้ endpoint ตอบ status นี้ + Retry-After"""
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class ClientRateLimiter:
+    """token bucket ต่อ client (rate token/วินาที, สะสมได้สูงสุด burst) จำ client ล่าสุดไม่เกิน max_clients"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets: "collections.OrderedDict[str, List[float]]" = collections.OrderedDict()
+
+    def take(self, client: str, cost: float = 1.0, priority: int = PRIORITY_CHAT) -> None:
+        """หัก token ของ client ไม่พอ = raise Rejected(429) พร้อมเวลาที่ต้องรอจน token พอ"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.pop(client, None)
+        if bucket is None:
+            bucket = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        self._buckets[client] = bucket
+        bucket[1] = now
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        if tokens < cost:
+            bucket[0] = tokens
+            self.limited += 1
+            ADMISSIONS.inc(priority=PRIORITY_NAMES[priority], outcome="rate_limited")
+            raise Rejected(429, "rate_limited", (cost - tokens) / self.rate)
+        bucket[0] = tokens - cost
+
+    def refund(self, client: str, cost: float = 1.0) -> None:
+        """คืน token ที่ take() หักไป เมื่อ request ไม่ได้ทำงานจริง (เช่น คิวปฏิเสธ / client ตัดระหว่างรอ)"""
+        bucket = self._buckets.get(client)
+        if self.rate > 0 and bucket is not None:
+            bucket[0] = min(self.burst, bucket[0] + cost)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"clients": len(self._buckets), "rate_limited": self.limited}
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future")
+
+    def __init__(self, priority: int, seq: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+
+    @property
+    def order(self) -> tuple:
+        return (self.priority, self.seq)
+
+
+class Slot:
+    """สิทธิ์ทำงาน LLM หนึ่งงาน คืนด้วย release() (เรียกซ้ำได้ ใช้กับ stream ที่อาจจบได้หลายทาง)"""
+
+    def __init__(self, queue: Optional["AdmissionQueue"]):
+        self._queue = queue
+        self._started = time.monotonic()
+
+    def release(self) -> None:
+        if self._queue is not None:
+            queue, self._queue = self._queue, None
+            queue.release(time.monotonic() - self._started)
+
+
+class AdmissionQueue:
+    """จำกัดงาน LLM ที่ทำพร้อมกัน ที่เกินรอในคิวตาม priority (คิว/เวลารอจำกัด เกิน = Rejected(503))"""
+
+    def __init__(self, max_active: int, max_queue: int, max_wait: float):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.rejected = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # เวลาถือ slot เฉลี่ยแบบ EWMA (None = ยังไม่มีข้อมูล ยังไม่ทำนายเวลารอ)
+        self.avg_hold: Optional[float] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self, priority: int) -> Optional[float]:
+        """เวลารอโดยประมาณถ้าเข้าคิวตอนนี้ (งานที่ priority เท่ากันหรือดีกว่าได้ไปก่อน)"""
+        if self.avg_hold is None:
+            return None
+        ahead = sum(1 for w in self._waiters if w.priority <= priority)
+        return (ahead + 1) * self.avg_hold / self.max_active
+
+    def _reject(self, priority: int, outcome: str, retry_after: float) -> Rejected:
+        self.rejected += 1
+        ADMISSIONS.inc(priority=PRIORITY_NAMES[priority], outcome=outcome)
+        return Rejected(503, outcome, retry_after)
+
+    async def acquire(self, priority: int) -> Slot:
+        if self.max_active <= 0:
+            return Slot(None)
+        name = PRIORITY_NAMES[priority]
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            ADMISSIONS.inc(priority=name, outcome="admitted")
+            ADMISSION_WAIT.observe(0, priority=name)
+            return Slot(self)
+
+        expected = self.expected_wait(priority)
+        if expected is not None and expected > self.max_wait:
+            raise self._reject(priority, "shed", expected)
+        if len(self._waiters) >= self.max_queue:
+            worst = max(self._waiters, key=lambda w: w.order, default=None)
+            if worst is None or worst.priority <= priority:
+                raise self._reject(priority, "queue_full", expected or self.max_wait)
+            # งานที่สำคัญกว่ามาตอนคิวเต็ม: เบียดงานที่ priority แย่สุดและเข้าคิวล่าสุดออก
+            self._waiters.remove(worst)
+            worst.future.set_exception(
+                self._reject(worst.priority, "evicted", self.expected_wait(worst.priority) or self.max_wait)
+            )
+
+        waiter = _Waiter(priority, next(self._seq), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        enqueued = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter.future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            raise self._reject(priority, "expired", self.expected_wait(priority) or self.max_wait)
+        except asyncio.CancelledError:
+            # client ตัดไปตอนได้ slot พอดี ส่ง slot ต่อให้คนถัดไป
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self.release(None)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        ADMISSIONS.inc(priority=name, outcome="admitted")
+        ADMISSION_WAIT.observe(time.monotonic() - enqueued, priority=name)
+        return Slot(self)
+
+    def release(self, held: Optional[float]) -> None:
+        if held is not None:
+            self.avg_hold = held if self.avg_hold is None else 0.8 * self.avg_hold + 0.2 * held
+        # ส่ง slot ต่อให้งานที่ priority ดีสุด (มาก่อนได้ก่อน) โดยไม่คืนเข้ากองกลาง กันงานใหม่แซงคิว
+        while self._waiters:
+            waiter = min(self._waiters, key=lambda w: w.order)
+            self._waiters.remove(waiter)
+            if not waiter.future.done():
+                waiter.future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        queued = {name: 0 for p, name in PRIORITY_NAMES.items() if p != PRIORITY_CHEAP}
+        for waiter in self._waiters:
+            queued[PRIORITY_NAMES[waiter.priority]] += 1
+        return {
+            "active": self.active,
+            "max_active": self.max_active,
+            "queue_depth": self.depth,
+            "max_queue": self.max_queue,
+            "queued": queued,
+            "rejected": self.rejected,
+            "avg_hold_s": round(self.avg_hold or 0.0, 4),
+        }
@@ -0,0 +1,164 @@
+import math
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from forms import FORM_MASTER_DATA, FORM_BY_ID, form_id_for_source
+import metrics
+
+# ---------------------------------------------------------
+# ประกอบ context ให้ Advisor ภายใต้งบ token
+# - ลำดับความสำคัญ: ฟอร์มที่ keyword ตรง > chunk จาก Vector DB (ตามอันดับ) > ฟอร์มที่ chunk อ้างถึง
+#   ไม่เจอฟอร์มที่เกี่ยวเลย ค่อยใส่รายการฟอร์มทั้งหมด (เท่าที่งบเหลือ)
+# - chunk ที่ splitter ตัดซ้อนกัน (chunk_overlap=50) หรือซ้ำกัน รวมเป็นก้อนเดียวก่อนนับ token
+# - นับ token แบบประมาณ (ไม่มี tokenizer ของ Llama ใน process) เผื่อภาษาไทยไว้สูงกว่าอังกฤษ
+# ---------------------------------------------------------
+
+# ช่วงที่ซ้อนกันต้องยาวอย่างน้อยเท่านี้ถึงจะถือว่าเป็น chunk ต่อกัน (กันชนคำสั้นๆ ที่บังเอิญตรง)
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 200
+# เหลืองบน้อยกว่านี้ ไม่ตัด chunk มาใส่ครึ่งๆ
+MIN_PARTIAL_TOKENS = 48
+
+FORM_CODE_IN_TEXT_RE = re.compile(r"(?:RO|สทน)\s*[.\-]?\s*(\d{2})", re.IGNORECASE)
+
+CONTEXT_CHUNKS = metrics.REGISTRY.register(metrics.Counter(
+    "advisor_context_chunks_total", "Retrieved chunks by what the context packer did with them", ("outcome",)
+))
+CONTEXT_TOKENS = metrics.REGISTRY.register(metrics.Histogram(
+    "advisor_context_tokens", "Estimated tokens of packed advisor context",
+    buckets=(0, 50, 100, 200, 400, 600, 800, 1000, 1500, 2000, 3000),
+))
+
+
+def estimate_tokens(text: str) -> int:
+    """ประมาณจำนวน token: ASCII ~4 ตัวอักษร/token, ไทยและอักษรอื่น ~2 ตัวอักษร/token"""
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+
+def catalogue_line(item: Dict[str, Any], with_url: bool = True) -> str:
+    line = f"- {item['name']} (รหัส: {item['id']})"
+    return f"{line} ดาวน์โหลด: {item['url']}" if with_url else line
+
+
+def _overlap(left: str, right: str) -> int:
+    """ความยาวที่ท้าย left ซ้ำกับต้น right (0 = ไม่ต่อกัน)"""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_chunks(texts: Iterable[str]) -> List[str]:
+    """รวม chunk ที่ซ้ำ/ซ้อนกัน คงลำดับของ chunk ที่เจอก่อน (อันดับค้นหาดีกว่า)"""
+    merged: List[str] = []
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        for i, kept in enumerate(merged):
+            if text in kept:
+                break
+            if kept in text:
+                merged[i] = text
+                break
+            size = _overlap(kept, text)
+            if size:
+                merged[i] = kept + text[size:]
+                break
+            size = _overlap(text, kept)
+            if size:
+                merged[i] = text + kept[size:]
+                break
+        else:
+            merged.append(text)
+            continue
+        CONTEXT_CHUNKS.inc(outcome="merged")
+    return merged
+
+
+def forms_in_documents(docs: Sequence[Any]) -> List[Dict[str, Any]]:
+    """ฟอร์มที่ chunk อ้างถึง (form_id / URL ต้นทางใน metadata หรือรหัส RO.xx ในเนื้อความ)"""
+    found: Dict[str, Dict[str, Any]] = {}
+    for doc in docs:
+        metadata = getattr(doc, "metadata", None) or {}
+        item = FORM_BY_ID.get(metadata.get("form_id") or form_id_for_source(metadata.get("source")))
+        if item is not None:
+            found.setdefault(item["id"], item)
+        for number in FORM_CODE_IN_TEXT_RE.findall(getattr(doc, "page_content", "")):
+            item = FORM_BY_ID.get(f"RO.{number}")
+            if item is not None:
+                found.setdefault(item["id"], item)
+    return list(found.values())
+
+
+def _truncate(text: str, tokens: int) -> str:
+    # ตัดตามสัดส่วนจนเข้างบ (ประมาณการเป็นเชิงเส้นอยู่แล้ว วนไม่กี่รอบ)
+    while text and estimate_tokens(text + " …") > tokens:
+        text = text[: max(0, int(len(text) * tokens / estimate_tokens(text + " …")) - 1)]
+    return text.rstrip() + " …" if text else ""
+
+
+def pack_context(
+    matched_forms: Sequence[Dict[str, Any]],
+    docs: Sequence[Any],
+    budget: int,
+) -> str:
+    """ประกอบ context จากฟอร์มที่ keyword ตรง + chunk ที่ค้นได้ ให้ไม่เกิน budget token"""
+    sections: List[str] = []
+    used = 0
+
+    def add(text: str, partial: bool = False) -> bool:
+        nonlocal used
+        cost = estimate_tokens(text) + 1  # +1 = ขึ้นบรรทัดใหม่
+        if used + cost > budget:
+            if not partial or budget - used < MIN_PARTIAL_TOKENS:
+                return False
+            text = _truncate(text, budget - used - 1)
+            cost = estimate_tokens(text) + 1
+        sections.append(text)
+        used += cost
+        return True
+
+    def add_group(header: str, texts: Sequence[str], partial: bool = False) -> int:
+        """ใส่หัวข้อ + รายการตามลำดับจนงบหมด คืนจำนวนรายการที่ใส่ได้ (ใส่ไม่ได้เลย = ไม่ใส่หัวข้อ)"""
+        nonlocal used
+        mark = (len(sections), used)
+        count = 0
+        if add(header):
+            for text in texts:
+                if not add(text, partial):
+                    break
+                count += 1
+        if count == 0:
+            del sections[mark[0]:]
+            used = mark[1]
+        return count
+
+    seen_forms = set()
+    count = add_group("📚 ฟอร์มที่เกี่ยวข้องกับคำถาม:", [catalogue_line(item) for item in matched_forms])
+    seen_forms.update(item["id"] for item in matched_forms[:count])
+
+    chunks = merge_chunks(doc.page_content for doc in docs)
+    count = add_group("📄 ข้อมูลจากเอกสาร:", chunks, partial=True)
+    CONTEXT_CHUNKS.inc(count, outcome="packed")
+    CONTEXT_CHUNKS.inc(len(chunks) - count, outcome="dropped")
+
+    referenced = [item for item in forms_in_documents(docs) if item["id"] not in seen_forms]
+    count = add_group("📎 ฟอร์มที่เอกสารข้างต้นอ้างถึง:", [catalogue_line(item) for item in referenced])
+    seen_forms.update(item["id"] for item in referenced[:count])
+
+    if not seen_forms:
+        # ไม่รู้ว่าคำถามเกี่ยวกับฟอร์มไหน ให้รายการฟอร์มทั้งหมดเท่าที่งบเหลือ (ไม่ใส่ลิงก์ ประหยัด token)
+        add_group(
+            "📚 รายการแบบฟอร์มทั้งหมด:",
+            [catalogue_line(item, with_url=False) for item in FORM_MASTER_DATA],
+        )
+
+    CONTEXT_TOKENS.observe(used)
+    return "\n".join(sections)
+
+
+def context_budget(total_budget: int, *fixed_texts: Optional[str]) -> int:
+    """งบที่เหลือให้ context หลังหัก prompt ที่คงที่ + คำถาม"""
+    return max(0, total_budget - sum(estimate_tokens(t or "") for t in fixed_texts))
@@ -0,0 +1,77 @@
+"""Micro-benchmark: KeywordIndex vs. the old per-request nested keyword loops.
+
+Run from the repo root:
+
+    python -m benchmarks.bench_keyword_matcher
+
+The catalogue is scaled synthetically (copies of FORM_MASTER_DATA with
+suffixed keywords) to check the index still holds up with hundreds of forms.
+"""
+import timeit
+
+from forms import FORM_MASTER_DATA, TRIGGER_WORDS
+from keyword_index import KeywordIndex
+
+MESSAGES = [
+    "ลาป่วยใช้ฟอร์มอะไรครับ",
+    "ดรอปเรียนยังไง ต้องยื่นที่ไหน",
+    "สร้างไฟล์ใบลาป่วยให้หน่อย รหัส 64070501234 ป่วยเป็นไข้ 3 วัน",
+    "อยากถอน W วิชา CPE100 ทันไหม",
+    "หน่วยกิตเกินต้องทำยังไง ลงทะเบียนไม่ได้",
+    "บัตรนักศึกษาหายครับ ทำบัตรใหม่ได้ที่ไหน",
+    "What form do I need for a refund?",
+]
+
+
+def scaled_catalogue(copies: int):
+    forms = []
+    for n in range(copies):
+        for item in FORM_MASTER_DATA:
+            suffix = "" if n == 0 else f"#{n}"
+            forms.append({
+                "id": f"{item['id']}{suffix}",
+                "keywords": [f"{kw}{suffix}" for kw in item["keywords"]],
+            })
+    return forms
+
+
+def legacy_match(message, forms):
+    user_wants_file = any(word in message.lower() for word in TRIGGER_WORDS)
+    matched = []
+    for item in forms:
+        for kw in item["keywords"]:
+            if kw in message.lower():
+                matched.append(item["id"])
+                break
+    return user_wants_file, matched
+
+
+def build_index(forms):
+    return KeywordIndex(
+        [(word, ("trigger", word)) for word in TRIGGER_WORDS]
+        + [(kw, ("form", item["id"])) for item in forms for kw in item["keywords"]]
+    )
+
+
+def main(number: int = 200):
+    print(f"{'forms':>7} {'legacy us/msg':>14} {'index us/msg':>13} {'speedup':>8} {'build ms':>9}")
+    for copies in (1, 10, 50):
+        forms = scaled_catalogue(copies)
+        build_ms = timeit.timeit(lambda: build_index(forms), number=1) * 1000
+        index = build_index(forms)
+
+        legacy = timeit.timeit(
+            lambda: [legacy_match(m, forms) for m in MESSAGES], number=number
+        )
+        indexed = timeit.timeit(
+            lambda: [index.search(m) for m in MESSAGES], number=number
+        )
+        per_msg = 1e6 / (number * len(MESSAGES))
+        print(
+            f"{len(forms):>7} {legacy * per_msg:>14.1f} {indexed * per_msg:>13.1f} "
+            f"{legacy / indexed:>7.1f}x {build_ms:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Load benchmark: the real FastAPI app against local Groq/Qdrant stand-ins.
+
+Run from the repo root:
+
+    python -m benchmarks.bench_load
+    python -m benchmarks.bench_load --requests 400 --concurrency 32 --groq-latency 0.8
+    python -m benchmarks.bench_load --compare benchmarks/results/load_<sha>_<time>.json
+    python -m benchmarks.bench_load --groq-url http://127.0.0.1:8089  # fake_groq_server.py
+
+Each scenario (RAG chat, file-mode chat, streaming chat, direct document
+generation) replays the Thai corpus in benchmarks/corpus.py with a fixed number
+of concurrent clients. Requests go through httpx's ASGI transport, so the
+numbers cover the app itself, not a network stack. Reported per scenario:
+throughput, p50/p95/p99 latency and the same percentiles for each pipeline stage
+(keyword match, retrieval, LLM, render). Results are written as JSON under
+benchmarks/results/ so runs on different commits can be compared.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks import fakes
+from benchmarks.corpus import FILE_REQUESTS, RAG_QUESTIONS, SEED_CHUNKS
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    values = sorted(samples)
+    ms = lambda s: round(s * 1000, 2)
+    return {
+        "count": len(values),
+        "mean_ms": ms(sum(values) / len(values)) if values else 0.0,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else 0.0,
+    }
+
+
+class StageRecorder:
+    """Wraps main.py's pipeline functions and records how long each call took."""
+
+    def __init__(self):
+        self.scenario = None
+        self.samples: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+
+    def add(self, stage: str, seconds: float) -> None:
+        if self.scenario:
+            self.samples[self.scenario][stage].append(seconds)
+
+    def wrap_async(self, stage: str, fn: Callable) -> Callable:
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+    def wrap_sync(self, stage: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+    def wrap_async_gen(self, stage: str, fn: Callable) -> Callable:
+        # For streaming: records time to first token and total stream time
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            first = True
+            async for item in fn(*args, **kwargs):
+                if first:
+                    self.add(f"{stage}_first_token", time.perf_counter() - started)
+                    first = False
+                yield item
+            self.add(stage, time.perf_counter() - started)
+        return timed
+
+    def instrument(self, main) -> None:
+        main.match_message = self.wrap_sync("keyword_match", main.match_message)
+        main.retrieve_documents = self.wrap_async("retrieval", main.retrieve_documents)
+        main.get_advisor_response = self.wrap_async("llm_advisor", main.get_advisor_response)
+        main.stream_advisor_response = self.wrap_async_gen(
+            "llm_advisor_stream", main.stream_advisor_response
+        )
+        main.extract_form_fields = self.wrap_async("llm_extractor", main.extract_form_fields)
+        main.render_to_store = self.wrap_async("render", main.render_to_store)
+
+
+def scenario_requests(name: str, templates: List[str]):
+    """Endless iterator of (method, path, json body) for a scenario."""
+    counter = itertools.count()
+    if name == "chat_rag":
+        for message in itertools.cycle(RAG_QUESTIONS):
+            yield "/chat", {"message": message}
+    elif name == "chat_file":
+        for message in itertools.cycle(FILE_REQUESTS):
+            # unique student id per request so the output store cannot dedupe the render
+            yield "/chat", {"message": f"{message} รหัส {64000000000 + next(counter)}"}
+    elif name == "chat_stream":
+        for message in itertools.cycle(RAG_QUESTIONS):
+            yield "/chat/stream", {"message": message}
+    elif name == "generate_document":
+        for form_type in itertools.cycle(templates):
+            n = next(counter)
+            yield "/generate-document", {
+                "form_type": form_type,
+                "student_id": str(64000000000 + n),
+                "form_data": {
+                    "form_type": form_type,
+                    "student_name": "นักศึกษา ทดสอบ",
+                    "student_id": str(64000000000 + n),
+                    "request_details": "ขอยื่นคำร้องเพื่อทดสอบระบบ",
+                },
+            }
+    else:
+        raise ValueError(f"Unknown scenario: {name}")
+
+
+async def run_scenario(client, recorder: StageRecorder, name: str, requests: int,
+                       concurrency: int, templates: List[str]) -> Dict[str, Any]:
+    recorder.scenario = name
+    source = scenario_requests(name, templates)
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    statuses: Dict[str, int] = defaultdict(int)
+    remaining = itertools.count()
+
+    async def worker():
+        while next(remaining) < requests:
+            path, body = next(source)
+            started = time.perf_counter()
+            try:
+                async with client.stream("POST", path, json=body) as response:
+                    first = None
+                    async for _ in response.aiter_raw():
+                        if first is None:
+                            first = time.perf_counter() - started
+                    statuses[str(response.status_code)] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+                continue
+            if response.status_code != 200:
+                continue  # shed/failed requests are counted in "status", not in the percentiles
+            latencies.append(time.perf_counter() - started)
+            if first is not None:
+                first_bytes.append(first)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    recorder.scenario = None
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "status": dict(statuses),
+        "latency": summarize(latencies),
+        "first_byte": summarize(first_bytes),
+        "stages": {stage: summarize(v) for stage, v in sorted(recorder.samples[name].items())},
+    }
+
+
+async def run_all(main, args) -> Dict[str, Any]:
+    import httpx
+
+    recorder = StageRecorder()
+    recorder.instrument(main)
+    templates = sorted(main.TEMPLATE_MAP)
+    results = {}
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            deadline = time.monotonic() + args.ready_timeout
+            while (await client.get("/readyz")).status_code != 200:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("app did not become ready (see /readyz)")
+                await asyncio.sleep(0.1)
+            for name in args.scenarios:
+                # every scenario starts from empty caches, otherwise the order of scenarios matters
+                for cache in main.ALL_CACHES:
+                    cache.clear()
+                # short warm-up so first-request effects do not land in the percentiles
+                await run_scenario(client, StageRecorder(), name, args.warmup, 1, templates)
+                results[name] = await run_scenario(
+                    client, recorder, name, args.requests, args.concurrency, templates
+                )
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    header = f"{'scenario / stage':<34} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    for name, res in results.items():
+        base = (baseline or {}).get(name)
+        rows = [(name, res["throughput_rps"], res["latency"], base and base["latency"])]
+        rows += [
+            (f"  {stage}", "", stats, base and base["stages"].get(stage))
+            for stage, stats in res["stages"].items()
+        ]
+        for label, rps, stats, base_stats in rows:
+            line = (
+                f"{label:<34} {rps!s:>8} {stats['p50_ms']:>9.1f} "
+                f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}"
+            )
+            if base_stats and base_stats["p95_ms"]:
+                line += f" {(stats['p95_ms'] / base_stats['p95_ms'] - 1) * 100:>+11.1f}%"
+            print(line)
+        bad = {k: v for k, v in res["status"].items() if k != "200"}
+        if bad:
+            print(f"  non-200 responses: {bad}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=["chat_rag", "chat_file", "chat_stream", "generate_document"],
+        choices=["chat_rag", "chat_file", "chat_stream", "generate_document"],
+    )
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed requests per scenario")
+    parser.add_argument("--groq-latency", type=float, default=0.3, help="Fake Groq time to first token (s)")
+    parser.add_argument("--groq-token-latency", type=float, default=0.005, help="Fake Groq delay per token (s)")
+    parser.add_argument("--groq-jitter", type=float, default=0.2, help="Relative +/- jitter on fake delays")
+    parser.add_argument(
+        "--real-embeddings",
+        action="store_true",
+        help="Use the FastEmbed models from config.py instead of hash embeddings",
+    )
+    parser.add_argument("--qdrant-url", help="Benchmark against this Qdrant instead of an in-memory one")
+    parser.add_argument(
+        "--groq-url",
+        help="Call this Groq-compatible server (e.g. fake_groq_server.py) over HTTP instead of the in-process fake",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Disable the query/retrieval/answer caches")
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--out", help="Result file (default: benchmarks/results/load_<sha>_<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare p95 against")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own log output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # main.py reads these at import time
+    os.environ.setdefault("OUTPUT_DIR", tempfile.mkdtemp(prefix="bench_output_"))
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    # every simulated client shares one address; the per-client rate limit would throttle the run
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    if args.no_cache:
+        for name in ("QUERY_VECTOR_CACHE_SIZE", "RETRIEVAL_CACHE_SIZE", "ANSWER_CACHE_SIZE"):
+            os.environ[name] = "0"
+    if args.qdrant_url:
+        os.environ["QDRANT_URL"] = args.qdrant_url
+        os.environ["RETRIEVAL_BACKEND"] = "qdrant"
+    if args.groq_url:
+        os.environ["GROQ_BASE_URL"] = args.groq_url
+    fakes.FakeAsyncGroq.latency = args.groq_latency
+    fakes.FakeAsyncGroq.token_latency = args.groq_token_latency
+    fakes.FakeAsyncGroq.jitter = args.groq_jitter
+    fakes.install(
+        SEED_CHUNKS,
+        fake_embeddings=not args.real_embeddings,
+        qdrant_url=args.qdrant_url,
+        fake_groq=not args.groq_url,
+    )
+
+    log = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(log):
+        import main as app_main
+        results = asyncio.run(run_all(app_main, args))
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "revision": revision,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_report(results, baseline)
+
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"load_{revision or 'nogit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Thai student messages replayed by the load benchmark.
+
+RAG_QUESTIONS go down the advisor path of /chat, FILE_REQUESTS contain a
+trigger word and go down the extractor + render path. The mix is roughly what
+the registrar chat sees: mostly questions, some "make me the form" requests.
+"""
+from forms import FORM_MASTER_DATA
+
+RAG_QUESTIONS = [
+    "ลาป่วยใช้ฟอร์มอะไรครับ",
+    "ป่วยไม่ได้ไปสอบกลางภาค ต้องยื่นเอกสารอะไรบ้าง",
+    "ดรอปเรียนยังไง ต้องยื่นที่ไหน",
+    "อยากถอน W วิชา CPE100 ทันไหมคะ",
+    "หน่วยกิตเกินต้องทำยังไง ลงทะเบียนไม่ได้",
+    "ขอคืนเงินค่าลงทะเบียนที่จ่ายเกินใช้แบบฟอร์มไหน",
+    "ให้เพื่อนไปรับเอกสารแทนได้ไหม ต้องใช้ใบมอบฉันทะหรือเปล่า",
+    "อยากเลื่อนรับปริญญาไปปีหน้าต้องทำอย่างไร",
+    "ลาออกจากการเป็นนักศึกษาต้องให้ผู้ปกครองเซ็นไหม",
+    "ขอหนังสือรับรองผู้ปกครองได้ที่ไหนครับ",
+    "ลงทะเบียนเรียนต่ำกว่าเกณฑ์ต้องยื่นคำร้องอะไร",
+    "ขอผ่อนผันค่าเทอมได้หรือเปล่า",
+    "รักษาสภาพนักศึกษาทำยังไง ภาคนี้ไม่ได้ลงเรียน",
+    "จะขอเปลี่ยนชื่อสกุลในระบบทะเบียนต้องใช้เอกสารอะไร",
+    "What form do I need for a refund?",
+    "ติด F วิชาบังคับ ต้องลงซ้ำเลยไหม",
+    "ลากิจไปงานบวชพี่ชาย 3 วัน ต้องยื่นก่อนกี่วัน",
+    "ขอใบรับรองการเป็นนักศึกษาภาษาอังกฤษได้ที่ไหน",
+]
+
+FILE_REQUESTS = [
+    "สร้างไฟล์ใบลาป่วยให้หน่อย ชื่อสมชาย ใจดี รหัส 64070501234 ป่วยเป็นไข้ 3 วัน",
+    "ช่วยกรอกให้หน่อย ลาป่วยวันที่ 12-14 มีนาคม 2567 รหัส 65070501111 เบอร์ 0812345678",
+    "ร่างคำร้องทั่วไปขอเปิดรายวิชาเพิ่ม ชื่อ มานี มีนา รหัส 63070502222 คณะวิศวกรรมศาสตร์",
+    "ทำเอกสารหนังสือรับรองผู้ปกครอง ที่อยู่ 126 ถ.ประชาอุทิศ แขวงบางมด เขตทุ่งครุ กรุงเทพ 10140",
+    "สร้างไฟล์คำร้องขอลาออก เหตุผลย้ายไปเรียนต่างประเทศ อาจารย์ที่ปรึกษา ดร.สมศักดิ์",
+    "เจนไฟล์ลากิจ 2 วัน ไปงานแต่งพี่สาว รหัส 66070503333 อีเมล student@mail.kmutt.ac.th",
+]
+
+# Keyword-rich passages built from the form catalogue, used to seed the
+# in-memory vector store so retrieval has something realistic to rank.
+SEED_CHUNKS = [
+    {
+        "page_content": (
+            f"แบบฟอร์ม {item['id']} {item['name']} "
+            f"ใช้ในกรณี {' '.join(item['keywords'])} "
+            f"ดาวน์โหลดได้ที่ {item['url']} ยื่นที่สำนักงานทะเบียนนักศึกษา"
+        ),
+        "metadata": {"source": item["url"], "file": item["url"], "page": page, "form_id": item["id"]},
+    }
+    for item in FORM_MASTER_DATA
+    for page in range(3)
+]
@@ -0,0 +1,138 @@
+"""OpenAI-compatible stand-in for the Groq API, served over real HTTP.
+
+Unlike ``fakes.FakeAsyncGroq`` (patched in-process), this exercises the whole
+client layer in ``llm_client.py``: connection pooling, deadlines, retries on
+429/5xx, hedging and the circuit breaker. Point the app at it with::
+
+    python -m benchmarks.fake_groq_server --port 8089 --error-rate 0.1 --slow-rate 0.05
+    GROQ_BASE_URL=http://127.0.0.1:8089 GROQ_API_KEY=x uvicorn main:app
+
+Failures can also be injected per request with an ``X-Fake-Status`` header.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.fakes import FakeCompletions
+
+
+def build_app(
+    latency: float = 0.3,
+    token_latency: float = 0.005,
+    jitter: float = 0.2,
+    error_rate: float = 0.0,
+    error_status: int = 503,
+    slow_rate: float = 0.0,
+    slow_latency: float = 5.0,
+) -> FastAPI:
+    app = FastAPI()
+    completions = FakeCompletions(latency, token_latency, jitter)
+    app.state.stats = {"requests": 0, "errors": 0, "slow": 0}
+
+    def completion_body(model: str, content: str, usage) -> dict:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            },
+        }
+
+    def chunk_body(chunk_id: str, model: str, content: str, last: bool) -> dict:
+        body = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "delta": {"content": content} if content else {},
+                "finish_reason": "stop" if last else None,
+            }],
+        }
+        if last:
+            body["x_groq"] = {"id": chunk_id}
+        return body
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        stats = app.state.stats
+        stats["requests"] += 1
+        body = await request.json()
+
+        forced = request.headers.get("x-fake-status")
+        if forced or random.random() < error_rate:
+            stats["errors"] += 1
+            status = int(forced or error_status)
+            headers = {"retry-after": "0"} if status == 429 else {}
+            return JSONResponse(
+                {"error": {"message": f"fake {status}", "type": "fake_error"}},
+                status_code=status,
+                headers=headers,
+            )
+        if random.random() < slow_rate:
+            stats["slow"] += 1
+            await asyncio.sleep(slow_latency)
+
+        model = body.get("model", "")
+        kwargs = {"response_format": body["response_format"]} if body.get("response_format") else {}
+        if not body.get("stream"):
+            completion = await completions.create(model, body["messages"], **kwargs)
+            return completion_body(model, completion.choices[0].message.content, completion.usage)
+
+        chunks = await completions.create(model, body["messages"], stream=True, **kwargs)
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        async def events():
+            async for chunk in chunks:
+                data = chunk_body(chunk_id, model, chunk.choices[0].delta.content, last=False)
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps(chunk_body(chunk_id, model, '', last=True))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def stats():
+        return app.state.stats
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3, help="Time to first token (s)")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Delay per token (s)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative +/- jitter on delays")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="Status code of injected failures")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of requests that stall")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Extra delay of stalled requests (s)")
+    args = parser.parse_args(argv)
+    app = build_app(
+        args.latency, args.token_latency, args.jitter,
+        args.error_rate, args.error_status, args.slow_rate, args.slow_latency,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
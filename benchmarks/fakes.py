@@ -0,0 +1,219 @@
+"""Local stand-ins for Groq, FastEmbed and Qdrant used by the load benchmark.
+
+They keep the same call shapes main.py relies on, so the app runs unmodified:
+``install()`` patches the constructors before ``main`` is imported.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import types
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import SparseEmbeddings, SparseVector
+
+STUDENT_ID_RE = re.compile(r"\b\d{11}\b")
+
+# message keyword -> template the fake extractor "detects"
+FORM_HINTS = [
+    ("ผู้ปกครอง", "RO-03"),
+    ("ลาออก", "RO-13"),
+    ("ลาป่วย", "RO-16"),
+    ("ลากิจ", "RO-16"),
+]
+
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content: str):
+        self.message = _Message(content)
+        self.delta = _Message(content)
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+class _Completion:
+    def __init__(self, content: str, usage: Optional[_Usage] = None):
+        self.choices = [_Choice(content)]
+        self.usage = usage
+
+
+class FakeCompletions:
+    def __init__(self, latency: float, token_latency: float, jitter: float):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.calls = 0
+
+    def _delay(self, base: float) -> float:
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    @staticmethod
+    def _user_message(messages) -> str:
+        return next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+
+    @staticmethod
+    def _prompt_tokens(messages) -> int:
+        # ~4 chars per token is close enough for budget comparisons
+        return sum(len(m["content"]) for m in messages) // 4
+
+    def _extract(self, message: str) -> str:
+        form_type = next((f for kw, f in FORM_HINTS if kw in message), "RO-01")
+        student_id = STUDENT_ID_RE.search(message)
+        return json.dumps({
+            "form_type": form_type,
+            "student_name": "นักศึกษา ทดสอบ",
+            "student_id": student_id.group(0) if student_id else "",
+            "request_details": message,
+            "leave_reason": message,
+        }, ensure_ascii=False)
+
+    async def create(self, model: str, messages: List[dict], stream: bool = False, **kwargs):
+        self.calls += 1
+        message = self._user_message(messages)
+        if kwargs.get("response_format"):
+            content = self._extract(message)
+        else:
+            content = f"แนะนำให้ใช้แบบฟอร์มตามที่ระบุ สำหรับคำถาม: {message}"
+        tokens = content.split() or [content]
+        usage = _Usage(self._prompt_tokens(messages), len(tokens))
+
+        await asyncio.sleep(self._delay(self.latency))
+        if not stream:
+            await asyncio.sleep(self._delay(self.token_latency) * len(tokens))
+            return _Completion(content, usage)
+
+        async def chunks():
+            for i, token in enumerate(tokens):
+                await asyncio.sleep(self._delay(self.token_latency))
+                yield _Completion(token if i == 0 else " " + token)
+
+        return chunks()
+
+
+class FakeAsyncGroq:
+    """AsyncGroq with a fixed time-to-first-token plus a per-token delay."""
+
+    latency = 0.3
+    token_latency = 0.005
+    jitter = 0.2
+
+    def __init__(self, *args, **kwargs):
+        self.chat = types.SimpleNamespace(
+            completions=FakeCompletions(self.latency, self.token_latency, self.jitter)
+        )
+
+
+def _hash_vector(text: str, size: int) -> List[float]:
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(digest[i % len(digest)] / 255.0) - 0.5 for i in range(size)]
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic dense vectors, no model download (for CI / offline runs)."""
+
+    def __init__(self, model_name: Optional[str] = None, size: int = 384, **kwargs):
+        self.size = size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [_hash_vector(t, self.size) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return _hash_vector(text, self.size)
+
+
+class HashSparseEmbeddings(SparseEmbeddings):
+    """Bag-of-words sparse vectors keyed by a hash of each whitespace token."""
+
+    def __init__(self, model_name: Optional[str] = None, **kwargs):
+        pass
+
+    def embed_documents(self, texts: List[str]) -> List[SparseVector]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> SparseVector:
+        counts = {}
+        for word in text.lower().split():
+            idx = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:7], 16)
+            counts[idx] = counts.get(idx, 0.0) + 1.0
+        indices = sorted(counts)
+        return SparseVector(indices=indices, values=[counts[i] for i in indices])
+
+
+def seeded_qdrant(chunks, embedding: Embeddings, sparse_embedding: SparseEmbeddings):
+    """In-memory Qdrant holding ``chunks`` in the same layout upload_data.py writes."""
+    from qdrant_client import QdrantClient, models
+    from config import COLLECTION_NAME, DENSE_VECTOR_NAME, DENSE_VECTOR_SIZE, SPARSE_VECTOR_NAME
+
+    client = QdrantClient(location=":memory:")
+    client.create_collection(
+        COLLECTION_NAME,
+        vectors_config={
+            DENSE_VECTOR_NAME: models.VectorParams(
+                size=DENSE_VECTOR_SIZE, distance=models.Distance.COSINE
+            )
+        },
+        sparse_vectors_config={SPARSE_VECTOR_NAME: models.SparseVectorParams()},
+    )
+    texts = [c["page_content"] for c in chunks]
+    dense = embedding.embed_documents(texts)
+    sparse = sparse_embedding.embed_documents(texts)
+    client.upsert(COLLECTION_NAME, points=[
+        models.PointStruct(
+            id=i,
+            vector={
+                DENSE_VECTOR_NAME: d,
+                SPARSE_VECTOR_NAME: models.SparseVector(indices=s.indices, values=s.values),
+            },
+            payload={"page_content": c["page_content"], "metadata": c["metadata"]},
+        )
+        for i, (c, d, s) in enumerate(zip(chunks, dense, sparse))
+    ])
+    return client
+
+
+def install(
+    chunks,
+    fake_embeddings: bool = True,
+    qdrant_url: Optional[str] = None,
+    fake_groq: bool = True,
+) -> None:
+    """Patch Groq (unless fake_groq_server.py is used instead), FastEmbed (optional)
+    and Qdrant (unless a URL is given).
+
+    Must run before ``import main``: main.py binds these names at import time.
+    """
+    import groq
+    import qdrant_client
+    import langchain_qdrant
+    import langchain_community.embeddings.fastembed as fastembed
+
+    if fake_groq:
+        groq.AsyncGroq = FakeAsyncGroq
+    if fake_embeddings:
+        fastembed.FastEmbedEmbeddings = HashEmbeddings
+        langchain_qdrant.FastEmbedSparse = HashSparseEmbeddings
+    if qdrant_url:
+        return
+
+    dense_cls = HashEmbeddings if fake_embeddings else fastembed.FastEmbedEmbeddings
+    sparse_cls = HashSparseEmbeddings if fake_embeddings else langchain_qdrant.FastEmbedSparse
+    from config import DENSE_MODEL_NAME, SPARSE_MODEL_NAME, MODEL_CACHE_DIR
+    kwargs = {} if fake_embeddings else {"cache_dir": MODEL_CACHE_DIR}
+    client = seeded_qdrant(
+        chunks,
+        dense_cls(model_name=DENSE_MODEL_NAME, **kwargs),
+        sparse_cls(model_name=SPARSE_MODEL_NAME, **kwargs),
+    )
+    qdrant_client.QdrantClient = lambda *args, **kwargs: client
@@ -0,0 +1,274 @@
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import SparseEmbeddings, SparseVector
+
+from metrics import span
+
+# ---------------------------------------------------------
+# Cache กลางสำหรับ RAG path (query vector / ผลค้นหา / คำตอบ)
+# ---------------------------------------------------------
+
+def normalize_query(text: str) -> str:
+    """ทำ key ให้คำถามที่ต่างกันแค่ตัวพิมพ์/ช่องว่าง ใช้ cache ร่วมกันได้"""
+    return " ".join(text.lower().split())
+
+
+class LRUCache:
+    """LRU แบบจำกัดจำนวน พร้อมตัวนับ hit/miss (thread-safe เพราะถูกเรียกจาก retrieval thread)"""
+
+    def __init__(self, name: str, maxsize: int = 1024):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # API แบบ async ให้ endpoint เรียกได้เหมือนกันทุกชนิด (in-memory ทำเสร็จในที่ ไม่ต้องออก thread)
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        return self.get(key, default)
+
+    async def aset(self, key: Hashable, value: Any) -> None:
+        self.set(key, value)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class TTLCache(LRUCache):
+    """LRU ที่แต่ละ entry หมดอายุเองหลัง ttl วินาที"""
+
+    def __init__(self, name: str, maxsize: int = 512, ttl: float = 600):
+        super().__init__(name, maxsize)
+        self.ttl = ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "ttl": self.ttl}
+
+
+class SharedTTLCache:
+    """TTL cache ที่ทุก worker process ใช้ร่วมกัน (sqlite ไฟล์เดียว, ค่าเก็บเป็น pickle)
+
+    ใช้แทน TTLCache ได้เลย (get/set/discard/clear/stats) เปิด connection ใหม่หลัง fork
+    บน event loop ให้ใช้ aget/aset (ทำ I/O ใน thread) ไม่งั้นรอ lock ของ worker อื่นจะบล็อกทุก request
+    error ของ sqlite (เช่น lock นานเกิน busy_timeout) นับเป็น miss / ข้ามการเขียน ไม่ให้ request ล้ม
+    ตัดของหมดอายุ / เกินขนาดทุก evict_interval วินาที ไม่ใช่ทุกครั้งที่เขียน (ระหว่างนั้นเกิน maxsize ได้นิดหน่อย)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        maxsize: int = 512,
+        ttl: float = 600,
+        busy_timeout: float = 0.1,
+        evict_interval: float = 30.0,
+    ):
+        self.name = name
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.busy_timeout = busy_timeout
+        self.evict_interval = evict_interval
+        self._next_evict = 0.0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # connection ที่ติดมาจาก process แม่ใช้ต่อไม่ได้ (fork) เปิดใหม่ใน process นี้
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "name TEXT, key TEXT, expires REAL, value BLOB, PRIMARY KEY (name, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (name, expires)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if self.maxsize <= 0:
+            self.misses += 1
+            return default
+        with self._lock:
+            try:
+                row = self._connection().execute(
+                    "SELECT value FROM cache WHERE name = ? AND key = ? AND expires > ?",
+                    (self.name, repr(key), time.time()),
+                ).fetchone()
+            except sqlite3.Error:
+                self.errors += 1
+                row = None
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (name, key, expires, value) VALUES (?, ?, ?, ?)",
+                    (self.name, repr(key), now + self.ttl, blob),
+                )
+                if time.monotonic() >= self._next_evict:
+                    self._next_evict = time.monotonic() + self.evict_interval
+                    self._evict(conn, now)
+            except sqlite3.Error:
+                self.errors += 1
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM cache WHERE name = ? AND expires <= ?", (self.name, now))
+        # เกินขนาด: ลบตัวที่ใกล้หมดอายุที่สุด (= เขียนไว้นานสุด) ออกก่อน
+        conn.execute(
+            "DELETE FROM cache WHERE name = ? AND key IN ("
+            "SELECT key FROM cache WHERE name = ? ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.name, self.name, self.maxsize),
+        )
+
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def aset(self, key: Hashable, value: Any) -> None:
+        await asyncio.to_thread(self.set, key, value)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            try:
+                self._connection().execute(
+                    "DELETE FROM cache WHERE name = ? AND key = ?", (self.name, repr(key))
+                )
+            except sqlite3.Error:
+                self.errors += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                self._connection().execute("DELETE FROM cache WHERE name = ?", (self.name,))
+            except sqlite3.Error:
+                self.errors += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            try:
+                return self._connection().execute(
+                    "SELECT COUNT(*) FROM cache WHERE name = ? AND expires > ?", (self.name, time.time())
+                ).fetchone()[0]
+            except sqlite3.Error:
+                return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "ttl": self.ttl,
+            "shared": True,
+        }
+
+
+# ---------------------------------------------------------
+# Wrapper ของ Embedding ที่ cache เฉพาะ embed_query
+# (embed_documents ใช้ตอน ingest เท่านั้น ไม่ต้อง cache)
+# ---------------------------------------------------------
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, inner: Embeddings, cache: LRUCache):
+        self.inner = inner
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector: Optional[List[float]] = self.cache.get(key)
+        if vector is None:
+            with span("embed_dense"):
+                vector = self.inner.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+
+class CachedSparseEmbeddings(SparseEmbeddings):
+    def __init__(self, inner: SparseEmbeddings, cache: LRUCache):
+        self.inner = inner
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[SparseVector]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> SparseVector:
+        key = normalize_query(text)
+        vector: Optional[SparseVector] = self.cache.get(key)
+        if vector is None:
+            with span("embed_sparse"):
+                vector = self.inner.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
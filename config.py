@@ -0,0 +1,26 @@
+import os
+
+from dotenv import load_dotenv
+
+# ---------------------------------------------------------
+# ค่าที่ main.py / upload_data.py / preload.py ต้องตรงกัน
+# (ชื่อ collection, vector, model) รวมไว้ที่เดียว
+# ---------------------------------------------------------
+
+load_dotenv()
+
+QDRANT_URL = os.environ.get("QDRANT_URL")
+QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
+COLLECTION_NAME = "demo_collection_railway_v2"
+
+DENSE_VECTOR_NAME = "dense_vector"
+SPARSE_VECTOR_NAME = "sparse_vector"
+# payload ของ chunk: รหัสฟอร์มใน FORM_MASTER_DATA (upload_data.py ใส่ + ทำ index, main.py ใช้กรองผลค้นหา)
+FORM_ID_KEY = "metadata.form_id"
+
+DENSE_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+DENSE_VECTOR_SIZE = 384
+SPARSE_MODEL_NAME = "Qdrant/bm25"
+
+# โฟลเดอร์เก็บไฟล์ model ของ FastEmbed (preload.py โหลดไว้ตอน build image, server อ่านจากที่เดียวกัน)
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "model_cache")
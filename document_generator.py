@@ -1,63 +1,135 @@
 import os
+import copy
 import json
+import functools
+import threading
+from collections import OrderedDict
 from docxtpl import DocxTemplate
+from jinja2 import Environment
 from io import BytesIO
 
+from metrics import span
+
 # ---------------------------------------------------------
 # 1. ตั้งค่า Template
 # ---------------------------------------------------------
 TEMPLATE_DIR = "templates"
 
 TEMPLATE_MAP = {
-    "RO-01": os.path.join(TEMPLATE_DIR, "RO-01_General.docx"),
-    "RO-03": os.path.join(TEMPLATE_DIR, "RO-03_Parent.docx"),
+    "RO-01": os.path.join(TEMPLATE_DIR, "RO-01_General_Request.docx"),
+    "RO-03": os.path.join(TEMPLATE_DIR, "RO-03_Guardian.docx"),
     "RO-13": os.path.join(TEMPLATE_DIR, "RO-13_Resignation.docx"),
     "RO-16": os.path.join(TEMPLATE_DIR, "RO-16_Sick_Leave.docx")
 }
 
 # ---------------------------------------------------------
-# ฟังก์ชัน 1: สร้างไฟล์ลง Disk (สำหรับ Chatbot)
+# 2. Template Cache
+# เก็บ template ที่ parse แล้วไว้ใน RAM (key = form_type + mtime ของไฟล์)
+# แต่ละ request render จากสำเนา (deepcopy) ไม่ต้อง unzip/parse .docx ใหม่
+# และจำผล patch_xml + jinja ที่ compile แล้ว เหลือแค่ jinja render + zip ตอน save
 # ---------------------------------------------------------
-def generate_document_auto(llm_json_string):
-    try:
-        data = json.loads(llm_json_string)
-    except json.JSONDecodeError:
-        print("❌ Error: JSON ผิดรูปแบบ")
-        return None
+class _CachingEnvironment(Environment):
+    """Jinja env ที่จำ template ที่ compile แล้ว (docxtpl เรียก from_string ทุก part ทุกครั้ง)"""
 
-    form_type = data.get("form_type", "").upper()
-    
-    if form_type not in TEMPLATE_MAP:
-        print(f"❌ Error: ไม่พบ Template รหัส '{form_type}'")
-        return None
+    def __init__(self, maxsize=64, **kwargs):
+        super().__init__(**kwargs)
+        self._compiled = OrderedDict()
+        self._compiled_maxsize = maxsize
+        self._compiled_lock = threading.Lock()
 
-    template_path = TEMPLATE_MAP[form_type]
-    if not os.path.exists(template_path):
-        print(f"❌ Error: หาไฟล์ Template ไม่เจอ ({template_path})")
-        return None
+    def from_string(self, source, globals=None, template_class=None):
+        if globals is not None or template_class is not None:
+            return super().from_string(source, globals, template_class)
+        with self._compiled_lock:
+            template = self._compiled.get(source)
+            if template is not None:
+                self._compiled.move_to_end(source)
+                return template
+        template = super().from_string(source)
+        with self._compiled_lock:
+            self._compiled[source] = template
+            while len(self._compiled) > self._compiled_maxsize:
+                self._compiled.popitem(last=False)
+        return template
+
+_JINJA_ENV = _CachingEnvironment()
+
+@functools.lru_cache(maxsize=64)
+def _patch_xml_cached(src_xml):
+    # patch_xml ของ docxtpl ไม่ได้ใช้ state ของ instance
+    return DocxTemplate.patch_xml(None, src_xml)
 
-    print(f"✅ กำลังสร้างเอกสาร (Disk): {form_type}")
+class _CachedDocxTemplate(DocxTemplate):
+    def patch_xml(self, src_xml):
+        return _patch_xml_cached(src_xml)
 
-    # สร้างโฟลเดอร์ output
-    output_dir = "output"
-    os.makedirs(output_dir, exist_ok=True)
+class _TemplateEntry:
+    def __init__(self, mtime, blob, docx):
+        self.mtime = mtime
+        self.blob = blob
+        self.docx = docx
+        self.variables = None  # ชื่อตัวแปรใน template (คำนวณตอนถูกขอครั้งแรก)
 
-    student_id = data.get('student_id', 'unknown')
-    output_filename = f"Filled_{form_type}_{student_id}.docx"
-    output_path = os.path.join(output_dir, output_filename)
+_TEMPLATE_CACHE = {}
+_TEMPLATE_CACHE_LOCK = threading.Lock()
 
+def _get_entry(form_type):
+    template_path = TEMPLATE_MAP[form_type]
     try:
-        doc = DocxTemplate(template_path)
-        doc.render(data)
-        doc.save(output_path)
-        print(f"💾 บันทึกไฟล์สำเร็จ: {output_path}")
-        return output_path 
-    except Exception as e:
-        print(f"❌ Error: {e}")
+        mtime = os.stat(template_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    entry = _TEMPLATE_CACHE.get(form_type)
+    if entry is None or entry.mtime != mtime:
+        # Hot reload: ไฟล์ใน templates/ ถูกแก้ (mtime เปลี่ยน) -> โหลดใหม่
+        with _TEMPLATE_CACHE_LOCK:
+            entry = _TEMPLATE_CACHE.get(form_type)
+            if entry is None or entry.mtime != mtime:
+                with open(template_path, "rb") as f:
+                    blob = f.read()
+                prototype = DocxTemplate(BytesIO(blob))
+                prototype.init_docx()
+                entry = _TemplateEntry(mtime, blob, prototype.docx)
+                _TEMPLATE_CACHE[form_type] = entry
+                print(f"📄 โหลด Template เข้า Cache: {form_type}")
+    return entry
+
+def _get_template(form_type):
+    """คืน DocxTemplate พร้อม render (สำเนาจาก cache) หรือ None ถ้าไม่มีไฟล์ template"""
+    entry = _get_entry(form_type)
+    if entry is None:
         return None
+    doc = _CachedDocxTemplate(BytesIO(entry.blob))
+    doc.docx = copy.deepcopy(entry.docx)
+    return doc
+
+def get_template_variables(form_type):
+    """ชื่อตัวแปรทั้งหมดที่ template ใช้ (เรียงตามตัวอักษร) หรือ None ถ้าไม่มีไฟล์ template
+    คำนวณครั้งเดียวต่อเวอร์ชันของไฟล์ แก้ template แล้ว schema ตามทันที"""
+    entry = _get_entry(form_type)
+    if entry is None:
+        return None
+    if entry.variables is None:
+        doc = _CachedDocxTemplate(BytesIO(entry.blob))
+        entry.variables = tuple(sorted(doc.get_undeclared_template_variables(_JINJA_ENV)))
+    return entry.variables
+
+def warm_template_cache():
+    """โหลดทุก template ใน TEMPLATE_MAP ล่วงหน้า (เรียกตอน app startup) และ compile jinja ไว้เลย"""
+    loaded = []
+    for form_type, template_path in TEMPLATE_MAP.items():
+        doc = _get_template(form_type)
+        if doc is None:
+            print(f"⚠️ Warm-up: หาไฟล์ Template ไม่เจอ ({template_path})")
+            continue
+        doc.render({}, jinja_env=_JINJA_ENV)
+        get_template_variables(form_type)
+        loaded.append(form_type)
+    return loaded
 
 # ---------------------------------------------------------
-# ฟังก์ชัน 2: สร้างไฟล์ใน RAM (สำหรับ API Stream)
+# สร้างไฟล์ใน RAM (รันใน render pool แล้วเก็บต่อใน OutputStore / ZIP ของ batch)
 # ---------------------------------------------------------
 def generate_document_stream(llm_json_string):
     try:
@@ -66,17 +138,22 @@ def generate_document_stream(llm_json_string):
         return None
 
     form_type = data.get("form_type", "").upper()
-    if form_type not in TEMPLATE_MAP or not os.path.exists(TEMPLATE_MAP[form_type]):
+    if form_type not in TEMPLATE_MAP:
+        return None
+    with span("template_load"):
+        doc = _get_template(form_type)
+    if doc is None:
         return None
 
     print(f"✅ กำลังสร้างเอกสาร (Stream): {form_type}")
 
     try:
-        doc = DocxTemplate(TEMPLATE_MAP[form_type])
-        doc.render(data)
+        with span("template_render"):
+            doc.render(data, jinja_env=_JINJA_ENV)
         
         file_stream = BytesIO()
-        doc.save(file_stream)
+        with span("template_save"):
+            doc.save(file_stream)
         file_stream.seek(0)
         
         return file_stream
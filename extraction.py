@@ -0,0 +1,297 @@
+import datetime
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from document_generator import TEMPLATE_MAP, get_template_variables
+from forms import FORM_BY_ID, TRIGGER_WORDS
+from metrics import Counter, REGISTRY, span
+
+# ---------------------------------------------------------
+# แกะข้อมูลฟอร์มด้วยกฎ (regex) ก่อนเรียก LLM
+# ช่องที่อ่านได้แน่นอน (รหัสนักศึกษา เบอร์ อีเมล วันที่ จำนวนวันลา ประเภทฟอร์ม)
+# กรอกเองเลย แล้วค่อยถาม LLM เฉพาะช่องที่เหลือ (เหตุผล / รายละเอียด / ชื่อ ...)
+# ถ้าข้อความไม่มีอะไรให้ LLM แกะต่อ ก็ไม่ต้องเรียก LLM เลย
+# ---------------------------------------------------------
+
+# Schema ของแต่ละฟอร์มสร้างจากตัวแปรใน Template จริง (document_generator.get_template_variables)
+# ไม่ต้องเขียนมือให้หลุดจาก .docx แค่ใส่คำสั่งเพิ่มให้ช่องที่ต้องการรูปแบบพิเศษ
+FIELD_HINTS: Dict[str, str] = {
+    "request_details": "แต่งภาษาทางการ",
+    "leave_reason": "แต่งภาษาทางการ",
+    "reason_other_details": "แต่งภาษาทางการ",
+    "Parental_certification": "แต่งภาษาทางการ",
+    "date_month": "ตัวเลข 2 หลัก เช่น 03",
+}
+# ช่องที่ไม่มีใน template บางฟอร์มแต่ระบบใช้ (student_id ใช้ตั้งชื่อไฟล์)
+EXTRA_FIELDS = ("student_id",)
+
+# คำที่ชี้ฟอร์มได้ชัดเจน (ไม่ใช้ keyword กว้างๆ ของ FORM_MASTER_DATA เช่น "ออก" ที่ชนกับ "ออกใบ")
+FORM_TYPE_HINTS: Dict[str, List[str]] = {
+    "RO-01": ["คำร้องทั่วไป", "เรื่องทั่วไป"],
+    "RO-03": ["ผู้ปกครอง", "หนังสือรับรอง"],
+    "RO-13": ["ลาออก", "resignation"],
+    "RO-16": ["ลาป่วย", "ลากิจ", "ใบรับรองแพทย์", "sick leave"],
+}
+
+THAI_MONTHS = {
+    "มกราคม": 1, "ม.ค.": 1, "กุมภาพันธ์": 2, "ก.พ.": 2, "มีนาคม": 3, "มี.ค.": 3,
+    "เมษายน": 4, "เม.ย.": 4, "พฤษภาคม": 5, "พ.ค.": 5, "มิถุนายน": 6, "มิ.ย.": 6,
+    "กรกฎาคม": 7, "ก.ค.": 7, "สิงหาคม": 8, "ส.ค.": 8, "กันยายน": 9, "ก.ย.": 9,
+    "ตุลาคม": 10, "ต.ค.": 10, "พฤศจิกายน": 11, "พ.ย.": 11, "ธันวาคม": 12, "ธ.ค.": 12,
+}
+_MONTH_RE = "|".join(re.escape(m) for m in sorted(THAI_MONTHS, key=len, reverse=True))
+
+FORM_CODE_RE = re.compile(r"(?:\bro|สทน)\s*[-.]?\s*(\d{2})\b", re.IGNORECASE)
+STUDENT_ID_RE = re.compile(r"(?<!\d)\d{11}(?!\d)")
+MOBILE_RE = re.compile(r"(?<!\d)0[689]\d(?:[-\s]?\d){7}(?!\d)")
+LANDLINE_RE = re.compile(r"(?<!\d)0[2-7](?:[-\s]?\d){7}(?!\d)")
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# "12 มีนาคม 2567 - 14 มีนาคม 2567" / "12 มี.ค. 67 ถึง 14 มี.ค. 67" (ต้องลองก่อนแบบย่อ)
+FULL_DATE_RANGE_RE = re.compile(
+    rf"(?<!\d)(\d{{1,2}})\s*({_MONTH_RE})\s*(\d{{4}}|\d{{2}}(?!\d))?\s*(?:-|–|ถึง)\s*"
+    rf"(\d{{1,2}})\s*({_MONTH_RE})\s*(\d{{4}}|\d{{2}}(?!\d))?"
+)
+# "12-14 มีนาคม 2567" / "12 ถึง 14 มี.ค. 67"
+DATE_RANGE_RE = re.compile(
+    rf"(?<!\d)(\d{{1,2}})\s*(?:-|–|ถึง)\s*(\d{{1,2}})\s*({_MONTH_RE})\s*(\d{{4}}|\d{{2}}(?!\d))?"
+)
+# "12 มีนาคม 2567" / "12 มี.ค."
+THAI_DATE_RE = re.compile(rf"(?<!\d)(\d{{1,2}})\s*({_MONTH_RE})\s*(\d{{4}}|\d{{2}}(?!\d))?")
+# "12/03/2567"
+NUMERIC_DATE_RE = re.compile(r"(?<!\d)(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})(?!\d)")
+LEAVE_DAYS_RE = re.compile(r"(?<!\d)(\d{1,3})\s*วัน(?!ที่)")
+
+# คำนำหน้าข้อมูลที่เหลือค้างหลังตัดค่าที่แกะได้ออก ไม่นับเป็นเนื้อหาให้ LLM แกะต่อ
+LABEL_WORDS = [
+    "รหัสนักศึกษา", "รหัส", "เบอร์โทรศัพท์", "เบอร์โทร", "เบอร์", "โทร", "อีเมล", "อีเมล์", "email",
+    "วันที่", "ตั้งแต่", "ถึง", "จำนวน", "วัน", "ให้หน่อย", "หน่อย", "ครับ", "ค่ะ", "คะ", "ฟอร์ม",
+    "แบบฟอร์ม", "ใบ", "ช่วย", "ที่", "และ",
+]
+# เหลือตัวอักษรไม่ถึงเท่านี้ = ไม่มีข้อมูลอะไรให้ LLM แกะเพิ่ม
+MIN_RESIDUAL_CHARS = 3
+
+EXTRACTION_PATH = REGISTRY.register(Counter(
+    "extraction_total", "File-mode extractions by path (rules_only / partial_llm / no_form)", ("path",)
+))
+FORM_CLASSIFICATION = REGISTRY.register(Counter(
+    "form_classification_total", "How the form type was picked (rules / llm / failed)", ("method",)
+))
+
+_SCHEMA_CACHE: Dict[Tuple[str, Tuple[str, ...]], Dict[str, str]] = {}
+
+
+def extractor_schema(form_type: str) -> Optional[Dict[str, str]]:
+    """Schema JSON ของฟอร์ม (cache ตามชุดตัวแปรของ template) หรือ None ถ้าไม่มี template"""
+    if form_type not in TEMPLATE_MAP:
+        return None
+    variables = get_template_variables(form_type)
+    if variables is None:
+        return None
+    key = (form_type, variables)
+    schema = _SCHEMA_CACHE.get(key)
+    if schema is None:
+        schema = {"form_type": form_type}
+        for name in variables + tuple(f for f in EXTRA_FIELDS if f not in variables):
+            schema[name] = FIELD_HINTS.get(name, "")
+        _SCHEMA_CACHE[key] = schema
+    return schema
+
+
+def warm_extractor_schemas() -> List[str]:
+    """สร้าง schema ของทุกฟอร์มที่มี template ไว้ก่อน (เรียกตอน startup)"""
+    return [form_type for form_type in TEMPLATE_MAP if extractor_schema(form_type)]
+
+
+def form_choices_text() -> str:
+    """รายการฟอร์มที่สร้างไฟล์ได้ สำหรับ prompt เลือกฟอร์ม (สั้นๆ ไม่มี schema)"""
+    lines = []
+    for form_type in TEMPLATE_MAP:
+        item = FORM_BY_ID.get(form_type.replace("-", "."))
+        lines.append(f"- {form_type}: {item['name'] if item else form_type}")
+    return "\n".join(lines)
+
+
+class PreExtraction(NamedTuple):
+    form_type: Optional[str]
+    fields: Dict[str, str]
+    residual: str
+
+    @property
+    def needs_llm(self) -> bool:
+        return len(self.residual) >= MIN_RESIDUAL_CHARS
+
+
+def _be_year(raw: Optional[str], default: int) -> int:
+    if not raw:
+        return default
+    year = int(raw)
+    if year < 100:
+        return 2500 + year  # "67" = 2567
+    return year if year >= 2400 else year + 543
+
+
+def _fmt_date(day: int, month: int, year: int) -> str:
+    return f"{day:02d}/{month:02d}/{year}"
+
+
+def _detect_form_type(message: str) -> Optional[str]:
+    lowered = message.lower()
+    codes = {f"RO-{m}" for m in FORM_CODE_RE.findall(message)} & set(TEMPLATE_MAP)
+    if len(codes) == 1:
+        return codes.pop()
+    hinted = {form for form, words in FORM_TYPE_HINTS.items() if any(w in lowered for w in words)}
+    return hinted.pop() if len(hinted) == 1 else None
+
+
+def _to_date(day: int, month: int, year: int) -> Optional[datetime.date]:
+    """วันที่ปี พ.ศ. ที่มีอยู่จริง (31/02 = None)"""
+    try:
+        return datetime.date(year - 543, month, day)
+    except ValueError:
+        return None
+
+
+def _is_range(start: Tuple[int, int, int], end: Tuple[int, int, int]) -> bool:
+    first, last = _to_date(*start), _to_date(*end)
+    return first is not None and last is not None and first <= last
+
+
+def _extract_dates(message: str, this_year: int, spans: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+    """[วันเริ่ม, วันสุดท้าย] หรือ [วันเดียว] หรือ [] ถ้าไม่แน่ใจ (ค่าจาก regex ทับผล LLM จึงต้องไม่เดา)"""
+    # 1. ช่วงที่เขียนวันที่เต็มทั้งสองฝั่ง (ปีที่เขียนฝั่งเดียว ใช้กับทั้งสองฝั่ง)
+    saw_range = False
+    for m in FULL_DATE_RANGE_RE.finditer(message):
+        saw_range = True
+        start = (int(m.group(1)), THAI_MONTHS[m.group(2)], _be_year(m.group(3) or m.group(6), this_year))
+        end = (int(m.group(4)), THAI_MONTHS[m.group(5)], _be_year(m.group(6) or m.group(3), this_year))
+        if _is_range(start, end):
+            spans.append(m.span())
+            return [start, end]
+    # 2. ช่วงแบบย่อ "12-14 มีนาคม"
+    for m in DATE_RANGE_RE.finditer(message):
+        saw_range = True
+        month, year = THAI_MONTHS[m.group(3)], _be_year(m.group(4), this_year)
+        start, end = (int(m.group(1)), month, year), (int(m.group(2)), month, year)
+        if _is_range(start, end):
+            spans.append(m.span())
+            return [start, end]
+    if saw_range:
+        # เขียนเป็นช่วงแต่ไม่มีช่วงไหนถูกต้อง (เช่น "20-3 มีนาคม") ไม่หยิบวันเดี่ยวในช่วงนั้นมาใช้
+        return []
+    # 3. วันที่เดี่ยวๆ: วันแรกถึงวันสุดท้ายที่เจอ
+    found = []
+    for m in THAI_DATE_RE.finditer(message):
+        found.append((m.span(), (int(m.group(1)), THAI_MONTHS[m.group(2)], _be_year(m.group(3), this_year))))
+    for m in NUMERIC_DATE_RE.finditer(message):
+        found.append((m.span(), (int(m.group(1)), int(m.group(2)), _be_year(m.group(3), this_year))))
+    found = [(span_, date) for span_, date in sorted(found) if _to_date(*date) is not None]
+    if not found:
+        return []
+    dates = [found[0][1], found[-1][1]]
+    if not _is_range(*dates):
+        return []
+    spans.extend(span_ for span_, _ in found)
+    return dates
+
+
+def _leave_days(start: Tuple[int, int, int], end: Tuple[int, int, int]) -> Optional[int]:
+    try:
+        first = datetime.date(start[2] - 543, start[1], start[0])
+        last = datetime.date(end[2] - 543, end[1], end[0])
+    except ValueError:
+        return None
+    days = (last - first).days + 1
+    return days if days > 0 else None
+
+
+def pre_extract(message: str, today: Optional[datetime.date] = None) -> PreExtraction:
+    """แกะช่องที่อ่านด้วย regex ได้แน่นอน คืนฟอร์มที่เดาได้ ช่องที่กรอกแล้ว และข้อความที่เหลือ"""
+    with span("pre_extract"):
+        return _pre_extract(message, today or datetime.date.today())
+
+
+def _pre_extract(message: str, today: datetime.date) -> PreExtraction:
+    form_type = _detect_form_type(message)
+    schema = extractor_schema(form_type) or {}
+    fields: Dict[str, str] = {}
+    spans: List[Tuple[int, int]] = []
+
+    def first(regex) -> Optional[str]:
+        m = regex.search(message)
+        if m:
+            spans.append(m.span())
+        return m.group(0) if m else None
+
+    student_id = first(STUDENT_ID_RE)
+    email = first(EMAIL_RE)
+    mobile = first(MOBILE_RE)
+    landline = first(LANDLINE_RE)
+    mobile = re.sub(r"\D", "", mobile) if mobile else None
+    landline = re.sub(r"\D", "", landline) if landline else None
+
+    candidates = {
+        "student_id": student_id,
+        "student_email": email,
+        "student_tel": mobile or landline,
+        "phone_mobile": mobile,
+        "phone_home": landline,
+    }
+
+    this_year = today.year + 543
+    dates = _extract_dates(message, this_year, spans)
+    if dates:
+        candidates["date_from"] = _fmt_date(*dates[0])
+        candidates["date_to"] = _fmt_date(*dates[-1])
+    days = LEAVE_DAYS_RE.search(message)
+    if days:
+        spans.append(days.span())
+        candidates["leave_days"] = days.group(1)
+    elif dates:
+        counted = _leave_days(dates[0], dates[-1])
+        candidates["leave_days"] = str(counted) if counted else None
+    # วันที่ยื่นคำร้อง = วันนี้ (ปี พ.ศ., เดือนเป็นตัวเลขตามที่ template ใช้)
+    candidates["date_day"] = str(today.day)
+    candidates["date_month"] = f"{today.month:02d}"
+    candidates["date_year"] = str(this_year)
+
+    for name, value in candidates.items():
+        # ยังไม่รู้ฟอร์ม = เก็บไว้ทุกช่อง ตอนรวมกับผล LLM ค่อยตัดช่องที่ฟอร์มนั้นไม่มีทิ้ง
+        if value and (not schema or name in schema):
+            fields[name] = value
+    if form_type:
+        fields["form_type"] = form_type
+
+    # ตัดค่าที่แกะได้ + คำสั่ง/คำนำหน้า ออก แล้วดูว่ายังเหลือเนื้อหาให้ LLM แกะไหม
+    residual = message
+    for start, end in sorted(spans, reverse=True):
+        residual = residual[:start] + " " + residual[end:]
+    residual = FORM_CODE_RE.sub(" ", residual).lower()
+    removable = TRIGGER_WORDS + LABEL_WORDS + [w for ws in FORM_TYPE_HINTS.values() for w in ws]
+    for word in sorted(removable, key=len, reverse=True):
+        residual = residual.replace(word.lower(), " ")
+    residual = re.sub(r"[^\w]|\d|_", "", residual)
+
+    return PreExtraction(form_type, fields, residual)
+
+
+def with_form_type(pre: PreExtraction, form_type: str) -> PreExtraction:
+    """ใส่ฟอร์มที่เลือกได้ทีหลัง (เช่นจาก LLM) แล้วตัดช่องที่ฟอร์มนั้นไม่มีทิ้ง"""
+    schema = extractor_schema(form_type) or {}
+    fields = {k: v for k, v in pre.fields.items() if k in schema}
+    fields["form_type"] = form_type
+    return PreExtraction(form_type, fields, pre.residual)
+
+
+def remaining_schema(pre: PreExtraction) -> Dict[str, str]:
+    """Schema เฉพาะช่องที่กฎยังกรอกไม่ได้ (ใช้เมื่อรู้ฟอร์มแล้ว)"""
+    schema = extractor_schema(pre.form_type) or {}
+    return {k: v for k, v in schema.items() if k not in pre.fields}
+
+
+def merge_extraction(pre: PreExtraction, llm_data: Dict[str, Any]) -> Dict[str, Any]:
+    """รวมผล LLM กับผลจากกฎ ช่องที่กฎอ่านได้ใช้ค่าจากกฎ (แม่นกว่า) และเก็บเฉพาะช่องใน schema"""
+    schema = extractor_schema(pre.form_type) or {}
+    merged = {k: v for k, v in llm_data.items() if k in schema}
+    merged.update(pre.fields)
+    merged["form_type"] = pre.form_type
+    return merged
@@ -0,0 +1,168 @@
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from keyword_index import KeywordIndex
+from metrics import span
+
+# 📂 1. ฐานข้อมูลฟอร์ม (Master Data)
+FORM_MASTER_DATA = [
+    {
+        "id": "RO.01", 
+        "name": "คำร้องทั่วไป (General Request)", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-01.pdf",
+        "keywords": ["คำร้องทั่วไป", "ro01", "ro.01", "general", "อื่นๆ", "เรื่องทั่วไป", "สทน.01"]
+    },
+    {
+        "id": "RO.03", 
+        "name": "หนังสือรับรองของผู้ปกครอง", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-03.pdf",
+        "keywords": ["ผู้ปกครอง", "ro03", "ro.03", "หนังสือรับรอง", "ยินยอม", "parent", "สทน.03"]
+    },
+    {
+        "id": "RO.04", 
+        "name": "ใบมอบฉันทะ", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-04.pdf",
+        "keywords": ["มอบฉันทะ", "ro04", "ro.04", "แทน", "คนอื่นรับแทน", "authorization", "สทน.04"]
+    },
+    {
+        "id": "RO.08", 
+        "name": "คำร้องขอคืนเงินค่าลงทะเบียน", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-08.pdf",
+        "keywords": ["คืนเงิน", "ro08", "ro.08", "refund", "ค่าลงทะเบียน", "จ่ายเกิน", "ขอคืนเงิน", "สทน.08"]
+    },
+    {
+        "id": "กค.18", 
+        "name": "ใบแจ้งความจำนงโอนเงิน", 
+        "url": "https://regis.kmutt.ac.th/service/form/18.pdf",
+        "keywords": ["กค18", "กค.18", "โอนเงินเข้าบัญชี", "รับเงินโอน"]
+    },
+    {
+        "id": "RO.11", 
+        "name": "คำร้องขอเลื่อนรับพระราชทานปริญญาบัตร", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-11.pdf",
+        "keywords": ["รับปริญญา", "ro11", "ro.11", "เลื่อนรับ", "ไม่รับปริญญา", "สทน.11"]
+    },
+    {
+        "id": "RO.12", 
+        "name": "คำร้องขอลาพักการศึกษา", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-12Updated.pdf",
+        "keywords": ["ลาพัก", "ro12", "ro.12", "ดรอปเรียน", "drop", "พักการเรียน", "รักษาสถานภาพ", "สทน.12"]
+    },
+    {
+        "id": "RO.13", 
+        "name": "คำร้องขอลาออก", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-13Updated.pdf",
+        "keywords": ["ลาออก", "ro13", "ro.13", "resignation", "ออก", "quit", "สทน.13"]
+    },
+    {
+        "id": "RO.14", 
+        "name": "คำร้องขอเปลี่ยนแปลงข้อมูลประวัติ", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-14.pdf",
+        "keywords": ["เปลี่ยนชื่อ", "ro14", "ro.14", "เปลี่ยนนามสกุล", "แก้ประวัติ", "ที่อยู่ผิด", "คำนำหน้า", "สทน.14"]
+    },
+    {
+        "id": "RO.15", 
+        "name": "คำร้องขอทำบัตรนักศึกษาใหม่", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-15_160718.pdf",
+        "keywords": ["บัตรหาย", "ro15", "ro.15", "บัตรนักศึกษา", "ทำบัตรใหม่", "บัตรชำรุด", "สทน.15"]
+    },
+    {
+        "id": "RO.16", 
+        "name": "คำร้องขอลาป่วย/ลากิจ", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-16.pdf",
+        "keywords": ["ลาป่วย", "ro16", "ro.16", "ลากิจ", "ป่วย", "ใบรับรองแพทย์", "หยุดเรียน", "sick", "สทน.16"]
+    },
+    {
+        "id": "RO.18", 
+        "name": "คำร้องลงทะเบียนต่ำกว่า/เกินกว่าหน่วยกิต", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-18Updated.pdf",
+        "keywords": ["หน่วยกิตเกิน", "ro18", "ro.18", "หน่วยกิตต่ำ", "ลงทะเบียน", "ลงน้อย", "credits", "สทน.18"]
+    },
+    {
+        "id": "RO.19", 
+        "name": "คำร้องลงทะเบียนวิชาสอบซ้อน", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-19.pdf",
+        "keywords": ["สอบซ้อน", "ro19", "ro.19", "เวลาสอบชน", "exam conflict", "สทน.19"]
+    },
+    {
+        "id": "RO.20", 
+        "name": "คำร้องลงทะเบียนวิชานอกหลักสูตร", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-20.pdf",
+        "keywords": ["นอกหลักสูตร", "ro20", "ro.20", "วิชาเลือกเสรี", "free elective", "สทน.20"]
+    },
+    {
+        "id": "RO.21", 
+        "name": "คำร้องลงทะเบียนเรียนแบบบุคคลภายนอก", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-21.pdf",
+        "keywords": ["บุคคลภายนอก", "ro21", "ro.21", "visitor", "คนนอก", "สทน.21"]
+    },
+    {
+        "id": "RO.22", 
+        "name": "คำร้องขอสมัครสอบโดยไม่ต้องเข้าเรียน / ผ่อนผัน", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-22.pdf",
+        "keywords": ["ขาดเรียน", "ro22", "ro.22", "ผ่อนผัน", "ไม่ได้เข้าเรียน", "สมัครสอบ", "สทน.22"]
+    },
+    {
+        "id": "RO.23", 
+        "name": "คำร้องขอเปลี่ยน/เทียบรายวิชา", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-23.pdf",
+        "keywords": ["เทียบวิชา", "ro23", "ro.23", "เปลี่ยนวิชา", "transfer", "เทียบโอน", "สทน.23"]
+    },
+    {
+        "id": "RO.25", 
+        "name": "ใบลงทะเบียนเรียน", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-25.pdf",
+        "keywords": ["ใบลงทะเบียน", "ro25", "ro.25", "register", "regis", "สทน.25"]  
+    },
+    {
+        "id": "RO.26", 
+        "name": "ใบเพิ่ม-ลด-ถอน-เปลี่ยนกลุ่ม", 
+        "url": "https://regis.kmutt.ac.th/service/form/RO-26Updated.pdf",
+        "keywords": ["เพิ่มวิชา", "ro26", "ro.26", "ถอนวิชา", "เปลี่ยนเซค", "เปลี่ยน sec", "add/drop", "ลดวิชา", "ถอน w", "ติด w", "สทน.26"]
+    },
+]
+
+# เตรียม Text สำหรับ Prompt
+FORM_LIST_TEXT = ""
+for item in FORM_MASTER_DATA:
+    FORM_LIST_TEXT += f"- {item['name']} (รหัส: {item['id']})\n"
+
+# 🚦 คำที่บอกว่าผู้ใช้ต้องการให้ "สร้างไฟล์" (Router ใน /chat)
+TRIGGER_WORDS = ["สร้างไฟล์", "เจนไฟล์", "กรอกให้หน่อย", "ร่างคำร้อง", "ทำเอกสาร", "ออกใบ"]
+
+FORM_BY_ID = {item["id"]: item for item in FORM_MASTER_DATA}
+_FORM_ORDER = {item["id"]: i for i, item in enumerate(FORM_MASTER_DATA)}
+FORM_BY_URL = {item["url"]: item for item in FORM_MASTER_DATA}
+_FORM_BY_FILENAME = {item["url"].rsplit("/", 1)[-1].lower(): item for item in FORM_MASTER_DATA}
+
+def form_id_for_source(source: Optional[str]) -> Optional[str]:
+    """รหัสฟอร์มของไฟล์ต้นทาง (URL ใน PDF_URLS หรือไฟล์ local ชื่อเดียวกับใน URL) ไม่รู้จัก = None"""
+    if not source:
+        return None
+    item = FORM_BY_URL.get(source) or _FORM_BY_FILENAME.get(os.path.basename(source).lower())
+    return item["id"] if item else None
+
+# Index เดียวครอบทั้ง trigger และ keyword ทุกฟอร์ม สร้างครั้งเดียวตอน import
+MESSAGE_INDEX = KeywordIndex(
+    [(word, ("trigger", word)) for word in TRIGGER_WORDS]
+    + [(kw, ("form", item["id"])) for item in FORM_MASTER_DATA for kw in item["keywords"]]
+)
+
+class MessageMatch(NamedTuple):
+    triggers: List[str]
+    forms: List[Dict[str, Any]]
+
+def match_message(message: str) -> MessageMatch:
+    """สแกนข้อความรอบเดียว คืน trigger ที่เจอ และฟอร์มที่ตรง (เรียงตาม FORM_MASTER_DATA)"""
+    triggers: List[str] = []
+    form_ids = set()
+    with span("keyword_match"):
+        hits = MESSAGE_INDEX.search(message)
+    for _, (kind, value) in hits:
+        if kind == "trigger":
+            if value not in triggers:
+                triggers.append(value)
+        else:
+            form_ids.add(value)
+    forms = [FORM_BY_ID[fid] for fid in sorted(form_ids, key=_FORM_ORDER.__getitem__)]
+    return MessageMatch(triggers, forms)
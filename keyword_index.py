@@ -0,0 +1,60 @@
+from collections import deque
+from typing import Any, Dict, Iterable, List, Tuple
+
+# ---------------------------------------------------------
+# Aho-Corasick automaton สำหรับจับ keyword หลายคำในรอบเดียว
+# เดินทีละตัวอักษร จึงใช้กับภาษาไทย (ไม่มีช่องว่างคั่นคำ) ได้ตรงๆ
+# และเจอ keyword ที่ซ้อนกันได้ครบ เช่น "ลงทะเบียน" ใน "ใบลงทะเบียน"
+# ---------------------------------------------------------
+
+class KeywordIndex:
+    def __init__(self, entries: Iterable[Tuple[str, Any]]):
+        """entries: คู่ (keyword, payload) keyword จะถูกแปลงเป็นตัวพิมพ์เล็ก"""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, Any]]] = [[]]
+
+        for keyword, payload in entries:
+            keyword = keyword.lower()
+            if not keyword:
+                continue
+            node = 0
+            for ch in keyword:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((keyword, payload))
+
+        # สร้าง failure link แบบ BFS แล้วรวม output ของ suffix เข้ามา
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def search(self, text: str) -> List[Tuple[str, Any]]:
+        """คืน (keyword, payload) ทุกตัวที่เจอในข้อความ ตามลำดับตำแหน่งที่จบ"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found: List[Tuple[str, Any]] = []
+        node = 0
+        for ch in text.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.extend(out[node])
+        return found
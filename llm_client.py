@@ -0,0 +1,378 @@
+import asyncio
+import collections
+import random
+import time
+import types
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import groq
+import httpx
+
+import metrics
+
+# ---------------------------------------------------------
+# ชั้นเรียก Groq ที่ทนต่อ API สะดุด (เรียกแบบเดียวกับ AsyncGroq: client.chat.completions.create)
+# - connection pool ของ httpx ใช้ร่วมทุก request (ไม่ต้อง handshake TLS ใหม่ทุกครั้ง)
+# - deadline ต่อการเรียก (รวมเวลารอคิว + retry) แทนการรอจน proxy ตัด
+# - retry แบบ backoff + jitter เฉพาะ 429 / 5xx / timeout / ต่อไม่ติด
+# - hedge: ช้ากว่า percentile ที่ตั้งไว้ ยิงตัวที่สองซ้อน ใครเสร็จก่อนใช้ตัวนั้น
+# - circuit breaker ต่อ model ล่มติดกันหลายครั้ง = สลับไป fallback model ชั่วคราว
+# - semaphore รวมทั้ง process กัน burst เกิน rate limit
+# ทดสอบกับ server ปลอมได้ด้วย GROQ_BASE_URL (ดู benchmarks/fake_groq_server.py)
+# ---------------------------------------------------------
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+LLM_REQUESTS = metrics.REGISTRY.register(metrics.Counter(
+    "llm_requests_total", "Groq HTTP attempts by model and outcome", ("model", "outcome")
+))
+LLM_RETRIES = metrics.REGISTRY.register(metrics.Counter(
+    "llm_retries_total", "Groq calls retried, by model and reason", ("model", "reason")
+))
+LLM_HEDGES = metrics.REGISTRY.register(metrics.Counter(
+    "llm_hedged_requests_total", "Hedged second requests, by which one answered first", ("model", "winner")
+))
+LLM_FALLBACKS = metrics.REGISTRY.register(metrics.Counter(
+    "llm_fallback_total", "Calls sent to the fallback model while the primary circuit was open", ("model",)
+))
+
+
+class CircuitOpen(Exception):
+    """model หลักล่ม (circuit เปิดอยู่) และไม่มี fallback model ให้ใช้"""
+
+
+# token ของ request ที่ผ่านตอน circuit ปิดอยู่ (ไม่ใช่ probe)
+_PASS = object()
+
+
+class CircuitBreaker:
+    """ล่มติดกัน threshold ครั้ง = เปิด circuit ไม่ยิงไปอีก cooldown วินาที แล้วปล่อยให้ลองทีละครั้ง
+
+    allow() คืน token (None = ห้ามยิง) ให้ส่งกลับมาตอน record_success / record_failure / abandon
+    request ที่ถือ token ของรอบลอง (probe) เท่านั้นที่ปิดรอบลองได้ request อื่นที่ค้างอยู่ไม่ทำให้มี probe ซ้อน
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> Optional[object]:
+        state = self.state
+        if state == "closed":
+            return _PASS
+        if state == "half_open" and self._probe is None:
+            # ปล่อย request เดียวไปลองก่อน ที่เหลือยังไป fallback
+            self._probe = object()
+            return self._probe
+        return None
+
+    def _end_probe(self, token: Optional[object]) -> bool:
+        if token is not None and token is self._probe:
+            self._probe = None
+            return True
+        return False
+
+    def record_success(self, token: Optional[object] = None) -> None:
+        # ใครสำเร็จก็ได้ = model กลับมาแล้ว ปิด circuit (probe ที่ยังค้างอยู่ไม่มีความหมายแล้ว)
+        self.failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def abandon(self, token: Optional[object] = None) -> None:
+        # probe ถูกยกเลิกกลางทาง (ไม่รู้ผล) ให้ request ถัดไปลองแทน (request ปกติที่ถูกยกเลิกไม่เกี่ยว)
+        self._end_probe(token)
+
+    def record_failure(self, token: Optional[object] = None) -> None:
+        self.failures += 1
+        if self._end_probe(token) or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """เวลาตอบล่าสุด N ครั้ง ใช้หา percentile สำหรับ hedge"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = collections.deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def _retry_reason(exc: BaseException) -> Optional[str]:
+    """เหตุผลที่ retry ได้ (ใช้เป็น label) หรือ None ถ้าเป็น error ที่ลองใหม่ก็ไม่หาย"""
+    if isinstance(exc, (asyncio.TimeoutError, groq.APITimeoutError)):
+        return "timeout"
+    if isinstance(exc, groq.APIConnectionError):
+        return "connection"
+    if isinstance(exc, groq.APIStatusError) and exc.status_code in RETRYABLE_STATUS:
+        return str(exc.status_code)
+    return None
+
+
+def _outcome(exc: BaseException) -> str:
+    # ถูกยกเลิก = แพ้ hedge หรือหมด deadline ไม่ใช่ความผิดของ Groq
+    if isinstance(exc, asyncio.CancelledError):
+        return "cancelled"
+    return _retry_reason(exc) or "error"
+
+
+def _retry_after(exc: BaseException) -> float:
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+class _Completions:
+    def __init__(self, owner: "ResilientGroq"):
+        self._owner = owner
+
+    async def create(self, **kwargs: Any) -> Any:
+        return await self._owner.create(**kwargs)
+
+
+class _SlotStream:
+    """stream ที่ถือ slot ของ semaphore ไว้ คืนตอนอ่านจนจบ / error หรือตอน aclose()
+    (เรียก aclose() ได้แม้ยังไม่เคยวนอ่าน และเรียกซ้ำได้ ฝั่งผู้ใช้ควรเรียกใน finally เสมอ)"""
+
+    def __init__(self, owner: "ResilientGroq", stream: Any):
+        self._owner: Optional["ResilientGroq"] = owner
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+
+    def __aiter__(self) -> "_SlotStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._owner is None:
+            raise StopAsyncIteration
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    def _release(self) -> bool:
+        if self._owner is None:
+            return False
+        owner, self._owner = self._owner, None
+        owner.in_flight -= 1
+        owner._semaphore.release()
+        return True
+
+    async def aclose(self) -> None:
+        if not self._release():
+            return
+        close = getattr(self._stream, "close", None) or getattr(self._stream, "aclose", None)
+        if close is not None:
+            await close()
+
+    def __del__(self) -> None:
+        # กันพลาด: ถูกทิ้งโดยไม่ได้ aclose() ก็ยังคืน slot (connection ปล่อยให้ GC ของ httpx จัดการ)
+        self._release()
+
+
+class ResilientGroq:
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: Optional[str] = None,
+        *,
+        fallback_model: Optional[str] = None,
+        max_concurrency: int = 16,
+        deadline: float = 20.0,
+        connect_timeout: float = 3.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        hedge_percentile: float = 0,
+        breaker_failures: int = 5,
+        breaker_cooldown: float = 30.0,
+        pool_size: int = 32,
+        keepalive: float = 30.0,
+    ):
+        self.fallback_model = fallback_model or None
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.in_flight = 0
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyWindow] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive,
+            ),
+            timeout=httpx.Timeout(deadline, connect=connect_timeout),
+        )
+        # retry ของ SDK ปิดไว้ ให้ชั้นนี้คุมเองทั้งหมด (ไม่งั้น deadline นับไม่ถูก)
+        self._client = groq.AsyncGroq(
+            api_key=api_key,
+            base_url=base_url or None,
+            max_retries=0,
+            timeout=httpx.Timeout(deadline, connect=connect_timeout),
+            http_client=self._http,
+        )
+        self.chat = types.SimpleNamespace(completions=_Completions(self))
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+        return breaker
+
+    def _pick_model(self, model: str) -> Tuple[str, object]:
+        token = self._breaker(model).allow()
+        if token is not None:
+            return model, token
+        if self.fallback_model and self.fallback_model != model:
+            token = self._breaker(self.fallback_model).allow()
+            if token is not None:
+                LLM_FALLBACKS.inc(model=self.fallback_model)
+                return self.fallback_model, token
+        raise CircuitOpen(f"Groq model {model} is unavailable (circuit open)")
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        # full jitter: สุ่ม 0..base*2^n กัน client หลายตัว retry พร้อมกัน แต่ไม่ต่ำกว่า Retry-After ของ 429
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return max(random.uniform(0, ceiling), _retry_after(exc))
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        if not self.hedge_percentile:
+            return None
+        window = self._latency.get(model)
+        return window.percentile(self.hedge_percentile) if window else None
+
+    async def create(self, *, model: str, deadline: Optional[float] = None, **kwargs: Any) -> Any:
+        """เหมือน AsyncGroq.chat.completions.create แต่มี deadline รวม (วินาที) และ retry/fallback ให้"""
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            target, token = self._pick_model(model)
+            try:
+                result = await self._attempt(target, kwargs, deadline_at)
+            except asyncio.CancelledError:
+                self._breaker(target).abandon(token)
+                raise
+            except Exception as exc:
+                reason = _retry_reason(exc)
+                if reason is None:
+                    # เช่น 400 / auth: server ยังตอบได้ปกติ ไม่นับเป็นล่ม
+                    self._breaker(target).record_success(token)
+                    raise
+                self._breaker(target).record_failure(token)
+                attempt += 1
+                delay = self._backoff(attempt, exc)
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline_at:
+                    if isinstance(exc, asyncio.TimeoutError):
+                        raise TimeoutError(f"Groq call exceeded its {deadline or self.deadline}s deadline") from None
+                    raise
+                LLM_RETRIES.inc(model=target, reason=reason)
+                await asyncio.sleep(delay)
+                continue
+            self._breaker(target).record_success(token)
+            return result
+
+    async def _attempt(self, model: str, kwargs: Dict[str, Any], deadline_at: float) -> Any:
+        if kwargs.get("stream"):
+            return await self._open_stream(model, kwargs, deadline_at)
+        hedge_after = self._hedge_delay(model)
+        first = asyncio.create_task(self._call(model, kwargs, deadline_at))
+        tasks = {first}
+        try:
+            if hedge_after is None or time.monotonic() + hedge_after >= deadline_at:
+                return await first
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done:
+                return first.result()
+            second = asyncio.create_task(self._call(model, kwargs, deadline_at))
+            tasks.add(second)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        LLM_HEDGES.inc(model=model, winner="hedge" if task is second else "primary")
+                        return task.result()
+                    error = task.exception()
+            LLM_HEDGES.inc(model=model, winner="none")
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call(self, model: str, kwargs: Dict[str, Any], deadline_at: float) -> Any:
+        # รอคิว semaphore นับรวมใน deadline ด้วย
+        timeout = max(deadline_at - time.monotonic(), 0)
+        return await asyncio.wait_for(self._call_with_slot(model, kwargs), timeout)
+
+    async def _call_with_slot(self, model: str, kwargs: Dict[str, Any]) -> Any:
+        async with self._semaphore:
+            self.in_flight += 1
+            started = time.monotonic()
+            try:
+                response = await self._client.chat.completions.create(model=model, **kwargs)
+            except BaseException as exc:
+                LLM_REQUESTS.inc(model=model, outcome=_outcome(exc))
+                raise
+            finally:
+                self.in_flight -= 1
+        self._latency.setdefault(model, LatencyWindow()).add(time.monotonic() - started)
+        LLM_REQUESTS.inc(model=model, outcome="ok")
+        return response
+
+    async def _open_stream(self, model: str, kwargs: Dict[str, Any], deadline_at: float) -> Any:
+        # stream: deadline ครอบถึงตอนเปิด stream ได้ (retry ได้แค่ก่อน token แรก) slot คืนตอน stream จบ
+        timeout = max(deadline_at - time.monotonic(), 0)
+        await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        self.in_flight += 1
+        try:
+            stream = await asyncio.wait_for(
+                self._client.chat.completions.create(model=model, **kwargs),
+                max(deadline_at - time.monotonic(), 0),
+            )
+        except BaseException as exc:
+            self.in_flight -= 1
+            self._semaphore.release()
+            LLM_REQUESTS.inc(model=model, outcome=_outcome(exc))
+            raise
+        LLM_REQUESTS.inc(model=model, outcome="ok")
+        return _SlotStream(self, stream)
+
+    def stats(self) -> Dict[str, Any]:
+        breakers = list(self._breakers.values())
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "open_circuits": sum(1 for b in breakers if b.state != "closed"),
+        }
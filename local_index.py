@@ -0,0 +1,266 @@
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import SparseEmbeddings
+
+from forms import form_id_for_source
+
+# ---------------------------------------------------------
+# Vector index แบบ local (ไม่ต้องยิง Qdrant ทุก request)
+# upload_data.py export snapshot ของ collection มาเป็นไฟล์:
+#   dense.npy          เมทริกซ์ dense (normalize แล้ว) โหลดแบบ memmap
+#   sparse_*.npy       inverted index ของ BM25 (term -> [doc, weight])
+#   payloads.json      id / page_content / metadata ของแต่ละ chunk
+# ค้นหาแบบ hybrid ให้ผลเหมือน RetrievalMode.HYBRID ของ QdrantVectorStore:
+# prefetch dense k ตัว + sparse k ตัว แล้วรวมด้วย RRF แบบเดียวกับ Qdrant
+# ระบุ form_ids = ค้นเฉพาะ chunk ของฟอร์มนั้น (เหมือน filter metadata.form_id ของ Qdrant)
+# ระบุ boost_form_ids = เพิ่ม prefetch ที่กรองเฉพาะฟอร์มนั้นเข้า RRF ด้วย (ดันขึ้น แต่ไม่ตัดฟอร์มอื่นทิ้ง)
+# ---------------------------------------------------------
+
+# ค่าคงที่ของ RRF ที่ Qdrant ใช้ (score = 1 / (rank + k), rank เริ่มที่ 0)
+RRF_K = 2
+MANIFEST_FILE = "manifest.json"
+FORMAT_VERSION = 1
+
+
+def export_local_index(
+    client: Any,
+    collection_name: str,
+    directory: str,
+    dense_vector_name: str = "dense_vector",
+    sparse_vector_name: str = "sparse_vector",
+) -> int:
+    """ดึงทุก point จาก collection มาเขียนเป็น snapshot คืนจำนวน chunk ที่ export"""
+    ids, payloads, dense_rows = [], [], []
+    postings: Dict[int, List[tuple]] = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name, limit=256, offset=offset, with_payload=True, with_vectors=True
+        )
+        for point in points:
+            doc = len(ids)
+            ids.append(str(point.id))
+            payloads.append(point.payload or {})
+            dense_rows.append(point.vector[dense_vector_name])
+            sparse = point.vector.get(sparse_vector_name)
+            if sparse is not None:
+                for term, weight in zip(sparse.indices, sparse.values):
+                    postings.setdefault(term, []).append((doc, weight))
+        if offset is None:
+            break
+
+    dense = np.asarray(dense_rows, dtype=np.float32) if ids else np.zeros((0, 0), np.float32)
+    # distance=COSINE: Qdrant normalize ตอนเก็บ เราก็ normalize ไว้ก่อน ตอนค้นหาเหลือแค่ dot product
+    norms = np.linalg.norm(dense, axis=1, keepdims=True)
+    dense /= np.where(norms == 0, 1, norms)
+
+    terms = np.array(sorted(postings), dtype=np.int64)
+    lengths = [len(postings[t]) for t in terms]
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = [entry for t in terms for entry in postings[int(t)]]
+    docs = np.array([d for d, _ in flat], dtype=np.int32)
+    weights = np.array([w for _, w in flat], dtype=np.float32)
+
+    # เขียนลงโฟลเดอร์ชั่วคราวแล้วสลับทีเดียว server ที่เปิดไฟล์ชุดเก่าอยู่จะไม่เห็นไฟล์ครึ่งๆ
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".local_index.", dir=parent)
+    np.save(os.path.join(tmp_dir, "dense.npy"), dense)
+    np.save(os.path.join(tmp_dir, "sparse_terms.npy"), terms)
+    np.save(os.path.join(tmp_dir, "sparse_offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "sparse_docs.npy"), docs)
+    np.save(os.path.join(tmp_dir, "sparse_weights.npy"), weights)
+    with open(os.path.join(tmp_dir, "payloads.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "payloads": payloads}, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(
+            {"version": FORMAT_VERSION, "collection": collection_name, "count": len(ids)}, f
+        )
+
+    old_dir = None
+    if os.path.exists(directory):
+        old_dir = tempfile.mkdtemp(prefix=".local_index.old.", dir=parent)
+        os.replace(directory, os.path.join(old_dir, "index"))
+    os.replace(tmp_dir, directory)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return len(ids)
+
+
+class LocalHybridIndex:
+    """ค้นหา hybrid ใน process จาก snapshot ที่ export ไว้ (ใช้แทน QdrantVectorStore ได้)"""
+
+    def __init__(
+        self,
+        directory: str,
+        embedding: Embeddings,
+        sparse_embedding: SparseEmbeddings,
+    ):
+        self.directory = directory
+        self.embedding = embedding
+        self.sparse_embedding = sparse_embedding
+        self.signature = self.manifest_signature(directory)
+
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported local index version: {manifest.get('version')}")
+        self.collection_name = manifest["collection"]
+
+        self._dense = np.load(os.path.join(directory, "dense.npy"), mmap_mode="r")
+        self._terms = np.load(os.path.join(directory, "sparse_terms.npy"))
+        self._offsets = np.load(os.path.join(directory, "sparse_offsets.npy"))
+        self._docs = np.load(os.path.join(directory, "sparse_docs.npy"), mmap_mode="r")
+        self._weights = np.load(os.path.join(directory, "sparse_weights.npy"), mmap_mode="r")
+        with open(os.path.join(directory, "payloads.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        self._ids = data["ids"]
+        self._payloads = data["payloads"]
+        # form_id -> index ของ chunk (snapshot ก่อนมี form_id ใน payload ใช้ URL ต้นทางแทน)
+        by_form: Dict[str, List[int]] = {}
+        for doc, payload in enumerate(self._payloads):
+            metadata = payload.get("metadata") or {}
+            form_id = metadata.get("form_id") or form_id_for_source(metadata.get("source"))
+            if form_id:
+                by_form.setdefault(form_id, []).append(doc)
+        self._form_docs = {fid: np.array(docs, dtype=np.int64) for fid, docs in by_form.items()}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @staticmethod
+    def manifest_signature(directory: str) -> Optional[tuple]:
+        """(inode, mtime) ของ manifest: export ใหม่สลับทั้งโฟลเดอร์ จึงได้ไฟล์ใหม่เสมอ"""
+        try:
+            st = os.stat(os.path.join(directory, MANIFEST_FILE))
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def is_stale(self) -> bool:
+        """มี snapshot ชุดใหม่มาแทนชุดที่เปิดอยู่ (ระหว่างสลับโฟลเดอร์ยังไม่นับ)"""
+        current = self.manifest_signature(self.directory)
+        return current is not None and current != self.signature
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, candidates: np.ndarray, k: int) -> np.ndarray:
+        """index ของ candidate ที่คะแนนสูงสุด k ตัว เรียงจากมากไปน้อย"""
+        if len(candidates) > k:
+            part = np.argpartition(-scores[candidates], k - 1)[:k]
+            candidates = candidates[part]
+        # stable sort เพื่อให้คะแนนเท่ากันได้ลำดับเดิมทุกครั้ง
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    def docs_for_forms(self, form_ids: Sequence[str]) -> np.ndarray:
+        """index ของ chunk ที่เป็นของฟอร์มใดฟอร์มหนึ่งใน form_ids (เรียงจากน้อยไปมาก)"""
+        parts = [self._form_docs[fid] for fid in form_ids if fid in self._form_docs]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts))
+
+    def dense_search(self, vector: List[float], k: int, allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        if len(self) == 0 or k <= 0 or (allowed is not None and len(allowed) == 0):
+            return np.empty(0, dtype=np.int64)
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if allowed is not None:
+            # คูณเฉพาะแถวที่ผ่าน filter
+            scores = self._dense[allowed] @ query
+            return allowed[self._top_k(scores, np.arange(len(scores)), k)]
+        scores = self._dense @ query
+        return self._top_k(scores, np.arange(len(scores)), k)
+
+    def sparse_search(
+        self, indices: List[int], values: List[float], k: int, allowed: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        if len(self) == 0 or len(self._terms) == 0 or k <= 0 or not len(indices):
+            return np.empty(0, dtype=np.int64)
+        if allowed is not None and len(allowed) == 0:
+            return np.empty(0, dtype=np.int64)
+        query_terms = np.asarray(indices, dtype=np.int64)
+        query_values = np.asarray(values, dtype=np.float32)
+        pos = np.minimum(np.searchsorted(self._terms, query_terms), len(self._terms) - 1)
+        found = self._terms[pos] == query_terms
+        scores = np.zeros(len(self), dtype=np.float32)
+        matched = np.zeros(len(self), dtype=bool)
+        for p, qv in zip(pos[found], query_values[found]):
+            start, end = self._offsets[p], self._offsets[p + 1]
+            docs = self._docs[start:end]
+            np.add.at(scores, docs, self._weights[start:end] * qv)
+            matched[docs] = True
+        if allowed is not None:
+            in_filter = np.zeros(len(self), dtype=bool)
+            in_filter[allowed] = True
+            matched &= in_filter
+        # Qdrant คืนเฉพาะ point ที่มี term ตรงกันอย่างน้อยหนึ่งตัว
+        return self._top_k(scores, np.flatnonzero(matched), k)
+
+    def _document(self, doc: int) -> Document:
+        payload = self._payloads[doc]
+        metadata = dict(payload.get("metadata") or {})
+        metadata["_id"] = self._ids[doc]
+        metadata["_collection_name"] = self.collection_name
+        return Document(page_content=payload.get("page_content", ""), metadata=metadata)
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        form_ids: Optional[Sequence[str]] = None,
+        boost_form_ids: Optional[Sequence[str]] = None,
+    ) -> List[tuple]:
+        """form_ids = ค้นเฉพาะฟอร์มเหล่านี้, boost_form_ids = เพิ่ม prefetch เฉพาะฟอร์มเหล่านี้เข้า RRF
+        (เหมือน prefetch ที่มี filter ใน query_points ของ Qdrant: chunk ของฟอร์มนั้นได้คะแนนเพิ่ม)"""
+        allowed = None
+        if form_ids is not None:
+            allowed = self.docs_for_forms(form_ids)
+            if len(allowed) == 0:
+                return []
+        dense_query = self.embedding.embed_query(query)
+        sparse_query = self.sparse_embedding.embed_query(query)
+        prefetch = [
+            self.dense_search(dense_query, k, allowed),
+            self.sparse_search(sparse_query.indices, sparse_query.values, k, allowed),
+        ]
+        if boost_form_ids:
+            boosted = self.docs_for_forms(boost_form_ids)
+            if allowed is not None:
+                boosted = np.intersect1d(boosted, allowed)
+            if len(boosted):
+                prefetch.append(self.dense_search(dense_query, k, boosted))
+                prefetch.append(self.sparse_search(sparse_query.indices, sparse_query.values, k, boosted))
+
+        fused: Dict[int, float] = {}
+        for hits in prefetch:
+            for rank, doc in enumerate(hits.tolist()):
+                fused[doc] = fused.get(doc, 0.0) + 1.0 / (rank + RRF_K)
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self._document(doc), score) for doc, score in ranked]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        form_ids: Optional[Sequence[str]] = None,
+        boost_form_ids: Optional[Sequence[str]] = None,
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, form_ids, boost_form_ids)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "local",
+            "directory": self.directory,
+            "chunks": len(self),
+            "terms": int(len(self._terms)),
+            "forms": len(self._form_docs),
+        }
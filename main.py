@@ -1,155 +1,162 @@
 import os
 import re
 import json
+import time
+import asyncio
+import tempfile
+import threading
 import uvicorn
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, NamedTuple, Optional, AsyncIterator, Callable
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
-from fastapi.staticfiles import StaticFiles # ไว้สำหรับทำ Link Download
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 from langchain_qdrant import QdrantVectorStore, FastEmbedSparse, RetrievalMode
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from groq import AsyncGroq
 from dotenv import load_dotenv
 from urllib.parse import quote
 
 # Import ฟังก์ชันสร้างไฟล์ที่เราแยกไว้
-from document_generator import generate_document_stream, generate_document_auto
+from document_generator import generate_document_stream, warm_template_cache, TEMPLATE_MAP
+from forms import FORM_BY_ID, MessageMatch, form_id_for_source, match_message
+from advisor_context import context_budget, pack_context
+from extraction import (
+    EXTRACTION_PATH,
+    FORM_CLASSIFICATION,
+    PreExtraction,
+    form_choices_text,
+    merge_extraction,
+    pre_extract,
+    remaining_schema,
+    warm_extractor_schemas,
+    with_form_type,
+)
+from render_pool import RenderPool, RenderPoolSaturated
+from zip_stream import ZipStreamWriter
+from output_store import OutputStore
+from cache import LRUCache, TTLCache, SharedTTLCache, CachedEmbeddings, CachedSparseEmbeddings, normalize_query
+import metrics
+from metrics import span
+from local_index import LocalHybridIndex
+from llm_client import ResilientGroq
+from admission import (
+    PRIORITY_CHAT,
+    PRIORITY_CHEAP,
+    PRIORITY_FILE,
+    AdmissionQueue,
+    ADMISSIONS,
+    ClientRateLimiter,
+    Rejected,
+    Slot,
+)
+import worker_state
+from config import (
+    QDRANT_URL,
+    QDRANT_API_KEY,
+    COLLECTION_NAME,
+    DENSE_VECTOR_NAME,
+    SPARSE_VECTOR_NAME,
+    FORM_ID_KEY,
+    DENSE_MODEL_NAME,
+    SPARSE_MODEL_NAME,
+    MODEL_CACHE_DIR,
+)
 
 load_dotenv()
 
 # ================= CONFIGURATION =================
-QDRANT_URL = os.environ.get("QDRANT_URL")
-QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-COLLECTION_NAME = "demo_collection_railway_v2"
-
-# 📂 1. ฐานข้อมูลฟอร์ม (Master Data)
-FORM_MASTER_DATA = [
-    {
-        "id": "RO.01", 
-        "name": "คำร้องทั่วไป (General Request)", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-01.pdf",
-        "keywords": ["คำร้องทั่วไป", "ro01", "ro.01", "general", "อื่นๆ", "เรื่องทั่วไป", "สทน.01"]
-    },
-    {
-        "id": "RO.03", 
-        "name": "หนังสือรับรองของผู้ปกครอง", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-03.pdf",
-        "keywords": ["ผู้ปกครอง", "ro03", "ro.03", "หนังสือรับรอง", "ยินยอม", "parent", "สทน.03"]
-    },
-    {
-        "id": "RO.04", 
-        "name": "ใบมอบฉันทะ", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-04.pdf",
-        "keywords": ["มอบฉันทะ", "ro04", "ro.04", "แทน", "คนอื่นรับแทน", "authorization", "สทน.04"]
-    },
-    {
-        "id": "RO.08", 
-        "name": "คำร้องขอคืนเงินค่าลงทะเบียน", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-08.pdf",
-        "keywords": ["คืนเงิน", "ro08", "ro.08", "refund", "ค่าลงทะเบียน", "จ่ายเกิน", "ขอคืนเงิน", "สทน.08"]
-    },
-    {
-        "id": "กค.18", 
-        "name": "ใบแจ้งความจำนงโอนเงิน", 
-        "url": "https://regis.kmutt.ac.th/service/form/18.pdf",
-        "keywords": ["กค18", "กค.18", "โอนเงินเข้าบัญชี", "รับเงินโอน"]
-    },
-    {
-        "id": "RO.11", 
-        "name": "คำร้องขอเลื่อนรับพระราชทานปริญญาบัตร", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-11.pdf",
-        "keywords": ["รับปริญญา", "ro11", "ro.11", "เลื่อนรับ", "ไม่รับปริญญา", "สทน.11"]
-    },
-    {
-        "id": "RO.12", 
-        "name": "คำร้องขอลาพักการศึกษา", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-12Updated.pdf",
-        "keywords": ["ลาพัก", "ro12", "ro.12", "ดรอปเรียน", "drop", "พักการเรียน", "รักษาสถานภาพ", "สทน.12"]
-    },
-    {
-        "id": "RO.13", 
-        "name": "คำร้องขอลาออก", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-13Updated.pdf",
-        "keywords": ["ลาออก", "ro13", "ro.13", "resignation", "ออก", "quit", "สทน.13"]
-    },
-    {
-        "id": "RO.14", 
-        "name": "คำร้องขอเปลี่ยนแปลงข้อมูลประวัติ", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-14.pdf",
-        "keywords": ["เปลี่ยนชื่อ", "ro14", "ro.14", "เปลี่ยนนามสกุล", "แก้ประวัติ", "ที่อยู่ผิด", "คำนำหน้า", "สทน.14"]
-    },
-    {
-        "id": "RO.15", 
-        "name": "คำร้องขอทำบัตรนักศึกษาใหม่", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-15_160718.pdf",
-        "keywords": ["บัตรหาย", "ro15", "ro.15", "บัตรนักศึกษา", "ทำบัตรใหม่", "บัตรชำรุด", "สทน.15"]
-    },
-    {
-        "id": "RO.16", 
-        "name": "คำร้องขอลาป่วย/ลากิจ", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-16.pdf",
-        "keywords": ["ลาป่วย", "ro16", "ro.16", "ลากิจ", "ป่วย", "ใบรับรองแพทย์", "หยุดเรียน", "sick", "สทน.16"]
-    },
-    {
-        "id": "RO.18", 
-        "name": "คำร้องลงทะเบียนต่ำกว่า/เกินกว่าหน่วยกิต", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-18Updated.pdf",
-        "keywords": ["หน่วยกิตเกิน", "ro18", "ro.18", "หน่วยกิตต่ำ", "ลงทะเบียน", "ลงน้อย", "credits", "สทน.18"]
-    },
-    {
-        "id": "RO.19", 
-        "name": "คำร้องลงทะเบียนวิชาสอบซ้อน", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-19.pdf",
-        "keywords": ["สอบซ้อน", "ro19", "ro.19", "เวลาสอบชน", "exam conflict", "สทน.19"]
-    },
-    {
-        "id": "RO.20", 
-        "name": "คำร้องลงทะเบียนวิชานอกหลักสูตร", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-20.pdf",
-        "keywords": ["นอกหลักสูตร", "ro20", "ro.20", "วิชาเลือกเสรี", "free elective", "สทน.20"]
-    },
-    {
-        "id": "RO.21", 
-        "name": "คำร้องลงทะเบียนเรียนแบบบุคคลภายนอก", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-21.pdf",
-        "keywords": ["บุคคลภายนอก", "ro21", "ro.21", "visitor", "คนนอก", "สทน.21"]
-    },
-    {
-        "id": "RO.22", 
-        "name": "คำร้องขอสมัครสอบโดยไม่ต้องเข้าเรียน / ผ่อนผัน", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-22.pdf",
-        "keywords": ["ขาดเรียน", "ro22", "ro.22", "ผ่อนผัน", "ไม่ได้เข้าเรียน", "สมัครสอบ", "สทน.22"]
-    },
-    {
-        "id": "RO.23", 
-        "name": "คำร้องขอเปลี่ยน/เทียบรายวิชา", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-23.pdf",
-        "keywords": ["เทียบวิชา", "ro23", "ro.23", "เปลี่ยนวิชา", "transfer", "เทียบโอน", "สทน.23"]
-    },
-    {
-        "id": "RO.25", 
-        "name": "ใบลงทะเบียนเรียน", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-25.pdf",
-        "keywords": ["ใบลงทะเบียน", "ro25", "ro.25", "register", "regis", "สทน.25"]  
-    },
-    {
-        "id": "RO.26", 
-        "name": "ใบเพิ่ม-ลด-ถอน-เปลี่ยนกลุ่ม", 
-        "url": "https://regis.kmutt.ac.th/service/form/RO-26Updated.pdf",
-        "keywords": ["เพิ่มวิชา", "ro26", "ro.26", "ถอนวิชา", "เปลี่ยนเซค", "เปลี่ยน sec", "add/drop", "ลดวิชา", "ถอน w", "ติด w", "สทน.26"]
-    },
-]
-
-# เตรียม Text สำหรับ Prompt
-FORM_LIST_TEXT = ""
-for item in FORM_MASTER_DATA:
-    FORM_LIST_TEXT += f"- {item['name']} (รหัส: {item['id']})\n"
+# ไม่ตั้ง = api.groq.com (ชี้ไป benchmarks/fake_groq_server.py เพื่อทดสอบ retry/timeout ได้)
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL")
+
+# การเรียก LLM: model หลัก / model สำรองตอน circuit ของตัวหลักเปิด (ว่าง = ไม่มี ตอบ error ทันที)
+LLM_MODEL = os.environ.get("LLM_MODEL", "llama-3.1-8b-instant")
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "")
+# deadline ต่อการเรียก (รวม retry) / retry สูงสุด / เรียกพร้อมกันได้กี่งานทั้ง process
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 20))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+# ช้ากว่า percentile นี้ของเวลาตอบล่าสุด ยิง request ที่สองซ้อน (0 = ไม่ hedge, เปลือง token เพิ่ม)
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", 0))
+# ล่มติดกันกี่ครั้งถึงเปิด circuit และเปิดค้างไว้กี่วินาทีก่อนลองใหม่
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", 30))
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 32))
+
+# Admission control หน้า /chat: request ที่ต้องเรียก LLM ทำพร้อมกันได้กี่งาน (0 = ไม่จำกัด)
+# ที่เกินรอในคิวได้กี่งาน / นานสุดกี่วินาที เกินกว่านั้นตอบ 503 + Retry-After ทันที
+ADMISSION_MAX_ACTIVE = int(os.environ.get("ADMISSION_MAX_ACTIVE", LLM_MAX_CONCURRENCY))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", ADMISSION_MAX_ACTIVE * 4))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 8))
+# token bucket ต่อ client: request ที่ต้องเรียก LLM ได้กี่ครั้ง/นาที และยิงติดกันได้กี่ครั้ง (0 = ไม่จำกัด)
+# ตอบจาก cache / ดาวน์โหลดไฟล์ หัก token แค่ RATE_LIMIT_CHEAP_COST
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", 20))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 10))
+RATE_LIMIT_CHEAP_COST = float(os.environ.get("RATE_LIMIT_CHEAP_COST", 0.1))
+# header ที่ proxy ใส่ IP จริงของ client (เช่น X-Forwarded-For) ไม่ตั้ง = ใช้ IP ที่ต่อเข้ามาตรงๆ
+CLIENT_IP_HEADER = os.environ.get("CLIENT_IP_HEADER")
+# จำนวน proxy ที่เชื่อถือได้หน้า API: อ่าน IP ตัวที่ N จากขวา (ตัวซ้ายสุด client ปลอมมาเองได้)
+TRUSTED_PROXY_COUNT = max(1, int(os.environ.get("TRUSTED_PROXY_COUNT", 1)))
+
+# ที่มาของผลค้นหา: "qdrant" = ยิง Qdrant ตาม QDRANT_URL, "local" = ค้นใน process จาก snapshot
+# ที่ export ด้วย `python upload_data.py --export-local local_index`
+RETRIEVAL_BACKEND = os.environ.get("RETRIEVAL_BACKEND", "qdrant").lower()
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "local_index")
+# ต่อ Qdrant ไม่ได้ตอน startup ให้ลองใหม่ทุกกี่วินาที (ระหว่างนั้น /readyz ตอบ 503)
+VECTOR_STORE_RETRY = float(os.environ.get("VECTOR_STORE_RETRY", 5))
+
+# ค้นหา Vector DB ได้พร้อมกันสูงสุดกี่งาน และรอได้นานสุดกี่วินาทีต่อ request
+RETRIEVAL_MAX_CONCURRENCY = int(os.environ.get("RETRIEVAL_MAX_CONCURRENCY", 4))
+RETRIEVAL_TIMEOUT = float(os.environ.get("RETRIEVAL_TIMEOUT", 5))
+# ข้อความสร้างไฟล์ที่ regex ยังบอกไม่ได้ว่าฟอร์มไหน เริ่มค้น Vector DB ไประหว่างรอ LLM จัดประเภท
+# ถ้าสุดท้ายได้ฟอร์มค่อยยกเลิก (0 = ค้นหลังจัดประเภทเสร็จ)
+SPECULATIVE_RETRIEVAL = os.environ.get("SPECULATIVE_RETRIEVAL", "1").lower() in ("1", "true", "yes")
+# keyword ตรงฟอร์มไหน ดัน chunk ของฟอร์มนั้นขึ้นมา: ค้นเฉพาะฟอร์ม + ค้นทั้ง collection แล้วรวมด้วย RRF
+# (keyword กว้างๆ ตรงผิดฟอร์ม ผลจากทั้ง collection ที่ตรงกว่ายังติดอันดับได้)
+RETRIEVAL_FORM_FILTER = os.environ.get("RETRIEVAL_FORM_FILTER", "1").lower() in ("1", "true", "yes")
+
+# Process pool สำหรับ render .docx (จำนวน worker / งานค้างสูงสุด / Retry-After ตอนคิวเต็ม)
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+RENDER_MAX_PENDING = int(os.environ.get("RENDER_MAX_PENDING", RENDER_WORKERS * 4))
+RENDER_RETRY_AFTER = int(os.environ.get("RENDER_RETRY_AFTER", 2))
+# งาน batch ส่งเข้า render pool ค้างได้พร้อมกันสูงสุดกี่ไฟล์ (คุม RAM ให้คงที่)
+BATCH_RENDER_WINDOW = int(os.environ.get("BATCH_RENDER_WINDOW", RENDER_WORKERS * 2))
+# batch request ทำพร้อมกันได้กี่งาน (เกิน = 503) งานของ batch ไม่นับรวมใน RENDER_MAX_PENDING
+BATCH_MAX_CONCURRENT = int(os.environ.get("BATCH_MAX_CONCURRENT", 1))
+
+# ที่เก็บเอกสารที่สร้างแล้ว: อายุ (วินาที) / ขนาดรวมสูงสุด / จำนวนไฟล์ล่าสุดที่ถือไว้ใน RAM
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "output")
+OUTPUT_TTL = float(os.environ.get("OUTPUT_TTL", 24 * 3600))
+OUTPUT_MAX_BYTES = int(os.environ.get("OUTPUT_MAX_BYTES", 500 * 1024 * 1024))
+OUTPUT_MEMORY_ITEMS = int(os.environ.get("OUTPUT_MEMORY_ITEMS", 16))
+OUTPUT_TOKEN_SECRET = os.environ.get("OUTPUT_TOKEN_SECRET")
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Cache ของ RAG path (0 = ปิด cache ชั้นนั้น)
+QUERY_VECTOR_CACHE_SIZE = int(os.environ.get("QUERY_VECTOR_CACHE_SIZE", 2048))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 512))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 600))
+# serve.py (หลาย worker) ตั้งให้: cache ผลค้นหา/คำตอบใช้ sqlite ไฟล์นี้ร่วมกันทุก worker
+# (ไม่ตั้ง = cache อยู่ใน RAM ของ process เดียวตามเดิม) ผลค้นหาที่ใช้ร่วมกันหมดอายุตาม ANSWER_CACHE_TTL
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH")
+# ONNX Runtime threads ต่อ model (0 = ตาม FastEmbed) serve.py ตั้งเป็น 1: หลาย worker แบ่ง core กันแทน
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", 0))
+# serve.py ตั้งให้: แต่ละ worker เขียนสถานะ (heartbeat) ลงโฟลเดอร์นี้ทุกกี่วินาที
+WORKER_STATE_DIR = os.environ.get("WORKER_STATE_DIR")
+WORKER_HEARTBEAT = float(os.environ.get("WORKER_HEARTBEAT", 2))
+# งบ token (ประมาณ) ของ input ทั้งหมดที่ส่งให้ Advisor: system prompt + context + คำถาม
+ADVISOR_INPUT_TOKENS = int(os.environ.get("ADVISOR_INPUT_TOKENS", 1500))
+# upload_data.py ใช้ token นี้สั่งล้าง cache หลัง rebuild collection (ไม่ตั้ง = ปิด endpoint)
+CACHE_ADMIN_TOKEN = os.environ.get("CACHE_ADMIN_TOKEN")
 
 # ================= PYDANTIC MODELS =================
 class UserRequest(BaseModel):
@@ -160,6 +167,14 @@ class GenerateRequest(BaseModel):
     student_id: str
     form_data: Dict[str, Any]
 
+class BatchRecord(BaseModel):
+    student_id: str
+    form_data: Dict[str, Any]
+
+class BatchGenerateRequest(BaseModel):
+    form_type: str
+    records: List[BatchRecord]
+
 class SourceItem(BaseModel):
     doc: str
     page: int
@@ -172,13 +187,13 @@ class ChatResponse(BaseModel):
 # ================= AI FUNCTIONS (2 บุคลิก) =================
 
 # 1. บุคลิก "ที่ปรึกษา" (Advisor) - ตอบคำถามทั่วไป
-async def get_advisor_response(context: str, question: str, client: AsyncGroq) -> str:
-    system_prompt =f'''
+# system prompt คงที่ สร้างครั้งเดียว (ส่วนที่เปลี่ยนตามคำถามไปอยู่ใน context ข้อความถัดไป)
+ADVISOR_SYSTEM_PROMPT = '''
         คุณคือ "น้องผู้ช่วย มจธ." (KMUTT Assistant) ผู้เชี่ยวชาญด้านงานทะเบียนและเอกสารคำร้อง
         หน้าที่ของคุณคือ: ให้คำแนะนำที่ถูกต้อง กระชับ และเป็นมิตรกับนักศึกษา (เหมือนรุ่นพี่แนะนำรุ่นน้อง)
 
-        📚 **คลังข้อมูลรหัสเอกสารที่คุณต้องใช้ (Knowledge Base):**
-        {FORM_LIST_TEXT}
+        📚 **ข้อมูลอ้างอิง:** ระบบจะแนบฟอร์มที่เกี่ยวข้องและเนื้อหาจากเอกสารมาในข้อความถัดไป
+        ให้ตอบจากข้อมูลอ้างอิงนั้นเป็นหลัก
 
         ⚡ **กฎการตอบคำถาม (Strict Rules):**
         1. **ห้ามมั่วรหัส:** ต้องตอบรหัสเอกสาร (RO.xx) ให้ตรงกับบริบทเท่านั้น ห้ามเดาเอง
@@ -202,56 +217,161 @@ async def get_advisor_response(context: str, question: str, client: AsyncGroq) -
         2. ใช้แบบฟอร์ม **สทน. 12 (RO.12)** ประกอบการยื่น
         ⬇️ ดาวน์โหลดที่นี่: https://regis.kmutt.ac.th/service/form/RO-12Updated.pdf"
     '''
+
+def build_advisor_messages(context: str, question: str) -> List[Dict[str, str]]:
+    messages = [{"role": "system", "content": ADVISOR_SYSTEM_PROMPT}]
+    if context:
+        messages.append({"role": "system", "content": f"ข้อมูลอ้างอิง:\n{context}"})
+    messages.append({"role": "user", "content": question})
+    return messages
+
+def build_advisor_context(question: str, match: MessageMatch, docs: list) -> str:
+    """ฟอร์มที่ keyword ตรง + chunk ที่ค้นได้ บีบให้ทั้ง prompt ไม่เกิน ADVISOR_INPUT_TOKENS"""
+    budget = context_budget(ADVISOR_INPUT_TOKENS, ADVISOR_SYSTEM_PROMPT, question)
+    return pack_context(match.forms, docs, budget)
+
+async def get_advisor_response(context: str, question: str, client: ResilientGroq) -> str:
     try:
-        response = await client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
-            ],
-            temperature=0.3
-        )
+        with span("llm_advisor"):
+            response = await client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=build_advisor_messages(context, question),
+                temperature=0.3
+            )
+        metrics.record_usage("advisor", response.usage)
         return response.choices[0].message.content
     except Exception as e:
         return f"AI Error: {e}"
 
+# 1.1 แบบ Stream - ส่ง token ออกไปทันทีที่ Groq ส่งมา (ใช้กับ /chat/stream)
+async def stream_advisor_response(context: str, question: str, client: ResilientGroq) -> AsyncIterator[str]:
+    started = time.perf_counter()
+    stream = await client.chat.completions.create(
+        model=LLM_MODEL,
+        messages=build_advisor_messages(context, question),
+        temperature=0.3,
+        stream=True
+    )
+    first_token = True
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    metrics.observe_stage("llm_advisor_first_token", time.perf_counter() - started)
+                    first_token = False
+                yield chunk.choices[0].delta.content
+            # Groq ส่ง usage มากับ chunk สุดท้ายใน x_groq
+            metrics.record_usage("advisor", getattr(getattr(chunk, "x_groq", None), "usage", None))
+    finally:
+        # คืน slot ของ ResilientGroq แม้ client ตัดไปก่อนได้ token แรก
+        await stream.aclose()
+    metrics.observe_stage("llm_advisor_stream", time.perf_counter() - started)
+
 # 2. บุคลิก "นักแกะข้อมูล" (Extractor) - สร้าง JSON เท่านั้น
-async def get_extractor_response(question: str, client: AsyncGroq) -> str:
-    # โพย Schema (ใส่ให้ครบทุกฟอร์มที่รองรับ)
-    schemas = """
-    [RO-01] {"form_type": "RO-01","request_subject": "","recipient": "","student_name": "","student_id": "","faculty": "","department": "","class_level": "","semester_gpa": "","cumulative_gpa": "","advisor_name": "","student_tel": "","student_email": "","request_details":"แต่งภาษาทางการ"}
-    [RO-03] {"form_type": "RO-03","request_subject": "","recipient": "","student_name": "","student_id": "","faculty": "","department": "","class_level": "","address_no": "","address_moo": "","address_soi": "","address_road": "","address_subdistrict": "","address_district": "","address_province": "","address_postal_code": "","phone_home": "","phone_mobile": "","Parental_certification":"แต่งภาษาทางการ","date_day": "","date_month": "","date_year": ""}
-    [RO-13] {"form_type": "RO-13","recipient": "","enclosure_2": "","student_name": "","faculty": "","department": "","class_level": "","advisor_name": "","student_tel": "","student_email": "","reason_study_at_location": "","reason_other_details": "แต่งภาษาทางการ","date_day": "","date_month": "","date_year": ""}
-    [RO-16] {"form_type": "RO-16","recipient": "","enclosure_1": "","enclosure_2": "","student_name": "","student_id": "","faculty": "","department": "","class_level": "","advisor_name": "","student_tel": "","student_email": "","leave_days": "","date_from": "","date_to": "","leave_reason":"แต่งภาษาทางการ","date_day": "","date_month": "","date_year": ""}
+# ขั้นที่ 1: เลือกฟอร์ม (จาก keyword/รหัสฟอร์มในข้อความ ถ้าไม่เจอค่อยถาม LLM สั้นๆ)
+# ขั้นที่ 2: ช่องที่ regex อ่านได้ (รหัส เบอร์ อีเมล วันที่) กรอกใน extraction.pre_extract
+#            แล้วส่ง schema ของฟอร์มนั้นฟอร์มเดียว เฉพาะช่องที่ยังขาด ให้ LLM กรอก
+async def classify_form_type(question: str, client: ResilientGroq) -> Optional[str]:
+    """ถาม LLM ว่าข้อความนี้ต้องใช้ฟอร์มไหน (prompt สั้น ไม่มี schema) คืน None ถ้าไม่แน่ใจ"""
+    system_prompt = f"""
+    เลือกแบบฟอร์มที่ผู้ใช้ต้องการจากรายการนี้ ตอบเป็น JSON {{"form_type": "<รหัส>"}} เท่านั้น
+    ถ้าไม่ตรงกับฟอร์มไหนเลย ให้ตอบ {{"form_type": ""}}
+    {form_choices_text()}
     """
+    try:
+        with span("llm_classifier"):
+            response = await client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": question}
+                ],
+                temperature=0,
+                max_tokens=20,
+                response_format={"type": "json_object"}
+            )
+        metrics.record_usage("classifier", response.usage)
+        form_type = str(json.loads(response.choices[0].message.content).get("form_type", ""))
+    except Exception:
+        return None
+    form_type = form_type.strip().upper().replace(".", "-")
+    return form_type if form_type in TEMPLATE_MAP else None
+
+async def resolve_form(pre: PreExtraction, question: str, client: ResilientGroq) -> Optional[PreExtraction]:
+    """ขั้นที่ 1: ระบุฟอร์ม คืน None ถ้าไม่รู้ว่าฟอร์มไหน (ผู้เรียกเลือกเองว่าจะตอบแบบไหนต่อ)"""
+    if pre.form_type:
+        FORM_CLASSIFICATION.inc(method="rules")
+        return pre
+    form_type = await classify_form_type(question, client)
+    if form_type is None:
+        FORM_CLASSIFICATION.inc(method="failed")
+        EXTRACTION_PATH.inc(path="no_form")
+        return None
+    FORM_CLASSIFICATION.inc(method="llm")
+    return with_form_type(pre, form_type)
+
+async def extract_form_fields(pre: PreExtraction, question: str, client: ResilientGroq) -> str:
+    """ขั้นที่ 2: กรอกช่องที่เหลือของฟอร์มที่รู้แล้ว (ไม่เหลือช่องให้ LLM = ไม่เรียก LLM)"""
+    if not pre.needs_llm:
+        EXTRACTION_PATH.inc(path="rules_only")
+        return json.dumps(pre.fields, ensure_ascii=False)
+    EXTRACTION_PATH.inc(path="partial_llm")
+
+    schema = json.dumps(remaining_schema(pre), ensure_ascii=False)
     system_prompt = f"""
     คุณคือ Data Extractor
-    หน้าที่: แปลงคำพูดผู้ใช้เป็น JSON เพื่อกรอกฟอร์ม
+    หน้าที่: แปลงคำพูดผู้ใช้เป็น JSON เพื่อกรอกฟอร์ม {pre.form_type}
     กฎ: 
     1. ห้ามตอบเป็นประโยคสนทนา ให้ตอบ JSON Block เดียวเท่านั้น
     2. ถ้าข้อมูลไม่ครบ ให้ใส่ค่าว่าง ""
-    3. แต่งประโยคในช่อง reason/details ให้เป็นภาษาทางการ
-    4. ในช่อง date_month ให้ใช้ตัวเลขเช่น 03 แทนเดือนมีนาคม
+    3. ช่องที่มีคำอธิบายในค่าตั้งต้น ให้ทำตามคำอธิบายนั้น
     
-    Schemas:
-    {schemas}
+    Schema:
+    {schema}
     """
     try:
-        response = await client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
-            ],
-            temperature=0.1, # ค่าต่ำเพื่อให้โครงสร้างแม่นยำ
-            response_format={"type": "json_object"}
-        )
-        return response.choices[0].message.content
+        with span("llm_extractor"):
+            response = await client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": question}
+                ],
+                temperature=0.1, # ค่าต่ำเพื่อให้โครงสร้างแม่นยำ
+                response_format={"type": "json_object"}
+            )
+        metrics.record_usage("extractor", response.usage)
+        with span("json_parse"):
+            llm_data = json.loads(response.choices[0].message.content)
+        if not isinstance(llm_data, dict):
+            llm_data = {}
     except Exception as e:
-        return "{}"
+        # LLM ล่ม: ยังสร้างเอกสารจากช่องที่กฎกรอกได้
+        llm_data = {}
+    return json.dumps(merge_extraction(pre, llm_data), ensure_ascii=False)
 
 # ================= APP SETUP =================
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # โหลด Template .docx เข้า Cache ก่อนรับ request แรก
+    loaded = warm_template_cache()
+    print(f"✅ Templates Ready: {', '.join(loaded)}")
+    print(f"✅ Extractor Schemas Ready: {', '.join(warm_extractor_schemas())}")
+    render_pool.start()
+    startup_state["render_pool"] = True
+    print(f"✅ Render Pool Ready: {RENDER_WORKERS} workers")
+    # model + vector store โหลดเบื้องหลัง เปิด port ได้ทันที (/healthz ตอบได้, /readyz รอจนพร้อม)
+    loader = asyncio.create_task(startup_models())
+    heartbeat = asyncio.create_task(report_worker_state()) if WORKER_STATE_DIR else None
+    yield
+    loader.cancel()
+    if heartbeat is not None:
+        heartbeat.cancel()
+    render_pool.shutdown()
+    await groq_client.close()
+
+render_pool = RenderPool(RENDER_WORKERS, RENDER_MAX_PENDING, BATCH_MAX_CONCURRENT)
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -261,26 +381,349 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# เปิดให้เข้าถึงโฟลเดอร์ output ได้ผ่าน Browser (สำหรับโหลดไฟล์)
-os.makedirs("output", exist_ok=True)
-app.mount("/download", StaticFiles(directory="output"), name="download")
-
-# โหลด Model แบบ Global (เพื่อให้เร็ว ไม่ต้องโหลดใหม่ทุกรอบ)
-print("⏳ Initializing Models...")
-embeddings = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
-sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
-qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-vector_store = QdrantVectorStore(
-    client=qdrant_client,
-    collection_name=COLLECTION_NAME,
-    embedding=embeddings,
-    sparse_embedding=sparse_embeddings,
-    retrieval_mode=RetrievalMode.HYBRID,
-    vector_name="dense_vector",
-    sparse_vector_name="sparse_vector",
+@app.middleware("http")
+async def trace_and_time(request: Request, call_next):
+    # trace id ต่อ request: ใช้ของ proxy ถ้าส่ง X-Request-ID มา ไม่งั้นสร้างใหม่ แล้วส่งกลับใน header
+    trace_id = request.headers.get("x-request-id") or metrics.new_trace_id()
+    metrics.trace_id_var.set(trace_id)
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    metrics.HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, path=path)
+    metrics.HTTP_REQUESTS.inc(method=request.method, path=path, status=response.status_code)
+    response.headers["X-Request-ID"] = trace_id
+    return response
+
+# ไฟล์ที่สร้างแล้วเก็บใน output/{token}/ และโหลดผ่าน /download/{token}/{filename}
+output_store = OutputStore(
+    OUTPUT_DIR, OUTPUT_TTL, OUTPUT_MAX_BYTES, OUTPUT_MEMORY_ITEMS, OUTPUT_TOKEN_SECRET
+)
+
+# Cache ของ RAG path สร้างไว้ก่อน ส่วน model โหลดใน startup_models() หลัง server เปิดแล้ว
+dense_vector_cache = LRUCache("dense_query_vectors", QUERY_VECTOR_CACHE_SIZE)
+sparse_vector_cache = LRUCache("sparse_query_vectors", QUERY_VECTOR_CACHE_SIZE)
+if SHARED_CACHE_PATH:
+    retrieval_cache = SharedTTLCache("retrieval_hits", SHARED_CACHE_PATH, RETRIEVAL_CACHE_SIZE, ANSWER_CACHE_TTL)
+    answer_cache = SharedTTLCache("answers", SHARED_CACHE_PATH, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+else:
+    retrieval_cache = LRUCache("retrieval_hits", RETRIEVAL_CACHE_SIZE)
+    answer_cache = TTLCache("answers", ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+ALL_CACHES = [dense_vector_cache, sparse_vector_cache, retrieval_cache, answer_cache]
+
+groq_client = ResilientGroq(
+    GROQ_API_KEY,
+    GROQ_BASE_URL,
+    fallback_model=LLM_FALLBACK_MODEL,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    deadline=LLM_DEADLINE,
+    max_retries=LLM_MAX_RETRIES,
+    hedge_percentile=LLM_HEDGE_PERCENTILE,
+    breaker_failures=LLM_BREAKER_FAILURES,
+    breaker_cooldown=LLM_BREAKER_COOLDOWN,
+    pool_size=LLM_POOL_SIZE,
+)
+
+rate_limiter = ClientRateLimiter(RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+admission_queue = AdmissionQueue(ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT)
+
+# สถานะสำหรับ /readyz (ยังไม่พร้อม = /chat ตอบจาก keyword ไปก่อน ไม่ค้น vector)
+startup_state: Dict[str, Any] = {
+    "render_pool": False,
+    "models": False,
+    "vector_store": False,
+    "error": None,
+}
+embeddings: Optional[CachedEmbeddings] = None
+sparse_embeddings: Optional[CachedSparseEmbeddings] = None
+vector_store = None
+
+def load_models() -> None:
+    """โหลด FastEmbed จาก MODEL_CACHE_DIR (preload.py โหลดไว้ให้แล้ว) และ infer หนึ่งรอบเพื่ออุ่นเครื่อง"""
+    global embeddings, sparse_embeddings
+    started = time.perf_counter()
+    threads = {"threads": EMBED_THREADS} if EMBED_THREADS else {}
+    dense = FastEmbedEmbeddings(model_name=DENSE_MODEL_NAME, cache_dir=MODEL_CACHE_DIR, **threads)
+    sparse = FastEmbedSparse(model_name=SPARSE_MODEL_NAME, cache_dir=MODEL_CACHE_DIR, **threads)
+    # ONNX Runtime จัดสรร buffer ตอน infer ครั้งแรก ทำตรงนี้แทน request แรกของผู้ใช้
+    dense.embed_query("warm up")
+    sparse.embed_query("warm up")
+    embeddings = CachedEmbeddings(dense, dense_vector_cache)
+    sparse_embeddings = CachedSparseEmbeddings(sparse, sparse_vector_cache)
+    print(f"✅ Models Ready! ({time.perf_counter() - started:.1f}s)")
+
+def build_vector_store():
+    if RETRIEVAL_BACKEND == "local":
+        try:
+            index = LocalHybridIndex(LOCAL_INDEX_DIR, embeddings, sparse_embeddings)
+            print(f"📚 Local index: {len(index)} chunks from {LOCAL_INDEX_DIR}")
+            return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ โหลด local index ไม่ได้ ({e}) ใช้ Qdrant แทน")
+    qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+    return QdrantVectorStore(
+        client=qdrant_client,
+        collection_name=COLLECTION_NAME,
+        embedding=embeddings,
+        sparse_embedding=sparse_embeddings,
+        retrieval_mode=RetrievalMode.HYBRID,
+        vector_name=DENSE_VECTOR_NAME,
+        sparse_vector_name=SPARSE_VECTOR_NAME,
+    )
+
+def preload() -> None:
+    """โหลดทุกอย่างที่ fork ไปใช้ร่วมกันได้ (serve.py เรียกใน master ก่อน fork worker)
+
+    model / template / local index ที่โหลดตรงนี้ worker ได้ไปแบบ copy-on-write
+    ส่วน Qdrant client (มี connection) ให้แต่ละ worker ต่อเองใน startup_models()
+    """
+    global vector_store
+    loaded = warm_template_cache()
+    print(f"✅ Templates Ready: {', '.join(loaded)}")
+    warm_extractor_schemas()
+    load_models()
+    startup_state["models"] = True
+    if RETRIEVAL_BACKEND == "local":
+        try:
+            vector_store = LocalHybridIndex(LOCAL_INDEX_DIR, embeddings, sparse_embeddings)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ โหลด local index ไม่ได้ ({e}) ให้แต่ละ worker ต่อ Qdrant เอง")
+            return
+        startup_state["vector_store"] = True
+        print(f"📚 Local index: {len(vector_store)} chunks from {LOCAL_INDEX_DIR}")
+
+async def startup_models() -> None:
+    global vector_store
+    if embeddings is None:
+        print("⏳ Initializing Models...")
+        try:
+            await asyncio.to_thread(load_models)
+        except Exception as e:
+            startup_state["error"] = f"models: {e}"
+            print(f"❌ Model Load Error: {e}")
+            return
+    startup_state["models"] = True
+    if vector_store is not None:
+        return
+
+    # Qdrant ล่ม/ยังไม่ขึ้น ไม่ต้องให้ server ล้ม ลองต่อใหม่เรื่อยๆ
+    while True:
+        try:
+            store = await asyncio.to_thread(build_vector_store)
+            break
+        except Exception as e:
+            startup_state["error"] = f"vector_store: {e}"
+            print(f"⚠️ เชื่อมต่อ Vector DB ไม่ได้ ({e}) ลองใหม่ใน {VECTOR_STORE_RETRY}s")
+            await asyncio.sleep(VECTOR_STORE_RETRY)
+    vector_store = store
+    startup_state["vector_store"] = True
+    startup_state["error"] = None
+    print("✅ Vector Store Ready!")
+
+# Thread pool แยกสำหรับงานค้นหา (FastEmbed + Qdrant HTTP เป็น blocking ทั้งหมด)
+# ขนาดเท่ากับ semaphore เพื่อไม่ให้งานไปกองคิวใน executor
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_CONCURRENCY, thread_name_prefix="retrieval"
 )
-groq_client = AsyncGroq(api_key=GROQ_API_KEY)
-print("✅ Models Ready!")
+retrieval_semaphore = asyncio.Semaphore(RETRIEVAL_MAX_CONCURRENCY)
+
+FORM_FILTER = metrics.REGISTRY.register(metrics.Counter(
+    "retrieval_form_filter_total",
+    "Form-boosted searches: results all from the matched forms, mixed with other forms, or no form hits",
+    ("outcome",),
+))
+
+local_index_lock = threading.Lock()
+
+def refresh_local_index() -> None:
+    """upload_data.py export local index ชุดใหม่แล้ว (manifest เปลี่ยน) เปิดชุดใหม่ + ล้าง cache ของ process นี้
+
+    เช็คก่อนค้นทุกครั้ง (แค่ stat ไฟล์เดียว) ทุก worker ของ serve.py จึงเห็นชุดใหม่เอง
+    ไม่ต้องพึ่ง /cache/invalidate ที่ไปถึงแค่ worker เดียว
+    """
+    global vector_store
+    store = vector_store
+    if not isinstance(store, LocalHybridIndex) or not store.is_stale():
+        return
+    with local_index_lock:
+        if vector_store is not store:
+            return  # thread อื่นเปิดชุดใหม่ให้แล้ว
+        try:
+            vector_store = LocalHybridIndex(LOCAL_INDEX_DIR, embeddings, sparse_embeddings)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ เปิด local index ชุดใหม่ไม่ได้ ({e}) ใช้ชุดเดิมต่อ")
+            store.signature = store.manifest_signature(store.directory)
+            return
+        # ผลค้น/คำตอบที่ worker นี้ cache จากชุดเก่า (รวมที่เขียนลง sqlite หลังอีก worker ล้างไปแล้ว)
+        retrieval_cache.clear()
+        answer_cache.clear()
+        print(f"🔄 Local index ชุดใหม่: {len(vector_store)} chunks")
+
+def _boosted_search(query: str, k: int, form_ids: tuple) -> list:
+    """ค้นรอบเดียว: prefetch ทั้ง collection + เฉพาะ chunk ของฟอร์มที่ keyword ตรง (dense + sparse อย่างละชุด)
+    แล้วรวมด้วย RRF ฝั่ง Qdrant chunk ของฟอร์มนั้นที่ติดทั้งสองชุดได้คะแนนรวม
+    แต่ keyword กว้างๆ ที่ตรงผิดฟอร์ม ผลจากฟอร์มอื่นที่ตรงกว่ายังติดอันดับได้"""
+    if isinstance(vector_store, LocalHybridIndex):
+        return vector_store.similarity_search(query, k, boost_form_ids=form_ids)
+    dense = vector_store.embeddings.embed_query(query)
+    sparse = vector_store.sparse_embeddings.embed_query(query)
+    sparse = models.SparseVector(indices=sparse.indices, values=sparse.values)
+    # payload index บน metadata.form_id: prefetch ชุดที่กรองแล้วเร็วพอๆ กับชุดเต็ม
+    form_filter = models.Filter(
+        must=[models.FieldCondition(key=FORM_ID_KEY, match=models.MatchAny(any=list(form_ids)))]
+    )
+    prefetch = [
+        models.Prefetch(using=using, query=vector, filter=query_filter, limit=k)
+        for query_filter in (None, form_filter)
+        for using, vector in ((vector_store.vector_name, dense), (vector_store.sparse_vector_name, sparse))
+    ]
+    points = vector_store.client.query_points(
+        collection_name=vector_store.collection_name,
+        prefetch=prefetch,
+        query=models.FusionQuery(fusion=models.Fusion.RRF),
+        limit=k,
+        with_payload=True,
+    ).points
+    return [
+        vector_store._document_from_point(
+            point, vector_store.collection_name,
+            vector_store.content_payload_key, vector_store.metadata_payload_key,
+        )
+        for point in points
+    ]
+
+def _vector_search(query: str, k: int, form_ids: tuple = ()) -> list:
+    # รันใน retrieval thread: รวมเวลา embed query (ถ้า cache miss) + ค้น Vector DB
+    refresh_local_index()
+    with span("vector_search"):
+        if not form_ids:
+            return vector_store.similarity_search(query, k)
+        docs = _boosted_search(query, k, form_ids)
+        kept = sum(
+            1 for doc in docs
+            if (doc.metadata.get("form_id") or form_id_for_source(doc.metadata.get("source"))) in form_ids
+        )
+        FORM_FILTER.inc(outcome="form_only" if kept == len(docs) and docs else "mixed" if kept else "no_form_hits")
+        return docs
+
+def retrieval_form_ids(match: MessageMatch) -> tuple:
+    """ฟอร์มที่ keyword ตรง ใช้ดันผลค้นหา (ว่าง = ค้นทั้ง collection อย่างเดียว)"""
+    if not RETRIEVAL_FORM_FILTER:
+        return ()
+    return tuple(item["id"] for item in match.forms)
+
+async def retrieve_documents(query: str, k: int = 3, form_ids: tuple = ()) -> Optional[list]:
+    """ค้นหาแบบ Hybrid นอก event loop ถ้าเกินเวลา / คิวเต็ม / error / vector store ยังไม่พร้อม คืน None
+    (ผู้เรียกตอบจาก keyword ต่อได้ แต่ต้องไม่ cache คำตอบที่ไม่มี context จาก Vector DB)"""
+    cache_key = (normalize_query(query), k, form_ids)
+    cached = await retrieval_cache.aget(cache_key)
+    if cached is not None:
+        return cached
+    if vector_store is None:
+        print("⚠️ Retrieval: Vector Store ยังโหลดไม่เสร็จ ข้ามการค้นหา")
+        return None
+
+    with span("retrieval"):
+        results = await _retrieve_uncached(query, k, form_ids)
+    if results is None:
+        return None
+    await retrieval_cache.aset(cache_key, results)
+    return results
+
+async def _retrieve_uncached(query: str, k: int, form_ids: tuple) -> Optional[list]:
+    deadline = time.monotonic() + RETRIEVAL_TIMEOUT
+    try:
+        await asyncio.wait_for(retrieval_semaphore.acquire(), timeout=RETRIEVAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        print("⚠️ Retrieval: คิวค้นหาเต็ม ข้ามการค้นหา")
+        metrics.STAGE_ERRORS.inc(stage="retrieval")
+        return None
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(retrieval_executor, _vector_search, query, k, form_ids)
+    # คืน slot ตอนงานใน thread จบจริงเท่านั้น (thread ยกเลิกกลางทางไม่ได้)
+    future.add_done_callback(lambda _: retrieval_semaphore.release())
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(future), timeout=max(deadline - time.monotonic(), 0)
+        )
+    except asyncio.TimeoutError:
+        print(f"⚠️ Retrieval: ค้นหาเกิน {RETRIEVAL_TIMEOUT}s ข้ามการค้นหา")
+    except Exception as e:
+        print(f"❌ Retrieval Error: {e}")
+    metrics.STAGE_ERRORS.inc(stage="retrieval")
+    return None
+
+# ---------------------------------------------------------
+# Router + ค้นหาแบบขนาน
+# - ไม่มี trigger = RAG แน่นอน เริ่มค้นทันที
+# - มี trigger: regex หาฟอร์มก่อน (ไม่ถึงมิลลิวินาที) เจอ = โหมดสร้างไฟล์ ไม่ต้องค้นเลย
+#   ไม่เจอ = ค้นไปพร้อมกับรอ LLM จัดประเภท เวลาตอบ ≈ max(retrieval, classifier) + LLM
+# (การค้นที่ยกเลิกยังถือ slot ของ retrieval thread จนจบ จึงเริ่มเฉพาะตอนที่อาจได้ใช้จริง)
+# ---------------------------------------------------------
+SPECULATION = metrics.REGISTRY.register(metrics.Counter(
+    "speculative_retrieval_total", "Retrievals started while the LLM classifier was still running, by outcome", ("outcome",)
+))
+
+class Route(NamedTuple):
+    match: MessageMatch
+    pre: Optional[PreExtraction]  # มีเฉพาะข้อความที่มี trigger (โหมดสร้างไฟล์)
+
+def route_message(message: str, match: MessageMatch) -> Route:
+    # หาฟอร์ม/ช่องที่ regex อ่านได้ เป็นงาน CPU สั้นๆ รันรวดเดียวใน thread
+    with span("router"):
+        pre = pre_extract(message) if match.triggers else None
+    return Route(match, pre)
+
+def start_retrieval(message: str, match: MessageMatch) -> asyncio.Task:
+    return asyncio.create_task(retrieve_documents(message, k=3, form_ids=retrieval_form_ids(match)))
+
+def start_speculative_retrieval(message: str, match: MessageMatch) -> Optional[asyncio.Task]:
+    if not SPECULATIVE_RETRIEVAL or vector_store is None:
+        return None
+    return asyncio.create_task(retrieve_documents(message, k=3, form_ids=retrieval_form_ids(match)))
+
+async def take_retrieval(task: Optional[asyncio.Task], message: str, match: MessageMatch) -> Optional[list]:
+    """ใช้ผลค้นหาที่เริ่มไว้ก่อน (ถ้ามี) ไม่งั้นค่อยค้นตอนนี้ (None = ค้นไม่สำเร็จ ดู retrieve_documents)"""
+    if task is None:
+        return await retrieve_documents(message, k=3, form_ids=retrieval_form_ids(match))
+    return await task
+
+def cancel_retrieval(task: Optional[asyncio.Task]) -> None:
+    # งานใน retrieval thread วิ่งต่อจนจบ (คืน slot เอง) แค่ไม่มีใครรอผลแล้ว
+    if task is not None and not task.done():
+        task.cancel()
+        SPECULATION.inc(outcome="cancelled")
+
+async def route_with_speculation(message: str, match: MessageMatch) -> tuple:
+    """route ข้อความ (+ ค้น Vector DB ไปพร้อมกันเมื่อจำเป็น) คืน (route, pre, retrieval task)
+
+    match = ผล keyword scan ที่ endpoint ทำไว้แล้ว (ใช้กรองการค้นตามฟอร์ม)
+    pre ไม่เป็น None = โหมดสร้างไฟล์ที่รู้ฟอร์มแล้ว (ไม่มีการค้นค้างอยู่)
+    ข้อความที่มี trigger แต่ regex ไม่รู้ว่าฟอร์มไหน ระหว่างรอ LLM จัดประเภท การค้นวิ่งไปก่อน
+    ถ้าสุดท้ายจัดไม่ได้ จะตกไปตอบแบบ RAG โดยใช้ผลค้นชุดนั้นเลย
+    retrieval task เป็น None ได้ (ปิด speculation / vector store ยังไม่พร้อม) take_retrieval ค้นให้เอง
+    """
+    if not match.triggers:
+        retrieval = start_retrieval(message, match) if vector_store is not None else None
+        return Route(match, None), None, retrieval
+
+    route = await asyncio.to_thread(route_message, message, match)
+    if route.pre.form_type:
+        return route, await resolve_form(route.pre, message, groq_client), None
+
+    retrieval = start_speculative_retrieval(message, match)
+    try:
+        pre = await resolve_form(route.pre, message, groq_client)
+        if pre is not None:
+            cancel_retrieval(retrieval)
+            retrieval = None
+        elif retrieval is not None:
+            SPECULATION.inc(outcome="used")
+    except BaseException:
+        cancel_retrieval(retrieval)
+        raise
+    return route, pre, retrieval
 
 # ================= ENDPOINTS =================
 
@@ -288,89 +731,556 @@ print("✅ Models Ready!")
 def read_root():
     return {"status": "Server is running 🚀"}
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(req: UserRequest):
-    print(f"📩 ข้อความเข้า: {req.message}")
+@app.get("/healthz")
+def healthz():
+    """liveness: process ยังตอบได้ (ไม่รอ model)"""
+    return {"status": "ok", "pid": os.getpid()}
+
+def is_ready() -> bool:
+    # render pool ที่ worker ตายแล้วยังสร้างใหม่ไม่สำเร็จ ถือว่าไม่พร้อม
+    return all(startup_state[k] for k in ("render_pool", "models", "vector_store")) and render_pool.healthy
+
+def worker_status() -> Dict[str, Any]:
+    return {
+        "index": int(os.environ.get("WORKER_INDEX", 0)),
+        "pid": os.getpid(),
+        "ready": is_ready(),
+        "startup": {k: v for k, v in startup_state.items() if k != "error"},
+        "error": startup_state["error"],
+        "requests": int(metrics.HTTP_REQUESTS.total()),
+        "render_pending": render_pool.pending,
+        "llm_in_flight": groq_client.in_flight,
+        "admission_active": admission_queue.active,
+        "admission_queued": admission_queue.depth,
+        "memory": worker_state.memory_usage(),
+    }
+
+async def report_worker_state() -> None:
+    # heartbeat ให้ serve.py: ถ้า event loop ค้างจนเขียนไม่ได้ master จะ restart worker นี้
+    index = int(os.environ.get("WORKER_INDEX", 0))
+    while True:
+        try:
+            worker_state.write_status(WORKER_STATE_DIR, index, worker_status())
+            # expose อ่าน sqlite cache ด้วย ทำนอก event loop
+            await asyncio.to_thread(
+                lambda: worker_state.write_metrics(WORKER_STATE_DIR, index, metrics.REGISTRY.expose())
+            )
+        except OSError as e:
+            print(f"⚠️ เขียนสถานะ worker ไม่ได้: {e}")
+        await asyncio.sleep(WORKER_HEARTBEAT)
+
+@app.get("/workers")
+def workers():
+    """สถานะทุก worker (รันผ่าน serve.py) หรือของ process นี้ตัวเดียว"""
+    if not WORKER_STATE_DIR:
+        return {"workers": [worker_status()]}
+    return {"served_by": os.getpid(), "workers": worker_state.read_statuses(WORKER_STATE_DIR)}
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """readiness: พร้อมรับ traffic เมื่อ render pool, model และ vector store พร้อมครบ"""
+    ready = is_ready()
+    response.status_code = 200 if ready else 503
+    return {"ready": ready, **startup_state}
+
+def render_busy_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="ระบบสร้างเอกสารไม่ว่าง กรุณาลองใหม่อีกครั้ง",
+        headers={"Retry-After": str(RENDER_RETRY_AFTER)},
+    )
+
+# ---------------------------------------------------------
+# Admission control: rate limit ต่อ client + คิวงาน LLM (ดู admission.py)
+# ---------------------------------------------------------
+def client_key(request: Request) -> str:
+    if CLIENT_IP_HEADER:
+        # proxy ต่อ IP ที่ตัวเองเห็นไว้ท้าย header: ตัวที่ proxy ที่เชื่อถือได้ตัวแรกใส่ไว้คือ IP จริง
+        hops = [hop.strip() for hop in request.headers.get(CLIENT_IP_HEADER, "").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_COUNT:
+            return hops[-TRUSTED_PROXY_COUNT]
+    return request.client.host if request.client else "unknown"
+
+def overloaded_error(exc: Rejected) -> HTTPException:
+    if exc.status == 429:
+        detail = "ส่งคำถามถี่เกินไป กรุณารอสักครู่แล้วลองใหม่"
+    else:
+        detail = "ขณะนี้มีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้ง"
+    return HTTPException(status_code=exc.status, detail=detail, headers={"Retry-After": str(exc.retry_after)})
+
+def admit_cheap(request: Request) -> None:
+    """งานที่ไม่ต้องเรียก LLM (cache hit / ดาวน์โหลด): ไม่เข้าคิว หักแค่ token ส่วนน้อย"""
+    try:
+        rate_limiter.take(client_key(request), RATE_LIMIT_CHEAP_COST, PRIORITY_CHEAP)
+    except Rejected as e:
+        raise overloaded_error(e)
+    ADMISSIONS.inc(priority="cheap", outcome="admitted")
+
+async def admit_llm(request: Request, match: MessageMatch) -> Slot:
+    """ขอ slot งาน LLM (โหมดสร้างไฟล์ได้ก่อนคำถามทั่วไป) ไม่ได้ = 429/503 พร้อม Retry-After"""
+    priority = PRIORITY_FILE if match.triggers else PRIORITY_CHAT
+    client = client_key(request)
+    try:
+        rate_limiter.take(client, 1, priority)
+    except Rejected as e:
+        raise overloaded_error(e)
+    try:
+        return await admission_queue.acquire(priority)
+    except BaseException as e:
+        # ไม่ได้ slot (คิวเต็ม / รอนานเกิน / client ตัดไป) ไม่นับเป็นการใช้โควตา ลองใหม่ตาม Retry-After ได้
+        rate_limiter.refund(client, 1)
+        if isinstance(e, Rejected):
+            raise overloaded_error(e)
+        raise
+
+async def release_after(events: AsyncIterator[str], slot: Slot) -> AsyncIterator[str]:
+    # stream ถือ slot จนส่ง event สุดท้าย (หรือ client ตัดไป)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        slot.release()
+
+def _safe_filename_part(value: str) -> str:
+    return re.sub(r"[^\w.-]", "_", value) or "unknown"
+
+async def render_to_store(form_json: str) -> Optional[tuple]:
+    """render ผ่าน pool แล้วเก็บใน output_store (ข้อมูลซ้ำ = ใช้ไฟล์เดิม) คืน (token, filename)"""
+    try:
+        with span("json_parse"):
+            data = json.loads(form_json)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    form_type = str(data.get("form_type", "")).upper()
+    token = output_store.token_for(form_type, data)
+    filename = await asyncio.to_thread(output_store.lookup, token)
+    if filename:
+        print(f"⚡ Output cache hit: {filename}")
+        return token, filename
+
+    file_stream = await render_pool.run(generate_document_stream, form_json)
+    if not file_stream:
+        return None
+    student_id = _safe_filename_part(str(data.get("student_id", "unknown")))
+    filename = f"Filled_{form_type}_{student_id}.docx"
+    await asyncio.to_thread(output_store.put, token, filename, file_stream.getvalue())
+    return token, filename
+
+def stored_document_response(token: str, filename: str, download_name: str) -> Response:
+    found = output_store.get(token, filename)
+    if found is None:
+        raise HTTPException(status_code=404, detail="ไม่พบไฟล์ หรือไฟล์หมดอายุแล้ว")
+    content, path = found
+    headers = {"Content-Disposition": f"attachment; filename*=utf-8''{quote(download_name)}"}
+    if content is not None:
+        return Response(content=content, media_type=DOCX_MEDIA_TYPE, headers=headers)
+    return FileResponse(path, media_type=DOCX_MEDIA_TYPE, headers=headers)
+
+@app.get("/download/{token}/{filename}")
+def download_document(token: str, filename: str, request: Request):
+    admit_cheap(request)
+    return stored_document_response(token, filename, filename)
+
+@app.get("/output/stats")
+def output_stats():
+    return output_store.stats()
+
+@app.get("/render/stats")
+def render_stats():
+    return render_pool.stats()
+
+@app.get("/admission/stats")
+def admission_stats():
+    return {**admission_queue.stats(), **rate_limiter.stats()}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {c.name: c.stats() for c in ALL_CACHES}
+
+# upload_data.py เรียกหลัง rebuild COLLECTION_NAME เพื่อไม่ให้ตอบจากข้อมูลเก่า
+def _stats_collector():
+    for c in ALL_CACHES:
+        yield from metrics.stats_samples("cache", c.stats(), {"cache": c.name})
+    yield from metrics.stats_samples("render_pool", render_pool.stats())
+    yield from metrics.stats_samples("output_store", output_store.stats())
+    yield from metrics.stats_samples("llm", groq_client.stats())
+    yield from metrics.stats_samples("admission", admission_stats())
+    yield from metrics.stats_samples("startup", {
+        k: v for k, v in startup_state.items() if k != "error"
+    })
+
+metrics.REGISTRY.register_collector(_stats_collector)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    text = metrics.REGISTRY.expose()
+    if WORKER_STATE_DIR:
+        # serve.py: connection ไปตก worker ไหนก็ได้ รวมของทุก worker (ที่เขียนไว้ตอน heartbeat) แยกด้วย label worker
+        texts = worker_state.read_metrics(WORKER_STATE_DIR, max_age=max(30.0, WORKER_HEARTBEAT * 10))
+        texts[int(os.environ.get("WORKER_INDEX", 0))] = text
+        text = worker_state.merge_metrics(texts)
+    return Response(content=text, media_type="text/plain; version=0.0.4")
+
+@app.post("/cache/invalidate")
+def cache_invalidate(x_admin_token: Optional[str] = Header(default=None)):
+    if not CACHE_ADMIN_TOKEN or x_admin_token != CACHE_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    # upload_data.py export snapshot ใหม่แล้ว เปิดชุดใหม่ก่อนล้าง cache
+    # (worker อื่นของ serve.py เห็น manifest เปลี่ยนแล้วเปิดใหม่เองตอนค้นครั้งถัดไป)
+    refresh_local_index()
+    for c in ALL_CACHES:
+        c.clear()
+    print("🧹 ล้าง Cache ทั้งหมดแล้ว")
+    return {"status": "invalidated"}
+
+async def handle_file_request(message: str, pre: PreExtraction) -> ChatResponse:
+    """โหมดสร้างไฟล์ (รู้ฟอร์มแล้ว): ให้ AI แกะ JSON ช่องที่เหลือ -> render -> ส่งลิงก์ดาวน์โหลด"""
+    # 1. ให้ AI แกะ JSON
+    json_data_str = await extract_form_fields(pre, message, groq_client)
     
+    # 2. สร้างไฟล์ .docx ใน render pool แล้วเก็บลง output_store
+    try:
+        stored = await render_to_store(json_data_str)
+    except RenderPoolSaturated:
+        raise render_busy_error()
+    
+    if stored:
+        token, filename = stored
+        # สร้างลิงก์สำหรับดาวน์โหลด (สมมติรันบน localhost)
+        # ถ้าขึ้น Server จริง ต้องเปลี่ยน localhost เป็น Domain ของคุณ
+        base_url = os.getenv("APP_URL", "http://localhost:8000") 
+        download_url = f"{base_url}/download/{token}/{quote(filename)}"
+        
+        return ChatResponse(
+            reply=f"✅ ผมร่างเอกสารให้เรียบร้อยแล้วครับ!\n\n📂 **ดาวน์โหลดไฟล์ Word ได้ที่นี่:**\n{download_url}\n\n(คุณสามารถนำไปแก้ไขจัดหน้าต่อได้เลยครับ)",
+            sources=[]
+        )
+    else:
+        return ChatResponse(reply="ขออภัยครับ ผมไม่แน่ใจว่าต้องใช้ฟอร์มไหน หรือข้อมูลไม่เพียงพอ", sources=[])
+
+def keyword_sources(match: MessageMatch) -> List[SourceItem]:
+    """Source จากฟอร์มที่ keyword ตรง (รู้ได้ทันทีก่อนค้น Vector DB)"""
+    sources = []
+    # ฟอร์มที่ keyword ตรง (ได้มาจาก match_message แล้ว เรียงตาม FORM_MASTER_DATA)
+    for item in match.forms:
+        # เพิ่ม Source อัตโนมัติ
+        if not any(s.url == item["url"] for s in sources):
+            sources.append(SourceItem(doc=item["name"], page=1, url=item["url"]))
+    return sources
+
+def document_sources(docs: list, sources: List[SourceItem]) -> List[SourceItem]:
+    """เติม source จาก metadata ของ chunk ที่ค้นได้ (ฟอร์ม + หน้าจริงใน PDF) ต่อท้าย sources"""
+    sources = list(sources)
+    for doc in docs:
+        metadata = doc.metadata
+        url = metadata.get("source") or ""
+        item = FORM_BY_ID.get(metadata.get("form_id") or form_id_for_source(url))
+        if item is not None:
+            name, url = item["name"], item["url"]
+        elif url.startswith(("http://", "https://")):
+            name = url.rsplit("/", 1)[-1]
+        else:
+            continue  # ไฟล์ local ไม่มีลิงก์ให้ผู้ใช้เปิด
+        if not any(s.url == url for s in sources):
+            # PyMuPDF นับหน้าจาก 0
+            sources.append(SourceItem(doc=name, page=int(metadata.get("page", 0)) + 1, url=url))
+    return sources
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(req: UserRequest, request: Request):
+    print(f"📩 [{metrics.trace_id_var.get()}] ข้อความเข้า: {req.message}")
+
+    # 0. คำถามซ้ำช่วง peak ตอบจาก cache เลย ไม่ต้องเรียก LLM และไม่ต้องเข้าคิว
+    # (cache เก็บเฉพาะข้อความที่ไม่มี trigger จึงเช็คก่อน route ได้)
+    answer_key = normalize_query(req.message)
+    cached_response = await answer_cache.aget(answer_key)
+    if cached_response is not None:
+        admit_cheap(request)
+        print("⚡ Answer cache hit")
+        return cached_response
+
+    # keyword scan เร็วมาก ทำก่อน: รู้ priority ของคิว และให้การค้นกรองตามฟอร์มที่ keyword ตรง
+    match = match_message(req.message)
+    slot = await admit_llm(request, match)
+    try:
+        return await answer_message(req.message, answer_key, match)
+    finally:
+        slot.release()
+
+async def answer_message(message: str, answer_key: str, match: MessageMatch) -> ChatResponse:
     # ---------------------------------------------------------
-    # 🚦 STEP 1: ROUTER - เช็คเจตนาผู้ใช้
+    # 🚦 STEP 1: ROUTER - เช็คเจตนาผู้ใช้ (ค้น Vector DB ไปพร้อมกัน)
     # ---------------------------------------------------------
-    trigger_words = ["สร้างไฟล์", "เจนไฟล์", "กรอกให้หน่อย", "ร่างคำร้อง", "ทำเอกสาร", "ออกใบ"]
-    user_wants_file = any(word in req.message.lower() for word in trigger_words)
+    route, pre, retrieval = await route_with_speculation(message, match)
 
-    if user_wants_file:
+    if pre is not None:
         # === 🅰️ โหมดสร้างไฟล์ ===
         print("⚙️ Detect: สร้างไฟล์")
-        
-        # 1. ให้ AI แกะ JSON
-        json_data_str = await get_extractor_response(req.message, groq_client)
-        
-        # 2. สร้างไฟล์ .docx (บันทึกลง Disk)
-        # ใช้ฟังก์ชัน generate_document_auto จาก document_generator.py
-        file_path = generate_document_auto(json_data_str)
-        
-        if file_path:
-            filename = os.path.basename(file_path)
-            # สร้างลิงก์สำหรับดาวน์โหลด (สมมติรันบน localhost)
-            # ถ้าขึ้น Server จริง ต้องเปลี่ยน localhost เป็น Domain ของคุณ
-            base_url = os.getenv("APP_URL", "http://localhost:8000") 
-            download_url = f"{base_url}/download/{filename}"
-            
-            return ChatResponse(
-                reply=f"✅ ผมร่างเอกสารให้เรียบร้อยแล้วครับ!\n\n📂 **ดาวน์โหลดไฟล์ Word ได้ที่นี่:**\n{download_url}\n\n(คุณสามารถนำไปแก้ไขจัดหน้าต่อได้เลยครับ)",
-                sources=[]
-            )
-        else:
-            return ChatResponse(reply="ขออภัยครับ ผมไม่แน่ใจว่าต้องใช้ฟอร์มไหน หรือข้อมูลไม่เพียงพอ", sources=[])
+        return await handle_file_request(message, pre)
 
+    # === 🅱️ โหมดตอบคำถาม (RAG) ===
+    if route.match.triggers:
+        print("💬 Detect: ไม่รู้ว่าต้องใช้ฟอร์มไหน ตอบคำถามแทน")
     else:
-        # === 🅱️ โหมดตอบคำถาม (RAG) ===
         print("💬 Detect: ตอบคำถาม")
-        
-        # 1. ค้นหาใน Vector DB
-        search_results = vector_store.similarity_search(req.message, k=3)
-        
-        # 2. รวม Context + หาลิงก์ PDF ต้นฉบับ
-        context_text = ""
-        sources = []
-        
-        # (Logic เดิมของคุณที่ใช้ FORM_MASTER_DATA เช็คคีย์เวิร์ด)
-        for item in FORM_MASTER_DATA:
-            for kw in item["keywords"]:
-                if kw in req.message.lower():
-                    context_text += f"\n[ระบบแนะนำ]: ผู้ใช้ถามถึง '{item['name']}' ({item['id']})\n"
-                    # เพิ่ม Source อัตโนมัติ
-                    if not any(s.url == item["url"] for s in sources):
-                        sources.append(SourceItem(doc=item["name"], page=1, url=item["url"]))
-                    break
-
-        for doc in search_results:
-            context_text += f"{doc.page_content}\n\n"
-            # ... (Logic ดึง Source จาก Metadata ของคุณ) ...
-
-        # 3. ให้ AI ตอบ
-        answer = await get_advisor_response(context_text, req.message, groq_client)
-        
-        return ChatResponse(reply=answer, sources=sources)
+
+    # 1. ผลค้นหาใน Vector DB (เริ่มไว้ตั้งแต่ตอน route)
+    try:
+        search_results = await take_retrieval(retrieval, message, route.match)
+    finally:
+        cancel_retrieval(retrieval)
+    grounded = search_results is not None
+    search_results = search_results or []
+
+    # 2. รวม Context (ภายในงบ token) + หาลิงก์ PDF ต้นฉบับ (ฟอร์มที่ keyword ตรง + ที่มาของ chunk)
+    context_text = build_advisor_context(message, route.match, search_results)
+    sources = document_sources(search_results, keyword_sources(route.match))
+
+    # 3. ให้ AI ตอบ
+    answer = await get_advisor_response(context_text, message, groq_client)
+
+    response = ChatResponse(reply=answer, sources=sources)
+    # ค้นไม่สำเร็จ (warm-up / Qdrant ช้า / คิวเต็ม) ไม่ cache คำตอบที่ไม่มี context จาก Vector DB
+    # ไม่งั้นคำตอบนั้นค้างอยู่จนหมด TTL ทั้งที่ครั้งถัดไปอาจค้นได้ปกติ
+    if not answer.startswith("AI Error:") and grounded and not route.match.triggers:
+        await answer_cache.aset(answer_key, response)
+    return response
+
+# --- Endpoint แบบ Server-Sent Events: ส่ง sources ก่อน แล้วตามด้วย token ทีละชิ้น ---
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: UserRequest, request: Request):
+    print(f"📩 [{metrics.trace_id_var.get()}] ข้อความเข้า (stream): {req.message}")
+    answer_key = normalize_query(req.message)
+    cached_response = await answer_cache.aget(answer_key)
+    if cached_response is not None:
+        admit_cheap(request)
+        print("⚡ Answer cache hit")
+
+        async def cached_events():
+            yield sse_event("sources", jsonable_encoder(cached_response.sources))
+            yield sse_event("token", {"text": cached_response.reply})
+            yield sse_event("done", {"reply": cached_response.reply})
+
+        return StreamingResponse(
+            cached_events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    match = match_message(req.message)
+    slot = await admit_llm(request, match)
+    try:
+        route, pre, retrieval = await route_with_speculation(req.message, match)
+        if pre is not None:
+            # โหมดสร้างไฟล์ไม่มีอะไรให้ stream ทำให้เสร็จก่อน (ถ้าคิวเต็มจะได้ 503 ตามปกติ)
+            print("⚙️ Detect: สร้างไฟล์")
+            response = await handle_file_request(req.message, pre)
+    except BaseException:
+        slot.release()
+        raise
+
+    if pre is not None:
+        slot.release()
+
+        async def file_events():
+            yield sse_event("sources", [])
+            yield sse_event("token", {"text": response.reply})
+            yield sse_event("done", {"reply": response.reply})
+
+        return StreamingResponse(file_events(), media_type="text/event-stream")
+
+    print("💬 Detect: ตอบคำถาม")
+
+    async def rag_events():
+        try:
+            # sources จาก keyword ส่งได้ก่อนผลค้น Vector DB และก่อน LLM เริ่ม
+            sources = keyword_sources(route.match)
+            yield sse_event("sources", jsonable_encoder(sources))
+
+            search_results = await take_retrieval(retrieval, req.message, route.match)
+        finally:
+            # client ตัดการเชื่อมต่อก่อนได้ผลค้น
+            cancel_retrieval(retrieval)
+        grounded = search_results is not None
+        search_results = search_results or []
+        # chunk ที่ค้นได้มาจากฟอร์มอื่นเพิ่ม: ส่ง event "sources" ชุดเต็มอีกครั้ง (แทนชุดแรก)
+        all_sources = document_sources(search_results, sources)
+        if len(all_sources) != len(sources):
+            sources = all_sources
+            yield sse_event("sources", jsonable_encoder(sources))
+        context_text = build_advisor_context(req.message, route.match, search_results)
+
+        parts = []
+        try:
+            async for text in stream_advisor_response(context_text, req.message, groq_client):
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+        except Exception as e:
+            yield sse_event("error", {"detail": f"AI Error: {e}"})
+            return
+
+        answer = "".join(parts)
+        if grounded and not route.match.triggers:
+            await answer_cache.aset(answer_key, ChatResponse(reply=answer, sources=sources))
+        yield sse_event("done", {"reply": answer})
+
+    # background = กันกรณี client ตัดก่อน stream เริ่ม (generator ไม่เคยรัน finally ไม่ทำงาน)
+    return StreamingResponse(
+        release_after(rag_events(), slot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.release),
+    )
 
 # --- Endpoint สำหรับ Generate ไฟล์แบบ Stream (ถ้าจะใช้แยก) ---
 @app.post("/generate-document")
 async def generate_document(req: GenerateRequest):
     print(f"🖨️ Generate Request: {req.form_type}")
-    file_stream = generate_document_stream(json.dumps(req.form_data))
+    try:
+        stored = await render_to_store(json.dumps(req.form_data))
+    except RenderPoolSaturated:
+        raise render_busy_error()
     
-    if not file_stream:
+    if not stored:
         raise HTTPException(status_code=500, detail="สร้างไฟล์ไม่สำเร็จ")
 
+    token, stored_filename = stored
     filename = f"Filled_{req.form_type}_{req.student_id}.docx"
-    encoded_filename = quote(filename)
+    return stored_document_response(token, stored_filename, filename)
+
+# --- Endpoint สำหรับ Generate ฟอร์มเดียวกันทีละหลายคน (ส่งกลับเป็น ZIP แบบ stream) ---
+async def _spool_request_body(request: Request):
+    """เก็บ body ลงไฟล์ชั่วคราว (อยู่ใน RAM แค่ 1MB แรก) ก่อนเริ่มตอบ
+    เพราะอ่าน request body ระหว่าง StreamingResponse กำลังส่งไม่ได้"""
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+async def _iter_ndjson_records(spool) -> AsyncIterator[Dict[str, Any]]:
+    """อ่าน NDJSON ทีละบรรทัด บรรทัดที่ parse ไม่ได้จะได้ Exception แทน record"""
+    try:
+        for line in spool:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                yield e
+    finally:
+        spool.close()
+
+async def _iter_list_records(records: List[BatchRecord]) -> AsyncIterator[Dict[str, Any]]:
+    for record in records:
+        yield {"student_id": record.student_id, "form_data": record.form_data}
+
+async def _stream_batch_zip(
+    form_type: str, records: AsyncIterator[Dict[str, Any]], release: Callable[[], None]
+):
+    zip_writer = ZipStreamWriter()
+    errors: List[str] = []
+    pending = set()
+
+    async def render_one(index: int, record: Dict[str, Any]):
+        student_id = "unknown"
+        try:
+            student_id = str(record.get("student_id", "unknown"))
+            form_data = {**record.get("form_data", {}), "form_type": form_type}
+            file_stream = await render_pool.run(generate_document_stream, json.dumps(form_data), batch=True)
+        except Exception as e:
+            # คืน error พร้อมลำดับ record ไม่งั้นหาไม่เจอว่าแถวไหนพังใน batch หลายพันแถว
+            return index, student_id, e
+        return index, student_id, file_stream
+
+    def collect(done) -> bytes:
+        out = b""
+        for task in done:
+            index, student_id, file_stream = task.result()
+            if isinstance(file_stream, Exception):
+                errors.append(f"#{index} ({student_id}): render error: {file_stream or type(file_stream).__name__}")
+                continue
+            if not file_stream:
+                errors.append(f"#{index} ({student_id}): สร้างไฟล์ไม่สำเร็จ")
+                continue
+            filename = f"Filled_{form_type}_{_safe_filename_part(student_id)}.docx"
+            out += zip_writer.add(filename, file_stream.getvalue())
+        return out
+
+    try:
+        index = 0
+        async for record in records:
+            if isinstance(record, Exception):
+                errors.append(f"#{index}: อ่านข้อมูลไม่ได้ ({record})")
+                index += 1
+                continue
+            pending.add(asyncio.create_task(render_one(index, record)))
+            index += 1
+            if len(pending) >= BATCH_RENDER_WINDOW:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                yield collect(done)
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            yield collect(done)
+
+        tail = b""
+        if errors:
+            tail = zip_writer.add("errors.txt", "\n".join(errors).encode("utf-8"))
+        print(f"📦 Batch เสร็จ: {index - len(errors)}/{index} ไฟล์")
+        yield tail + zip_writer.close()
+    finally:
+        # client ตัดการเชื่อมต่อกลางทาง -> ยกเลิกงานที่ยังค้าง
+        for task in pending:
+            task.cancel()
+        release()
+
+@app.post("/generate-documents/batch")
+async def generate_documents_batch(request: Request, form_type: Optional[str] = None):
+    """รับ JSON {form_type, records:[{student_id, form_data}]} หรือ NDJSON (ทีละ record, ส่ง form_type ใน query)"""
+    content_type = request.headers.get("content-type", "")
+    is_ndjson = "ndjson" in content_type
+    if not is_ndjson:
+        try:
+            body = BatchGenerateRequest(**(await request.json()))
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"ข้อมูลไม่ถูกต้อง: {e}")
+        form_type = body.form_type
+
+    form_type = (form_type or "").upper()
+    if form_type not in TEMPLATE_MAP:
+        raise HTTPException(status_code=400, detail=f"ไม่พบ Template รหัส '{form_type}'")
+
+    try:
+        release = render_pool.begin_batch()
+    except RenderPoolSaturated:
+        raise render_busy_error()
+    try:
+        if is_ndjson:
+            records = _iter_ndjson_records(await _spool_request_body(request))
+        else:
+            records = _iter_list_records(body.records)
+    except BaseException:
+        release()
+        raise
 
+    print(f"📦 Batch Generate Request: {form_type}")
+    filename = quote(f"Filled_{form_type}_batch.zip")
+    # background = กันกรณี client ตัดก่อน stream เริ่ม (generator ไม่เคยรัน finally ไม่ทำงาน)
     return StreamingResponse(
-        file_stream, 
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        headers={"Content-Disposition": f"attachment; filename*=utf-8''{encoded_filename}"}
+        _stream_batch_zip(form_type, records, release),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{filename}"},
+        background=BackgroundTask(release),
     )
 
+# process เดียว (core เดียว) ถ้าต้องการหลาย worker ที่แชร์ model กันใช้ `python serve.py`
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000)) 
     uvicorn.run(app, host="0.0.0.0", port=port)
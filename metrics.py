@@ -0,0 +1,246 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# ---------------------------------------------------------
+# Metrics แบบ Prometheus (text format) ไม่ต้องพึ่ง lib เพิ่ม
+# - span("stage") จับเวลาแต่ละขั้น (router / retrieval / LLM / render ...) ลง histogram
+# - trace id ต่อ request (X-Request-ID) ใช้ติด log ของ span ได้ถ้าเปิด TRACE_LOGS=1
+# - stats เดิมของ cache / render pool / output store ดึงมาแสดงตอน scrape ผ่าน collector
+# ---------------------------------------------------------
+
+TRACE_LOGS = os.environ.get("TRACE_LOGS", "0").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+trace_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+# ใน worker process ของ render pool: เก็บ span ไว้ส่งกลับ parent แทนการลง histogram ของตัวเอง
+_captured_spans: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar(
+    "captured_spans", default=None
+)
+
+
+def _label_key(labelnames: Sequence[str], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [count ต่อ bucket (ไม่สะสม), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels: Any) -> int:
+        entry = self._values.get(_label_key(self.labelnames, labels))
+        return entry[2] if entry else 0
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                    )
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# collector คืน list ของ (ชื่อ, help, type, [(labels, value), ...]) ตอน scrape
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        # รวม sample ชื่อเดียวกันจากหลาย collector (เช่น cache หลายตัว) ไว้ใต้ HELP/TYPE เดียว
+        families: Dict[str, list] = {}
+        for collector in self._collectors:
+            for name, help, kind, samples in collector():
+                families.setdefault(name, [help, kind, []])[2].extend(samples)
+        for name, (help, kind, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                names = tuple(labels)
+                lines.append(
+                    f"{name}{_format_labels(names, [labels[n] for n in names])} {_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "path", "status")
+))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts (streaming bodies continue after this)",
+    ("method", "path"),
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "stage_duration_seconds", "Duration of each pipeline stage", ("stage",)
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "stage_errors_total", "Pipeline stages that raised", ("stage",)
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "Tokens reported by the Groq API", ("call", "kind")
+))
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    captured = _captured_spans.get()
+    if captured is not None:
+        captured.append((stage, seconds))
+        return
+    STAGE_LATENCY.observe(seconds, stage=stage)
+    if TRACE_LOGS:
+        print(f"🕒 [{trace_id_var.get() or '-'}] {stage} {seconds * 1000:.1f}ms")
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """จับเวลาขั้นตอนหนึ่ง (ใช้ได้ทั้งใน async และ thread)"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def capture_spans() -> Iterator[list]:
+    """เก็บ span ที่เกิดข้างในไว้ใน list (ใช้ใน worker process แล้วส่งกลับไป observe ที่ parent)"""
+    captured: list = []
+    token = _captured_spans.set(captured)
+    try:
+        yield captured
+    finally:
+        _captured_spans.reset(token)
+
+
+def observe_spans(spans: Iterable[Tuple[str, float]]) -> None:
+    for stage, seconds in spans:
+        observe_stage(stage, seconds)
+
+
+def record_usage(call: str, usage: Any) -> None:
+    """นับ token จาก response.usage ของ Groq (ไม่มี usage = ข้าม)"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value:
+            LLM_TOKENS.inc(value, call=call, kind=kind.replace("_tokens", ""))
+
+
+def stats_samples(prefix: str, stats: Dict[str, Any], labels: Optional[Dict[str, Any]] = None):
+    """แปลง dict stats (ซ้อนกันได้) เป็น gauge เช่น {"hits": 3} -> {prefix}_hits 3"""
+    labels = labels or {}
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, dict):
+            yield from stats_samples(name, value, labels)
+        elif isinstance(value, (int, float)):
+            yield name, "Snapshot of " + name.replace("_", " "), "gauge", [(labels, value)]
@@ -0,0 +1,148 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from cache import LRUCache
+
+# ---------------------------------------------------------
+# ที่เก็บไฟล์เอกสารที่สร้างแล้ว (แทนการเขียน output/Filled_*.docx ทับกันไปเรื่อยๆ)
+# - key = hash ของ form_type + ข้อมูลที่ render -> ข้อมูลเหมือนเดิมไม่ต้อง render ซ้ำ
+# - token = HMAC(secret, key) เดาไม่ได้ถ้าไม่รู้ secret ใช้เป็นชื่อโฟลเดอร์ output/{token}/
+# - ลบไฟล์เองตามอายุ (TTL) และขนาดรวม (ไฟล์ที่ไม่ได้ใช้นานสุดออกก่อน)
+#   ไล่ทั้งโฟลเดอร์อย่างมากทุก evict_interval วินาที (ระหว่างนั้นขนาดรวมเกิน max_bytes ได้ชั่วคราว)
+# ---------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class OutputStore:
+    def __init__(
+        self,
+        directory: str,
+        ttl: float,
+        max_bytes: int,
+        memory_items: int = 0,
+        secret: Optional[str] = None,
+        evict_interval: float = 30.0,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._next_evict = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # ไม่ได้ตั้ง secret = สุ่มใหม่ทุกครั้งที่ start (ลิงก์เดิมยังโหลดได้ แต่จะไม่ dedupe ข้ามรอบ)
+        self._secret = (secret or secrets.token_hex(32)).encode()
+        self._memory = LRUCache("output_memory", memory_items)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def token_for(self, form_type: str, data: Dict[str, Any]) -> str:
+        canonical = json.dumps(
+            {"form_type": form_type, "data": data}, sort_keys=True, ensure_ascii=False
+        )
+        key = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        return hmac.new(self._secret, key.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def _entry_dir(self, token: str) -> Optional[str]:
+        if not _TOKEN_RE.match(token):
+            return None
+        return os.path.join(self.directory, token)
+
+    def _expired(self, entry_dir: str) -> bool:
+        # evict() รันตอน put() เท่านั้น server ที่ไม่มีใครสร้างไฟล์ใหม่ ต้องเช็คอายุตอนอ่านเองด้วย
+        try:
+            return time.time() - os.path.getmtime(entry_dir) > self.ttl
+        except OSError:
+            return True
+
+    def lookup(self, token: str) -> Optional[str]:
+        """คืนชื่อไฟล์ถ้ามีอยู่แล้วและยังไม่หมดอายุ (cache hit) พร้อมต่ออายุ"""
+        entry_dir = self._entry_dir(token)
+        if entry_dir is not None and self._expired(entry_dir):
+            entry_dir = None
+        try:
+            names = [n for n in os.listdir(entry_dir) if not n.startswith(".")] if entry_dir else []
+        except FileNotFoundError:
+            names = []
+        if not names:
+            self.misses += 1
+            return None
+        os.utime(entry_dir)
+        self.hits += 1
+        return names[0]
+
+    def get(self, token: str, filename: str) -> Optional[Tuple[Optional[bytes], str]]:
+        """คืน (bytes ถ้าอยู่ใน RAM, path บน disk) ของไฟล์ หรือ None ถ้าไม่มี/หมดอายุ"""
+        entry_dir = self._entry_dir(token)
+        if entry_dir is None or os.path.basename(filename) != filename:
+            return None
+        if self._expired(entry_dir):
+            self._memory.discard(token)
+            return None
+        path = os.path.join(entry_dir, filename)
+        cached = self._memory.get(token)
+        if cached is not None and cached[0] == filename:
+            os.utime(entry_dir)
+            return cached[1], path
+        if not os.path.isfile(path):
+            return None
+        os.utime(entry_dir)
+        return None, path
+
+    def put(self, token: str, filename: str, content: bytes) -> None:
+        entry_dir = self._entry_dir(token)
+        os.makedirs(entry_dir, exist_ok=True)
+        # เขียนไฟล์ชั่วคราวแล้ว rename เพื่อไม่ให้ request ที่โหลดพร้อมกันได้ไฟล์ครึ่งๆ
+        tmp_path = os.path.join(entry_dir, f".{filename}.{secrets.token_hex(4)}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, os.path.join(entry_dir, filename))
+        self._memory.set(token, (filename, content))
+        if time.monotonic() >= self._next_evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """ลบ entry ที่หมดอายุ แล้วลบตัวที่ไม่ได้ใช้นานสุดจนขนาดรวมไม่เกิน max_bytes"""
+        with self._lock:
+            self._next_evict = time.monotonic() + self.evict_interval
+            now = time.time()
+            entries = []
+            for token in os.listdir(self.directory):
+                entry_dir = os.path.join(self.directory, token)
+                if not _TOKEN_RE.match(token):
+                    continue
+                try:
+                    size = sum(
+                        os.path.getsize(os.path.join(entry_dir, n)) for n in os.listdir(entry_dir)
+                    )
+                    entries.append((os.path.getmtime(entry_dir), size, token))
+                except OSError:
+                    continue  # ถูกลบ/กำลังเขียนพร้อมกัน รอบหน้าค่อยดู
+
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, token in entries:
+                if now - mtime <= self.ttl and total <= self.max_bytes:
+                    break
+                shutil.rmtree(os.path.join(self.directory, token), ignore_errors=True)
+                self._memory.discard(token)
+                total -= size
+                self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "memory": self._memory.stats(),
+        }
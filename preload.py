@@ -1,10 +1,23 @@
 # preload.py
-from langchain_huggingface import HuggingFaceEmbeddings
+# ดาวน์โหลด model ชุดเดียวกับที่ main.py / upload_data.py ใช้ (อ่านจาก config.py)
+# ลง MODEL_CACHE_DIR ตอน build image เพื่อให้ container ไม่ต้องโหลดตอน boot
+# ใช้: MODEL_CACHE_DIR=/app/model_cache python preload.py
+import os
+import time
+
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 from langchain_qdrant import FastEmbedSparse
-# or whatever library you use in main.py
 
-print("Downloading models...")
-# Initialize the model here to force the download
-embeddings = HuggingFaceEmbeddings(model_name='BAAI/bge-m3')
-sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
-print("Download complete!")
\ No newline at end of file
+from config import DENSE_MODEL_NAME, SPARSE_MODEL_NAME, MODEL_CACHE_DIR
+
+print(f"Downloading models to {os.path.abspath(MODEL_CACHE_DIR)}...")
+os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+started = time.perf_counter()
+# Initialize the models here to force the download, then run one inference to check the files load
+embeddings = FastEmbedEmbeddings(model_name=DENSE_MODEL_NAME, cache_dir=MODEL_CACHE_DIR)
+embeddings.embed_query("warm up")
+print(f" - {DENSE_MODEL_NAME}")
+sparse_embeddings = FastEmbedSparse(model_name=SPARSE_MODEL_NAME, cache_dir=MODEL_CACHE_DIR)
+sparse_embeddings.embed_query("warm up")
+print(f" - {SPARSE_MODEL_NAME}")
+print(f"Download complete! ({time.perf_counter() - started:.1f}s)")
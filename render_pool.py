@@ -0,0 +1,195 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+from document_generator import warm_template_cache
+
+# ---------------------------------------------------------
+# Process Pool สำหรับ render .docx (docxtpl เป็น pure Python กิน CPU)
+# แต่ละ worker มี Template Cache ของตัวเอง (อุ่นใน initializer) และจำกัดจำนวนงานค้างในคิว
+# worker เกิดจาก forkserver ไม่ได้ fork จาก server ตรงๆ: server มี thread เยอะ (retrieval, ONNX, httpx)
+# fork ตอนที่ thread อื่นถือ lock อยู่ ลูกจะค้างที่ lock นั้นตลอดไป
+# worker ตายกลางงาน (OOM / segfault) ทั้ง pool ใช้ต่อไม่ได้ สร้าง pool ใหม่แทน (งานที่ค้างอยู่ตอบ 503)
+# ---------------------------------------------------------
+
+class RenderPoolSaturated(Exception):
+    """คิว render เต็ม ให้ endpoint ตอบ 503 + Retry-After"""
+
+
+class _Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        avg = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "avg_s": round(avg, 4), "max_s": round(self.max, 4)}
+
+
+def _mp_context() -> multiprocessing.context.BaseContext:
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    ctx = multiprocessing.get_context("forkserver")
+    # forkserver import __main__ + module นี้ (docxtpl, template code) ไว้ครั้งเดียว
+    # worker ที่ fork ออกจาก forkserver ไม่ต้อง import app ใหม่ทุกตัว (ไม่มี thread ติดมา)
+    ctx.set_forkserver_preload(["__main__", __name__])
+    return ctx
+
+
+def _exit_with_parent(server_pid: int) -> None:
+    # server ถูก kill -9 (เช่น serve.py restart worker ที่ค้าง) queue ของ pool ไม่ส่ง EOF มาให้
+    # และ forkserver ก็ไม่ปิดตาม (worker ถือปลาย pipe ของมันไว้) ต้องคอยเช็คเองว่า server ยังอยู่
+    while True:
+        try:
+            os.kill(server_pid, 0)
+        except ProcessLookupError:
+            os._exit(0)
+        time.sleep(1)
+
+
+def _init_worker(server_pid: int) -> None:
+    threading.Thread(target=_exit_with_parent, args=(server_pid,), daemon=True).start()
+    warm_template_cache()
+
+
+def _ping() -> bool:
+    return True
+
+
+def _timed_job(fn: Callable, submitted_at: float, *args: Any):
+    started_at = time.time()
+    # span ที่เกิดใน worker (template render/save) ส่งกลับไปลง metrics ของ parent
+    with metrics.capture_spans() as spans:
+        result = fn(*args)
+    return result, started_at - submitted_at, time.time() - started_at, spans
+
+
+class RenderPool:
+    def __init__(self, workers: int, max_pending: int, max_batches: int = 1):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_batches = max_batches
+        self.pending = 0
+        self.batches = 0
+        self.batch_pending = 0
+        self.rejected = 0
+        self.queue_wait = _Timing()
+        self.render_time = _Timing()
+        self.restarts = 0
+        self.healthy = False
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._restart_lock = asyncio.Lock()
+
+    def start(self) -> None:
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=_mp_context(),
+            initializer=_init_worker,
+            initargs=(os.getpid(),),
+        )
+        # ส่งงานเปล่าให้ครบทุก worker เพื่อบังคับ spawn + warm-up ก่อนรับ traffic
+        for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        self.healthy = True
+
+    def shutdown(self) -> None:
+        self.healthy = False
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def begin_batch(self) -> Callable[[], None]:
+        """จองที่ให้ batch request หนึ่งงาน (ครบ max_batches แล้ว = RenderPoolSaturated)
+        คืนฟังก์ชันสำหรับคืนที่ เรียกซ้ำได้ (stream อาจจบได้หลายทาง)"""
+        if self.batches >= self.max_batches:
+            self.rejected += 1
+            raise RenderPoolSaturated()
+        self.batches += 1
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.batches -= 1
+
+        return release
+
+    async def run(self, fn: Callable, *args: Any, batch: bool = False) -> Any:
+        """รัน fn(*args) ใน worker process ถ้างานค้างเกิน max_pending จะ raise RenderPoolSaturated
+        (batch=True = งานของ batch request: ไม่ปฏิเสธ และนับแยกใน batch_pending
+        ไม่กินโควตา max_pending ของงาน interactive เพราะ batch คุมจำนวนงานค้างเองอยู่แล้ว)"""
+        if not batch and self.pending >= self.max_pending:
+            self.rejected += 1
+            raise RenderPoolSaturated()
+
+        if batch:
+            self.batch_pending += 1
+        else:
+            self.pending += 1
+        executor = self._executor
+        try:
+            if executor is None:
+                raise BrokenProcessPool("render pool is not running")
+            future = executor.submit(_timed_job, fn, time.time(), *args)
+            result, wait_s, render_s, spans = await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # ไม่ลองงานเดิมซ้ำ: ถ้างานนี้เองที่ทำ worker ตาย จะพา pool ใหม่ล้มตามไปด้วย
+            await self._restart(executor)
+            raise RenderPoolSaturated()
+        finally:
+            if batch:
+                self.batch_pending -= 1
+            else:
+                self.pending -= 1
+
+        self.queue_wait.add(wait_s)
+        self.render_time.add(render_s)
+        metrics.observe_stage("render_queue_wait", wait_s)
+        metrics.observe_stage("render", render_s)
+        metrics.observe_spans(spans)
+        return result
+
+    async def _restart(self, broken: Optional[ProcessPoolExecutor]) -> None:
+        async with self._restart_lock:
+            if self._executor is not broken:
+                return  # งานอื่นที่พังพร้อมกันสร้างใหม่ไปแล้ว
+            self.healthy = False
+            self.restarts += 1
+            self._executor = None
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            print("⚠️ Render worker ตาย สร้าง render pool ใหม่")
+            try:
+                await asyncio.to_thread(self.start)
+            except Exception as e:
+                # ยังสร้างไม่ได้ (healthy=False, /readyz ตอบ 503) งานถัดไปจะลองสร้างใหม่อีก
+                self._executor = None
+                print(f"❌ สร้าง render pool ใหม่ไม่ได้: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "healthy": self.healthy,
+            "restarts": self.restarts,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "batches": self.batches,
+            "max_batches": self.max_batches,
+            "batch_pending": self.batch_pending,
+            "rejected": self.rejected,
+            "queue_wait": self.queue_wait.as_dict(),
+            "render_time": self.render_time.as_dict(),
+        }
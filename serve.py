@@ -0,0 +1,245 @@
+# serve.py
+# รัน API แบบหลาย worker process (แทน `python main.py` ที่ได้ core เดียว)
+# master โหลด model / template / local index ครั้งเดียว แล้ว fork worker ที่ใช้ของชุดนั้นร่วมกัน
+# แบบ copy-on-write (RAM ไม่คูณตามจำนวน worker, worker ใหม่ไม่ต้องโหลด model เอง)
+# - worker ทุกตัว accept จาก socket เดียวกัน (kernel กระจาย connection ให้)
+# - cache ผลค้นหา/คำตอบ ใช้ sqlite ไฟล์เดียวร่วมกัน, ไฟล์เอกสารอยู่ใน OUTPUT_DIR ร่วมกันอยู่แล้ว
+# - worker ตาย หรือ heartbeat หยุด (event loop ค้าง) master fork ตัวใหม่ให้
+#   ตายเร็วหลังเกิด (เช่น startup พัง) รอนานขึ้นเรื่อยๆ ก่อน fork ใหม่ ตายติดกันหลายรอบ = เลิก fork ช่องนั้น
+# - SIGHUP = restart worker ทีละตัว (เช่นหลัง export local index ใหม่), SIGTERM/SIGINT = ปิดทั้งหมด
+# ใช้: python serve.py --workers 4 --port 8000   (สถานะทุก worker: GET /workers)
+import argparse
+import gc
+import os
+import secrets
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+
+import uvicorn
+
+# worker ที่อยู่ไม่ถึงกี่วินาทีนับว่าตายตอน startup (ตายหลังจากนั้น = fork ใหม่ทันทีตามเดิม)
+CRASH_WINDOW = 30.0
+# รอก่อน fork ใหม่: 1, 2, 4, ... วินาที ไม่เกิน CRASH_BACKOFF_MAX, ตายติดกันเกิน MAX_CRASHES ครั้ง = เลิก
+CRASH_BACKOFF_MAX = 60.0
+MAX_CRASHES = 6
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API with preforked workers sharing preloaded models.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        help="Worker processes (default: WEB_CONCURRENCY or CPU count)",
+    )
+    parser.add_argument(
+        "--heartbeat-timeout",
+        type=float,
+        default=30,
+        help="Restart a worker whose heartbeat is older than this many seconds",
+    )
+    parser.add_argument(
+        "--state-dir",
+        help="Directory for worker status files and the shared cache (default: a new temp dir)",
+    )
+    return parser.parse_args(argv)
+
+
+def configure_environment(state_dir: str) -> None:
+    """ค่าที่ต้องตั้งก่อน import main (main.py อ่าน env ตอน import)"""
+    os.environ["WORKER_STATE_DIR"] = state_dir
+    os.environ.setdefault("SHARED_CACHE_PATH", os.path.join(state_dir, "cache.sqlite3"))
+    # ทุก worker ต้องใช้ secret เดียวกัน ไม่งั้นเอกสารเดียวกันได้ token ต่างกันแล้วแต่ worker
+    os.environ.setdefault("OUTPUT_TOKEN_SECRET", secrets.token_hex(32))
+    # ONNX Runtime ที่สร้าง thread pool แล้ว fork ต่อไม่ได้ และหลาย worker แบ่ง core กันอยู่แล้ว
+    os.environ.setdefault("EMBED_THREADS", "1")
+    # render pool ต่อ worker: worker หลายตัวรวมกันก็ใช้ครบทุก core แล้ว
+    os.environ.setdefault("RENDER_WORKERS", "1")
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket, workers: int, state_dir: str, heartbeat_timeout: float):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.state_dir = state_dir
+        self.heartbeat_timeout = heartbeat_timeout
+        self.children = {}  # pid -> index
+        self.running = True
+        self.restart_queue = []
+        self.restarting = None  # (index, pid ที่ถูกแทน, เวลาเริ่ม)
+        self.started_at = {}  # index -> เวลาที่ fork ตัวล่าสุด
+        self.crashes = {}  # index -> จำนวนครั้งที่ตายตอน startup ติดกัน
+        self.respawn_at = {}  # index -> เวลาที่จะ fork ใหม่ (รอ backoff อยู่)
+        self.failed = False
+
+    def spawn(self, index: int) -> None:
+        # buffer ที่ยังไม่ flush จะถูก copy ไปพิมพ์ซ้ำใน worker
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            self.started_at[index] = time.monotonic()
+            return
+        # --- worker ---
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        os.environ["WORKER_INDEX"] = str(index)
+        code = 0
+        try:
+            config = uvicorn.Config(self.app, lifespan="on", access_log=False)
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+
+    def stop(self, *_) -> None:
+        self.running = False
+
+    def reload(self, *_) -> None:
+        print("🔄 SIGHUP: restart worker ทีละตัว")
+        self.restart_queue = sorted(self.children, key=self.children.get)
+
+    def reap(self) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+            if self.running:
+                self.schedule_respawn(index, pid, status)
+
+    def schedule_respawn(self, index: int, pid: int, status: int) -> None:
+        uptime = time.monotonic() - self.started_at.get(index, 0)
+        if uptime >= CRASH_WINDOW:
+            self.crashes[index] = 0
+            print(f"⚠️ worker {index} (pid {pid}) จบการทำงาน (status {status}) fork ตัวใหม่")
+            self.spawn(index)
+            return
+        crashes = self.crashes[index] = self.crashes.get(index, 0) + 1
+        if crashes > MAX_CRASHES:
+            print(f"❌ worker {index} ตายตอน startup ติดกัน {crashes} ครั้ง เลิก fork ช่องนี้ (ดู log ด้านบน)")
+            if not self.children and not self.respawn_at:
+                print("❌ ไม่เหลือ worker ที่ทำงานได้ ปิด master")
+                self.failed = True
+                self.running = False
+            return
+        delay = min(CRASH_BACKOFF_MAX, 2 ** (crashes - 1))
+        print(f"⚠️ worker {index} (pid {pid}) ตายหลังเริ่ม {uptime:.1f}s (status {status}) รอ {delay}s แล้ว fork ใหม่")
+        self.respawn_at[index] = time.monotonic() + delay
+
+    def respawn_due(self) -> None:
+        now = time.monotonic()
+        for index, due in list(self.respawn_at.items()):
+            if due <= now:
+                del self.respawn_at[index]
+                self.spawn(index)
+
+    def _status(self, index: int):
+        import worker_state
+        return worker_state.read_status(self.state_dir, index)
+
+    def check_heartbeats(self) -> None:
+        for pid, index in list(self.children.items()):
+            status = self._status(index)
+            # ยังไม่เคยเขียน หรือเป็นไฟล์ของตัวเก่า = ยังบูทไม่เสร็จ ไม่นับ
+            if status is None or status.get("pid") != pid:
+                continue
+            if status["age_s"] > self.heartbeat_timeout:
+                print(f"⚠️ worker {index} (pid {pid}) heartbeat หยุด {status['age_s']}s kill แล้ว fork ใหม่")
+                os.kill(pid, signal.SIGKILL)
+
+    def rolling_restart(self) -> None:
+        if self.restarting is not None:
+            index, old_pid, started = self.restarting
+            status = self._status(index)
+            replaced = status is not None and status.get("pid") != old_pid and old_pid not in self.children
+            if not (replaced and status.get("ready")) and time.monotonic() - started < 120:
+                return
+            self.restarting = None
+        while self.restart_queue and self.restarting is None:
+            pid = self.restart_queue.pop(0)
+            if pid in self.children:
+                self.restarting = (self.children[pid], pid, time.monotonic())
+                os.kill(pid, signal.SIGTERM)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+        for index in range(self.workers):
+            self.spawn(index)
+        print(f"✅ Master pid {os.getpid()}: {self.workers} workers")
+        while self.running:
+            self.reap()
+            self.respawn_due()
+            self.check_heartbeats()
+            self.rolling_restart()
+            time.sleep(0.5)
+        self.shutdown()
+
+    def shutdown(self, grace: float = 30) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + grace
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.children.pop(pid)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    state_dir = args.state_dir or tempfile.mkdtemp(prefix="kmutt_workers_")
+    os.makedirs(state_dir, exist_ok=True)
+    configure_environment(state_dir)
+
+    import main as app_main
+
+    started = time.perf_counter()
+    app_main.preload()
+    print(f"✅ Preloaded in master ({time.perf_counter() - started:.1f}s)")
+    sock = bind_socket(args.host, args.port)
+    # ย้าย object ที่โหลดแล้วออกจากการไล่ของ GC: ไม่งั้น GC ใน worker เขียน refcount/flag
+    # ลงหน้า memory ของ model ทำให้หน้าที่แชร์กันโดน copy แยกทีละ worker
+    gc.collect()
+    gc.freeze()
+    master = Master(app_main.app, sock, args.workers, state_dir, args.heartbeat_timeout)
+    master.run()
+    sys.exit(1 if master.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
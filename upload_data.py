@@ -1,18 +1,41 @@
 import os
+import time
+import uuid
+import hashlib
+import argparse
+import multiprocessing
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient, models
-from langchain_qdrant import QdrantVectorStore, FastEmbedSparse, RetrievalMode
+from local_index import export_local_index
+from forms import form_id_for_source
+from config import (
+    COLLECTION_NAME,
+    QDRANT_URL,
+    QDRANT_API_KEY,
+    DENSE_VECTOR_NAME,
+    SPARSE_VECTOR_NAME,
+    FORM_ID_KEY,
+    DENSE_MODEL_NAME,
+    DENSE_VECTOR_SIZE,
+    SPARSE_MODEL_NAME,
+    MODEL_CACHE_DIR,
+)
+from langchain_qdrant import FastEmbedSparse
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_community.document_loaders.parsers import PyMuPDFParser
+from langchain_core.documents.base import Blob
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # Load keys
 load_dotenv()
 
-# --- CONFIGURATION (MUST MATCH MAIN.PY) ---
-COLLECTION_NAME = "demo_collection_railway_v2"  # <--- Make sure this matches main.py!
-QDRANT_URL = os.environ.get("QDRANT_URL")
-QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
+# --- CONFIGURATION (collection/model names are shared with main.py via config.py) ---
+# Used to tell the running API to drop its query/answer caches after a rebuild
+APP_URL = os.environ.get("APP_URL")
+CACHE_ADMIN_TOKEN = os.environ.get("CACHE_ADMIN_TOKEN")
 
 # URL list from your project
 PDF_URLS = [
@@ -37,61 +60,361 @@ PDF_URLS = [
     "https://regis.kmutt.ac.th/service/form/RO-26Updated.pdf", # RO.26
 ]
 
-def main():
-    print(f"🚀 Connecting to Qdrant: {QDRANT_URL}...")
-    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+# Payload keys written by QdrantVectorStore (metadata is nested under "metadata")
+SOURCE_KEY = "metadata.source"
+HASH_KEY = "metadata.content_hash"
+
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+
+def notify_cache_invalidation():
+    if not APP_URL or not CACHE_ADMIN_TOKEN:
+        print("ℹ️ APP_URL/CACHE_ADMIN_TOKEN not set, skipping cache invalidation.")
+        return
+    request = urllib.request.Request(
+        f"{APP_URL}/cache/invalidate",
+        method="POST",
+        headers={"X-Admin-Token": CACHE_ADMIN_TOKEN},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            print(f"🧹 API caches invalidated ({response.status})")
+    except Exception as e:
+        print(f"⚠️ Failed to invalidate API caches: {e}")
+
+def list_sources(pdf_dir=None):
+    """Return (source, location) pairs. Local files named like a known URL keep
+    that URL as their source, so point IDs match between online and offline runs."""
+    if not pdf_dir:
+        return [(url, url) for url in PDF_URLS]
+    known = {url.rsplit("/", 1)[-1]: url for url in PDF_URLS}
+    sources = []
+    for name in sorted(os.listdir(pdf_dir)):
+        if name.lower().endswith(".pdf"):
+            path = os.path.abspath(os.path.join(pdf_dir, name))
+            sources.append((known.get(name, path), path))
+    return sources
+
+def fetch_bytes(location):
+    if location.startswith(("http://", "https://")):
+        with urllib.request.urlopen(location, timeout=60) as response:
+            return response.read()
+    with open(location, "rb") as f:
+        return f.read()
+
+def point_id(source, index):
+    # Stable per (source, chunk position): re-ingesting a changed PDF overwrites in place
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}#{index}"))
+
+def load_chunks(source, data, content_hash):
+    docs = list(PyMuPDFParser().lazy_parse(Blob.from_data(data, path=source)))
+    for doc in docs:
+        doc.metadata["file"] = source
+        doc.metadata["source"] = source
+        doc.metadata["content_hash"] = content_hash
+        doc.metadata["form_id"] = form_id_for_source(source)
+    return text_splitter.split_documents(docs)
+
+def existing_hashes(client):
+    """(source -> set of content hashes currently stored in the collection,
+    sources with chunks that have no form_id yet, i.e. ingested before form tagging)"""
+    hashes = {}
+    untagged = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=COLLECTION_NAME,
+            with_payload=[SOURCE_KEY, HASH_KEY, FORM_ID_KEY],
+            with_vectors=False,
+            limit=1000,
+            offset=offset,
+        )
+        for point in points:
+            metadata = (point.payload or {}).get("metadata", {})
+            hashes.setdefault(metadata.get("source"), set()).add(metadata.get("content_hash"))
+            if "form_id" not in metadata:
+                untagged.add(metadata.get("source"))
+        if offset is None:
+            return hashes, untagged
+
+def tag_forms(client, sources):
+    """เติม form_id ให้ chunk เดิมของ source ที่ไม่ได้เปลี่ยน (แก้ payload อย่างเดียว ไม่ต้อง embed ใหม่)"""
+    for source in sources:
+        if source is None:
+            continue
+        client.set_payload(
+            collection_name=COLLECTION_NAME,
+            payload={"form_id": form_id_for_source(source)},
+            key="metadata",
+            points=source_filter(source),
+        )
+
+def source_filter(source, keep_hash=None):
+    must_not = []
+    if keep_hash is not None:
+        must_not.append(models.FieldCondition(key=HASH_KEY, match=models.MatchValue(value=keep_hash)))
+    return models.Filter(
+        must=[models.FieldCondition(key=SOURCE_KEY, match=models.MatchValue(value=source))],
+        must_not=must_not,
+    )
+
+def ensure_collection(client, recreate=False):
+    if recreate and client.collection_exists(COLLECTION_NAME):
+        print(f"🗑️ Dropping collection: {COLLECTION_NAME}")
+        client.delete_collection(COLLECTION_NAME)
 
-    # 1. Check/Create Collection
     if not client.collection_exists(COLLECTION_NAME):
         print(f"📦 Creating new collection: {COLLECTION_NAME}")
         client.create_collection(
             collection_name=COLLECTION_NAME,
-            vectors_config=models.VectorParams(size=384, distance=models.Distance.COSINE),
-            sparse_vectors_config={"sparse_vector": models.SparseVectorParams()},
+            vectors_config={DENSE_VECTOR_NAME: models.VectorParams(size=DENSE_VECTOR_SIZE, distance=models.Distance.COSINE)},
+            sparse_vectors_config={SPARSE_VECTOR_NAME: models.SparseVectorParams()},
         )
     else:
         print(f"✅ Collection {COLLECTION_NAME} already exists.")
 
-    # 2. Setup Models
-    print("🧠 Loading models...")
-    embeddings = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
-    sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
-
-    # 3. Process PDFs
-    all_docs = []
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-
-    print("📄 Downloading and processing PDFs...")
-    for url in PDF_URLS:
-        try:
-            print(f"   - Processing: {url}")
-            loader = PyMuPDFLoader(url)
-            docs = loader.load()
-            # Clean metadata to just filename
-            for doc in docs:
-                doc.metadata["file"] = url
-                doc.metadata["source"] = url
-            chunks = text_splitter.split_documents(docs)
-            all_docs.extend(chunks)
-        except Exception as e:
-            print(f"❌ Failed to load {url}: {e}")
-
-    # 4. Upload to Qdrant
-    print(f"📤 Uploading {len(all_docs)} chunks to Qdrant...")
-    QdrantVectorStore.from_documents(
-        documents=all_docs,
-        embedding=embeddings,
-        sparse_embedding=sparse_embeddings,
-        url=QDRANT_URL,
-        api_key=QDRANT_API_KEY,
-        collection_name=COLLECTION_NAME,
-        retrieval_mode=RetrievalMode.HYBRID,
-        vector_name="dense_vector",
-        sparse_vector_name="sparse_vector",
-        force_recreate=True # Don't delete if we just created it
+    for field_name in (SOURCE_KEY, FORM_ID_KEY):
+        client.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
+
+# --- EMBEDDING + UPLOAD ENGINE ---
+# Embedding runs in a process pool (each worker loads its own FastEmbed models),
+# uploads run on a thread pool, and both overlap: while batch N is being
+# upserted, batch N+1 is already being embedded.
+
+_embedders = None
+
+def _init_embedder(threads=None):
+    global _embedders
+    _embedders = (
+        FastEmbedEmbeddings(model_name=DENSE_MODEL_NAME, cache_dir=MODEL_CACHE_DIR, threads=threads),
+        FastEmbedSparse(model_name=SPARSE_MODEL_NAME, cache_dir=MODEL_CACHE_DIR, threads=threads),
+    )
+
+def _embed_texts(texts):
+    if _embedders is None:
+        _init_embedder()
+    dense_model, sparse_model = _embedders
+    dense = dense_model.embed_documents(texts)
+    sparse = [(v.indices, v.values) for v in sparse_model.embed_documents(texts)]
+    return dense, sparse
+
+class IngestionEngine:
+    def __init__(self, client, embed_batch_size=64, embed_workers=0, upload_batch_size=256, upload_parallel=2):
+        self.client = client
+        self.embed_batch_size = embed_batch_size
+        self.upload_batch_size = upload_batch_size
+        self.upload_parallel = upload_parallel
+        self.embed_workers = embed_workers
+        # embed_workers=0 embeds in this process (small runs, tests)
+        self._embed_pool = None
+        if embed_workers > 0:
+            self._embed_pool = ProcessPoolExecutor(
+                max_workers=embed_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_embedder,
+                initargs=(1,),  # one ORT thread per process, the pool provides the parallelism
+            )
+        self._upload_pool = ThreadPoolExecutor(max_workers=upload_parallel)
+        self._pending_chunks = []
+        self._embedding = deque()
+        self._uploading = deque()
+        self._points = []
+        self.chunks = 0
+        self._started = None
+
+    def add(self, chunks, ids):
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._pending_chunks.extend(zip(ids, chunks))
+        while len(self._pending_chunks) >= self.embed_batch_size:
+            self._submit_embedding(self._pending_chunks[:self.embed_batch_size])
+            del self._pending_chunks[:self.embed_batch_size]
+
+    def _submit_embedding(self, batch):
+        texts = [chunk.page_content for _, chunk in batch]
+        if self._embed_pool is None:
+            future = Future()
+            future.set_result(_embed_texts(texts))
+        else:
+            future = self._embed_pool.submit(_embed_texts, texts)
+        self._embedding.append((future, batch))
+        # Keep a bounded number of batches in flight so memory stays flat on big corpora
+        while len(self._embedding) > max(self.embed_workers, 1) * 2:
+            self._collect_embedding()
+
+    def _collect_embedding(self):
+        future, batch = self._embedding.popleft()
+        dense, sparse = future.result()
+        for (point_id, chunk), dense_vector, (indices, values) in zip(batch, dense, sparse):
+            self._points.append(models.PointStruct(
+                id=point_id,
+                vector={
+                    DENSE_VECTOR_NAME: dense_vector,
+                    SPARSE_VECTOR_NAME: models.SparseVector(indices=indices, values=values),
+                },
+                # Same payload layout as QdrantVectorStore so main.py can read it back
+                payload={"page_content": chunk.page_content, "metadata": chunk.metadata},
+            ))
+        while len(self._points) >= self.upload_batch_size:
+            self._submit_upload(self._points[:self.upload_batch_size])
+            del self._points[:self.upload_batch_size]
+
+    def _submit_upload(self, points):
+        self.chunks += len(points)
+        self._uploading.append(self._upload_pool.submit(
+            self.client.upsert, collection_name=COLLECTION_NAME, points=points, wait=True
+        ))
+        while len(self._uploading) > self.upload_parallel * 2:
+            self._uploading.popleft().result()
+
+    def flush(self):
+        """Embed and upload everything still buffered, then wait for all uploads."""
+        if self._pending_chunks:
+            self._submit_embedding(self._pending_chunks)
+            self._pending_chunks = []
+        while self._embedding:
+            self._collect_embedding()
+        if self._points:
+            self._submit_upload(self._points)
+            self._points = []
+        while self._uploading:
+            self._uploading.popleft().result()
+
+    def throughput(self):
+        if not self._started or not self.chunks:
+            return 0.0
+        return self.chunks / (time.perf_counter() - self._started)
+
+    def close(self):
+        if self._embed_pool is not None:
+            self._embed_pool.shutdown()
+        self._upload_pool.shutdown()
+
+def make_client(url):
+    if url == ":memory:":
+        return QdrantClient(location=":memory:")
+    return QdrantClient(url=url, api_key=QDRANT_API_KEY)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incrementally ingest form PDFs into Qdrant.")
+    parser.add_argument("--pdf-dir", help="Read PDFs from this directory instead of downloading PDF_URLS")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent download/parse workers")
+    parser.add_argument("--qdrant-url", default=QDRANT_URL, help="Qdrant URL, or :memory: for a local in-memory run")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="Chunks per embedding call")
+    parser.add_argument(
+        "--embed-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Embedding processes (0 = embed in the main process)",
+    )
+    parser.add_argument("--upload-batch-size", type=int, default=256, help="Points per upsert request")
+    parser.add_argument("--upload-parallel", type=int, default=2, help="Concurrent upsert requests")
+    parser.add_argument(
+        "--export-local",
+        metavar="DIR",
+        help="Also export the collection as a local index for RETRIEVAL_BACKEND=local",
+    )
+    parser.add_argument("--full", action="store_true", help="Drop and rebuild the whole collection")
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="With --pdf-dir, delete sources that are not in the directory (always on for PDF_URLS)",
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    print(f"🚀 Connecting to Qdrant: {args.qdrant_url}...")
+    client = make_client(args.qdrant_url)
+
+    # 1. Check/Create Collection
+    ensure_collection(client, recreate=args.full)
+    stored, untagged = existing_hashes(client)
+
+    # 2. Setup embedding/upload engine (models load inside the embedding workers)
+    print(f"🧠 Starting ingestion engine ({args.embed_workers} embedding workers)...")
+    engine = IngestionEngine(
+        client,
+        embed_batch_size=args.embed_batch_size,
+        embed_workers=args.embed_workers,
+        upload_batch_size=args.upload_batch_size,
+        upload_parallel=args.upload_parallel,
+    )
+
+    # 3. Download + hash + parse concurrently; unchanged sources are skipped before parsing
+    sources = list_sources(args.pdf_dir)
+    skipped = failed = 0
+    updated = {}
+
+    def process(source, location):
+        data = fetch_bytes(location)
+        content_hash = hashlib.sha256(data).hexdigest()
+        if stored.get(source) == {content_hash}:
+            return source, content_hash, None
+        return source, content_hash, load_chunks(source, data, content_hash)
+
+    print(f"📄 Checking {len(sources)} PDFs with {args.workers} workers...")
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = {pool.submit(process, s, loc): s for s, loc in sources}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    source, content_hash, chunks = future.result()
+                except Exception as e:
+                    print(f"❌ Failed to load {source}: {e}")
+                    failed += 1
+                    continue
+                if chunks is None:
+                    skipped += 1
+                    continue
+
+                print(f"   - Updating: {source} ({len(chunks)} chunks)")
+                engine.add(chunks, [point_id(source, i) for i in range(len(chunks))])
+                updated[source] = content_hash
+
+        # 4. Upsert new chunks first, then drop stale ones of updated sources (no empty window)
+        engine.flush()
+    finally:
+        engine.close()
+    for source, content_hash in updated.items():
+        client.delete(COLLECTION_NAME, points_selector=source_filter(source, keep_hash=content_hash))
+    if engine.chunks:
+        print(f"📤 Uploaded {engine.chunks} chunks ({engine.throughput():.1f} chunks/sec)")
+    changed = len(updated)
+
+    # Chunk ที่อัปโหลดก่อนมี form_id: เติม payload ให้ (source ที่เพิ่ง update ได้ form_id ไปแล้ว)
+    listed = {s for s, _ in sources}
+    retagged = [source for source in untagged if source in listed and source not in updated]
+    if retagged:
+        tag_forms(client, retagged)
+        print(f"🏷️ Tagged form_id on {len(retagged)} unchanged sources")
+
+    # 5. Remove sources that are no longer listed
+    removed = 0
+    if args.prune or not args.pdf_dir:
+        for source in stored:
+            if source is not None and source not in listed:
+                print(f"   - Removing: {source}")
+                client.delete(COLLECTION_NAME, points_selector=source_filter(source))
+                removed += 1
+
+    if args.export_local:
+        exported = export_local_index(
+            client, COLLECTION_NAME, args.export_local, DENSE_VECTOR_NAME, SPARSE_VECTOR_NAME
+        )
+        print(f"💾 Exported {exported} chunks to local index: {args.export_local}")
+    if changed or removed or retagged or args.export_local:
+        notify_cache_invalidation()
+    print(
+        f"🎉 Done in {time.perf_counter() - started:.1f}s: "
+        f"{changed} updated, {skipped} unchanged, {removed} removed, {failed} failed."
     )
-    
-    print("🎉 Success! Database is full. Your Railway app should work now.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
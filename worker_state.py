@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+# ---------------------------------------------------------
+# สถานะของแต่ละ worker ตอนรันผ่าน serve.py (หลาย process)
+# worker เขียน {WORKER_STATE_DIR}/worker-{WORKER_INDEX}.json เป็นระยะ (heartbeat)
+# - serve.py (master) ใช้ดูว่า worker ไหนค้าง (heartbeat เก่าเกิน) แล้ว restart
+# - /workers ของ worker ตัวไหนก็ได้ อ่านไฟล์ทั้งหมดมาแสดงรวมกัน
+# - metrics-{WORKER_INDEX}.prom: /metrics ของแต่ละ worker เขียนพร้อม heartbeat
+#   /metrics ตัวที่ถูกเรียกรวมทุกไฟล์ เติม label worker="i" (ของ worker อื่นช้ากว่าจริงไม่เกินรอบ heartbeat)
+# ---------------------------------------------------------
+
+def memory_usage() -> Dict[str, int]:
+    """RSS / PSS (kB) ของ process นี้ PSS หารหน้าที่แชร์ copy-on-write กับ process อื่นแล้ว"""
+    usage: Dict[str, int] = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Dirty"):
+                    usage[name.lower() + "_kb"] = int(rest.split()[0])
+    except (OSError, ValueError):
+        import resource
+        usage["rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
+
+
+def status_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"worker-{index}.json")
+
+
+def write_status(directory: str, index: int, status: Dict[str, Any]) -> None:
+    # เขียนไฟล์ชั่วคราวแล้ว rename กัน master อ่านเจอไฟล์ครึ่งๆ
+    path = status_path(directory, index)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({**status, "heartbeat": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def read_status(directory: str, index: int) -> Optional[Dict[str, Any]]:
+    try:
+        with open(status_path(directory, index), encoding="utf-8") as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    status["age_s"] = round(time.time() - status.get("heartbeat", 0), 2)
+    return status
+
+
+def read_statuses(directory: str) -> List[Dict[str, Any]]:
+    statuses = []
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("worker-") and name.endswith(".json"):
+            status = read_status(directory, int(name[len("worker-"):-len(".json")]))
+            if status is not None:
+                statuses.append(status)
+    return statuses
+
+
+def metrics_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"metrics-{index}.prom")
+
+
+def write_metrics(directory: str, index: int, text: str) -> None:
+    path = metrics_path(directory, index)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def read_metrics(directory: str, max_age: float) -> Dict[int, str]:
+    """exposition ล่าสุดของทุก worker (ไฟล์ที่ไม่ได้เขียนนานกว่า max_age = ช่องที่เลิกใช้แล้ว ข้าม)"""
+    texts: Dict[int, str] = {}
+    for name in os.listdir(directory):
+        if not (name.startswith("metrics-") and name.endswith(".prom")):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                continue
+            with open(path, encoding="utf-8") as f:
+                texts[int(name[len("metrics-"):-len(".prom")])] = f.read()
+        except (OSError, ValueError):
+            continue
+    return texts
+
+
+def _with_worker_label(sample: str, index: int) -> str:
+    label = f'worker="{index}"'
+    name_end = sample.find(" ")
+    brace = sample.find("{", 0, name_end)
+    if brace != -1:
+        return f"{sample[:brace + 1]}{label},{sample[brace + 1:]}"
+    return f"{sample[:name_end]}{{{label}}}{sample[name_end:]}"
+
+
+def merge_metrics(texts: Dict[int, str]) -> str:
+    """รวม exposition ของหลาย worker เป็นชุดเดียว (HELP/TYPE ครั้งเดียวต่อ metric, sample ได้ label worker)"""
+    families: Dict[str, list] = {}  # ชื่อ -> [บรรทัด HELP, บรรทัด TYPE, samples]
+    for index, text in sorted(texts.items()):
+        family: Optional[list] = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                family = families.setdefault(line.split(" ", 3)[2], [line, None, []])
+            elif line.startswith("# TYPE "):
+                if family is not None and family[1] is None:
+                    family[1] = line
+            elif line and family is not None:
+                family[2].append(_with_worker_label(line, index))
+    lines: List[str] = []
+    for help_line, type_line, samples in families.values():
+        lines.append(help_line)
+        if type_line:
+            lines.append(type_line)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
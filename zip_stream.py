@@ -0,0 +1,52 @@
+import time
+import zipfile
+
+# ---------------------------------------------------------
+# เขียน ZIP แบบ stream: zipfile เขียนลง buffer แบบ write-only (ไม่มี seek/tell)
+# จึงใช้ data descriptor แทนการย้อนกลับไปแก้ header
+# หลังเพิ่มแต่ละไฟล์ ให้ drain() เอา bytes ไปส่งต่อได้เลย ไม่ต้องถือทั้งไฟล์ไว้ใน RAM
+# ---------------------------------------------------------
+
+class _WriteOnlyBuffer:
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    def __init__(self):
+        self._buffer = _WriteOnlyBuffer()
+        # .docx บีบอัดมาแล้ว เก็บแบบ STORED ไม่ต้องเสีย CPU บีบซ้ำ
+        self._zip = zipfile.ZipFile(self._buffer, "w", compression=zipfile.ZIP_STORED)
+        self._names = set()
+
+    def add(self, name: str, data: bytes) -> bytes:
+        """เพิ่มไฟล์ (ชื่อซ้ำจะเติมเลขต่อท้าย) แล้วคืน bytes ของ ZIP ส่วนที่พร้อมส่ง"""
+        base, dot, ext = name.rpartition(".")
+        if not dot:
+            base, ext = name, ""
+        unique, n = name, 1
+        while unique in self._names:
+            n += 1
+            unique = f"{base}_{n}{dot}{ext}"
+        self._names.add(unique)
+
+        info = zipfile.ZipInfo(unique, date_time=time.localtime()[:6])
+        self._zip.writestr(info, data)
+        return self._buffer.drain()
+
+    def close(self) -> bytes:
+        """ปิดไฟล์ (เขียน central directory) แล้วคืน bytes ก้อนสุดท้าย"""
+        self._zip.close()
+        return self._buffer.drain()